@@ -0,0 +1,482 @@
+"""
+Replay benchmark for the Privacy Guard proxy addon.
+Feeds recorded or generated traffic through the proxy.py hooks without a
+network and reports per-stage latency, throughput and peak memory.
+
+    python benchmark.py [--flows capture.mitm | --har session.har | --synthetic 2000]
+                        [--rules rules/combined_rules.json] [--compare benchmarks/old.json]
+
+Results are saved as JSON under benchmarks/ so runs can be compared as the
+rule set or the code changes.
+"""
+
+import io
+import os
+import re
+import sys
+import gc
+import json
+import time
+import logging
+import base64
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import contextlib
+from collections import defaultdict
+from datetime import datetime
+from mitmproxy import connection, http
+from mitmproxy import io as flow_io
+from mitmproxy import version as mitmproxy_version
+
+# === Configuration ===
+RESULTS_DIR = "benchmarks"
+SYNTHETIC_FLOWS = 2000
+SYNTHETIC_SEED = 1
+REPEAT = 3  # Measured passes over the flows
+WARMUP = 1  # Unmeasured passes first (fills the host verdict cache)
+CHUNK_SIZE = 64 * 1024  # Bytes per chunk fed to streamed bodies, like mitmproxy's reads
+PERCENTILES = (50, 90, 99)
+
+# Sites the synthetic traffic is "visited" from
+SYNTHETIC_SITES = ["example-news.com", "example-shop.com", "example-blog.org", "example-video.net"]
+SYNTHETIC_EMAILS = ["jane.doe@example.com", "j.smith+promo@mail.example.org"]
+PIXEL_GIF = base64.b64decode("R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7")
+
+
+# === Loading traffic ===
+def make_flow(method, url, headers, content=b"", status=None, response_headers=None, response_content=b""):
+    """Build a detached HTTPFlow (no sockets) for replay"""
+    request = http.Request.make(method, url, content or b"", headers)
+    host = request.host
+    flow = http.HTTPFlow(
+        connection.Client(peername=("127.0.0.1", 50000), sockname=("127.0.0.1", 8080),
+                          timestamp_start=time.time()),
+        connection.Server(address=(host, request.port)),
+    )
+    flow.request = request
+    if status is not None:
+        flow.response = http.Response.make(status, response_content or b"", response_headers or {})
+    return flow
+
+
+def load_mitmproxy_flows(path):
+    """HTTP flows from a mitmdump / mitmweb capture (-w file)"""
+    with open(path, "rb") as f:
+        return [flow for flow in flow_io.FlowReader(f).stream() if isinstance(flow, http.HTTPFlow)]
+
+
+def _har_headers(entries):
+    # Pseudo-headers are HTTP/2 framing; bodies in a HAR are already decoded
+    return [(header["name"].encode("utf-8"), header["value"].encode("utf-8")) for header in entries
+            if not header["name"].startswith(":")
+            and header["name"].lower() not in ("content-length", "content-encoding", "transfer-encoding")]
+
+
+def load_har_flows(path):
+    """HTTP flows from a browser HAR export"""
+    with open(path, "r", encoding="utf-8") as f:
+        har = json.load(f)
+    flows = []
+    for entry in har.get("log", {}).get("entries", []):
+        request = entry["request"]
+        if not request["url"].startswith("http"):
+            continue
+        post_data = request.get("postData") or {}
+        content = post_data.get("text", "").encode("utf-8")
+        headers = _har_headers(request.get("headers", []))
+        if post_data.get("mimeType") and not any(name.lower() == b"content-type" for name, _ in headers):
+            headers.append((b"Content-Type", post_data["mimeType"].encode("utf-8")))
+        response = entry.get("response") or {}
+        body = response.get("content") or {}
+        response_content = body.get("text", "")
+        if body.get("encoding") == "base64":
+            response_content = base64.b64decode(response_content)
+        else:
+            response_content = response_content.encode("utf-8")
+        status = response.get("status") or None
+        flows.append(make_flow(request["method"], request["url"], headers, content,
+                               status, _har_headers(response.get("headers", [])), response_content))
+    return flows
+
+
+def synthetic_flows(rules, count=SYNTHETIC_FLOWS, seed=SYNTHETIC_SEED):
+    """A reproducible traffic mix built from the rule set's own tracker and whitelist domains"""
+    rng = random.Random(seed)
+    domain = re.compile(r"^[a-z0-9-]+(\.[a-z0-9-]+)+$")
+    trackers = sorted(name for name in rules.tracker_domains if domain.match(name))
+    whitelisted = sorted(name for name in rules.whitelist_domains if domain.match(name)) or ["localhost"]
+    if not trackers:
+        raise ValueError("rule set has no tracker domains to generate traffic from")
+
+    def page():
+        site = rng.choice(SYNTHETIC_SITES)
+        return site, {"Referer": f"https://www.{site}/article/{rng.randint(1, 500)}",
+                      "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) Firefox/128.0"}
+
+    flows = []
+    for i in range(count):
+        site, headers = page()
+        tracker = rng.choice(trackers)
+        email = rng.choice(SYNTHETIC_EMAILS)
+        roll = rng.random()
+        if roll < 0.35:
+            # Tracker beacon answered with a 1x1 pixel
+            url = f"https://{tracker}/collect?utm_source=news&utm_medium=email&cid={i}&v=2"
+            flows.append(make_flow("GET", url, headers, status=200,
+                                   response_headers={"Content-Type": "image/gif"}, response_content=PIXEL_GIF))
+        elif roll < 0.50:
+            # Tracker analytics POST carrying PII in JSON
+            body = json.dumps({"event": "signup", "user": {"email": email, "phone": "555-867-5309"},
+                               "items": [{"sku": f"SKU{i}", "qty": 1}], "page": headers["Referer"]}).encode()
+            flows.append(make_flow("POST", f"https://{tracker}/v1/events", dict(headers, **{
+                "Content-Type": "application/json"}), body, 204))
+        elif roll < 0.60:
+            body = f"email={email}&name=Jane+Doe&utm_campaign=spring&ref={i}".encode()
+            flows.append(make_flow("POST", f"https://{tracker}/form/submit", dict(headers, **{
+                "Content-Type": "application/x-www-form-urlencoded"}), body, 200))
+        elif roll < 0.68:
+            # Third-party script collecting a device profile
+            body = json.dumps({"canvas": "data:image/png;base64," + "A" * 2000, "webgl": "ANGLE (Intel)",
+                               "screen": "1920x1080", "timezone": "Europe/Berlin", "plugins": [],
+                               "hardwareConcurrency": 8, "fonts": ["Arial", "Helvetica"]}).encode()
+            flows.append(make_flow("POST", f"https://cdn{i % 7}.example-widgets.io/p", dict(headers, **{
+                "Content-Type": "application/json"}), body, 200))
+        elif roll < 0.73:
+            boundary = "----benchmark%d" % i
+            body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"email\"\r\n\r\n{email}\r\n"
+                    f"--{boundary}\r\nContent-Disposition: form-data; name=\"avatar\"; filename=\"a.png\"\r\n"
+                    f"Content-Type: image/png\r\n\r\n").encode() + rng.randbytes(4096) + f"\r\n--{boundary}--\r\n".encode()
+            flows.append(make_flow("POST", f"https://uploads.example-widgets.io/u/{i}", dict(headers, **{
+                "Content-Type": f"multipart/form-data; boundary={boundary}"}), body, 201))
+        elif roll < 0.85:
+            # First-party API call
+            flows.append(make_flow("POST", f"https://api.{site}/comments", dict(headers, **{
+                "Content-Type": "application/json"}), json.dumps({"text": "Nice read", "email": email}).encode(),
+                200, {"Content-Type": "application/json"}, b'{"ok":true}'))
+        elif roll < 0.90:
+            flows.append(make_flow("GET", f"https://{rng.choice(whitelisted)}/search?q=privacy", headers,
+                                   status=200, response_headers={"Content-Type": "text/html"},
+                                   response_content=b"<html>" + b"x" * 20000 + b"</html>"))
+        elif roll < 0.98:
+            # Third-party image of unknown length (counted while streamed)
+            flow = make_flow("GET", f"https://img.example-cdn.net/{i}.jpg", headers, status=200,
+                             response_headers={"Content-Type": "image/jpeg"}, response_content=rng.randbytes(30000))
+            del flow.response.headers["Content-Length"]
+            flows.append(flow)
+        elif roll < 0.99:
+            # Large upload: streamed through StreamingBodyScanner
+            body = (b"log line with nothing to see\n" * 40000) + f"contact={email}\n".encode()
+            flows.append(make_flow("POST", f"https://{tracker}/upload", dict(headers, **{
+                "Content-Type": "text/plain"}), body, 200))
+        else:
+            # Chunked upload without Content-Length
+            flow = make_flow("POST", f"https://{tracker}/stream", dict(headers, **{
+                "Content-Type": "application/x-www-form-urlencoded"}), f"email={email}&id={i}".encode(), 200)
+            del flow.request.headers["Content-Length"]
+            flow.request.headers["Transfer-Encoding"] = "chunked"
+            flows.append(flow)
+    return flows
+
+
+# === Measurement ===
+class StageTimer:
+    """Wraps detector functions and records their self time per flow.
+
+    Nested timed calls (match_tracker inside inspection_bypass) are charged
+    to the innermost stage only, so the stages of a flow add up.
+    """
+
+    def __init__(self):
+        self.samples = defaultdict(list)  # stage -> seconds per flow that ran it
+        self._flow = defaultdict(float)
+        self._stack = []
+        self.enabled = True
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            self._stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = self._stack.pop()
+                self._flow[stage] += elapsed - children
+                if self._stack:
+                    self._stack[-1] += elapsed
+        return timed
+
+    def end_flow(self):
+        if self.enabled:
+            for stage, seconds in self._flow.items():
+                self.samples[stage].append(seconds)
+        self._flow.clear()
+
+
+def summarize(samples):
+    """Latency summary in microseconds"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    summary = {"count": len(ordered), "mean_us": round(sum(ordered) / len(ordered) * 1e6, 2)}
+    for percentile in PERCENTILES:
+        index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+        summary[f"p{percentile}_us"] = round(ordered[index] * 1e6, 2)
+    summary["max_us"] = round(ordered[-1] * 1e6, 2)
+    summary["total_ms"] = round(sum(ordered) * 1e3, 3)
+    return summary
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == "darwin" else usage  # Bytes on macOS, KiB elsewhere
+
+
+def _feed(stream, body):
+    """Pass a body through a stream callable the way mitmproxy does, ending with b''"""
+    for offset in range(0, len(body), CHUNK_SIZE):
+        stream(body[offset:offset + CHUNK_SIZE])
+    stream(b"")
+
+
+def instrument(proxy, timer):
+    """Time the detectors proxy.py's hooks call (module functions and the rule set's methods)"""
+    rules = proxy.privacy_rules
+    proxy.inspection_bypass = timer.wrap("bypass_check", proxy.inspection_bypass)
+    proxy.match_tracker = timer.wrap("tracker_lookup", proxy.match_tracker)
+    proxy.log_event = timer.wrap("logging", proxy.log_event)
+    rules.detect_tracking_parameters = timer.wrap("tracking_params", rules.detect_tracking_parameters)
+    rules.inspect_pii = timer.wrap("pii_scan", rules.inspect_pii)
+    rules.detect_fingerprinting = timer.wrap("fingerprinting", rules.detect_fingerprinting)
+    rules.sanitize_request_body = timer.wrap("sanitize", rules.sanitize_request_body)
+    proxy.StreamingBodyScanner.__call__ = timer.wrap("stream_scan", proxy.StreamingBodyScanner.__call__)
+
+
+def replay(proxy, flows, timer, hook_samples, measured):
+    """Run every flow through the hooks once; returns (request bytes, seconds)"""
+    timer.enabled = measured
+    request_bytes = 0
+    started = time.perf_counter()
+    for original in flows:
+        flow = original.copy()
+        response = flow.response
+        flow.response = None  # Not there yet while the request hooks run
+        body = flow.request.raw_content or b""
+        request_bytes += len(body)
+        hooks = []
+
+        start = time.perf_counter()
+        proxy.requestheaders(flow)
+        hooks.append(("requestheaders", time.perf_counter() - start))
+        if callable(flow.request.stream):
+            start = time.perf_counter()
+            _feed(flow.request.stream, body)
+            hooks.append(("request_stream", time.perf_counter() - start))
+
+        start = time.perf_counter()
+        proxy.request(flow)
+        hooks.append(("request", time.perf_counter() - start))
+
+        if flow.response is None and response is not None:
+            flow.response = response
+            start = time.perf_counter()
+            proxy.responseheaders(flow)
+            hooks.append(("responseheaders", time.perf_counter() - start))
+            if callable(flow.response.stream):
+                start = time.perf_counter()
+                _feed(flow.response.stream, response.raw_content or b"")
+                hooks.append(("response_stream", time.perf_counter() - start))
+
+            start = time.perf_counter()
+            proxy.response(flow)
+            hooks.append(("response", time.perf_counter() - start))
+
+        if measured:
+            for hook, seconds in hooks:
+                hook_samples[hook].append(seconds)
+            hook_samples["total"].append(sum(seconds for _, seconds in hooks))
+        timer.end_flow()
+    return request_bytes, time.perf_counter() - started
+
+
+def load_proxy(rules_path, log_dir):
+    """Import proxy.py with its rules watcher stopped and events written to log_dir"""
+    os.environ.setdefault("PRIVACY_GUARD_METRICS_PORT", "0")  # Never clash with a running proxy
+    import proxy
+    from event_log import EventWriter, SegmentedEventLog
+    proxy.rules_watcher.stop()
+    proxy.event_writer.close()
+    proxy.event_writer = EventWriter(SegmentedEventLog(log_dir), max_queue=proxy.LOG_QUEUE_SIZE,
+                                     batch_size=proxy.LOG_BATCH_SIZE, flush_interval=proxy.LOG_FLUSH_INTERVAL)
+    if rules_path and os.path.abspath(rules_path) != os.path.abspath(proxy.privacy_rules.rules_path):
+        proxy.privacy_rules = proxy.PrivacyRules(rules_path)
+    return proxy
+
+
+def run_benchmark(proxy, flows, source, repeat=REPEAT, warmup=WARMUP, trace_memory=False):
+    rules = proxy.privacy_rules
+    timer = StageTimer()
+    instrument(proxy, timer)
+    hook_samples = defaultdict(list)
+
+    quiet = io.StringIO()
+    gc.collect()
+    rss_before = peak_rss_kb()
+    # Log records are formatted and written as usual, just not to the terminal
+    for handler in logging.getLogger("privacy_guard").handlers:
+        handler.setStream(quiet)
+    with contextlib.redirect_stdout(quiet):
+        for _ in range(warmup):
+            replay(proxy, flows, timer, hook_samples, measured=False)
+            quiet.seek(0)
+            quiet.truncate()
+        proxy.inspection_counts.clear()
+        if trace_memory:
+            tracemalloc.start()
+        request_bytes = seconds = 0
+        for _ in range(repeat):
+            pass_bytes, pass_seconds = replay(proxy, flows, timer, hook_samples, measured=True)
+            request_bytes += pass_bytes
+            seconds += pass_seconds
+            quiet.seek(0)
+            quiet.truncate()
+        traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    proxy.event_writer.close()
+
+    total_flows = len(flows) * repeat
+    writer_stats = proxy.event_writer.stats()
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "source": source,
+        "repeat": repeat,
+        "warmup": warmup,
+        "environment": {
+            "python": platform.python_version(),
+            "mitmproxy": mitmproxy_version.VERSION,
+            "platform": platform.platform(),
+        },
+        "rules": {
+            "path": rules.rules_path,
+            "tracker_domains": len(rules.tracker_domains),
+            "tracker_url_rules": len(rules.tracker_url_patterns),
+            "filters": len(rules.filter_engine),
+            "pii_regex_patterns": len(rules.pii_regex_patterns),
+            "fingerprinting_domains": len(rules.fingerprinting_domains),
+            "whitelist_domains": len(rules.whitelist_domains),
+        },
+        "throughput": {
+            "flows": total_flows,
+            "seconds": round(seconds, 4),
+            "flows_per_second": round(total_flows / seconds, 1) if seconds else None,
+            "request_mb_per_second": round(request_bytes / seconds / 1e6, 2) if seconds else None,
+        },
+        "hooks": {hook: summarize(samples) for hook, samples in sorted(hook_samples.items())},
+        "stages": {stage: summarize(samples) for stage, samples in sorted(timer.samples.items())},
+        "memory": {
+            "rss_before_kb": rss_before,
+            "peak_rss_kb": peak_rss_kb(),
+            "tracemalloc_peak_bytes": traced_peak,
+        },
+        "host_cache": rules.host_cache.stats(),
+        "inspection": dict(proxy.inspection_counts),
+        "events": {key: writer_stats[key] for key in ("written", "dropped", "errors")},
+    }
+
+
+# === Reporting ===
+def print_report(results, baseline=None):
+    def change(section, name, key):
+        if baseline is None:
+            return ""
+        old = baseline.get(section, {}).get(name, {}).get(key)
+        new = results[section][name].get(key)
+        if not old or new is None:
+            return ""
+        return f"  {key.split('_')[0]} {(new - old) / old * 100:+.1f}%"
+
+    if baseline is not None and baseline.get("source", {}).get("type") != results["source"]["type"]:
+        print(f"⚠️ Baseline replayed {baseline.get('source', {}).get('type')} traffic, this run "
+              f"{results['source']['type']}; latencies are not directly comparable")
+    throughput = results["throughput"]
+    print(f"🚀 {throughput['flows']} flows in {throughput['seconds']:.2f}s: "
+          f"{throughput['flows_per_second']} flows/s, {throughput['request_mb_per_second']} MB/s of request bodies")
+    if baseline is not None and baseline.get("throughput", {}).get("flows_per_second"):
+        old = baseline["throughput"]["flows_per_second"]
+        print(f"   vs baseline {old} flows/s ({(throughput['flows_per_second'] - old) / old * 100:+.1f}%)")
+    for section in ("hooks", "stages"):
+        print(f"\n⏱️ {section.capitalize()} (µs)   count      p50      p90      p99      max")
+        for name, summary in results[section].items():
+            if not summary["count"]:
+                continue
+            print(f"   {name:<16}{summary['count']:>7}{summary['p50_us']:>9.1f}{summary['p90_us']:>9.1f}"
+                  f"{summary['p99_us']:>9.1f}{summary['max_us']:>9.1f}"
+                  f"{change(section, name, 'p50_us')}{change(section, name, 'p99_us')}")
+    memory = results["memory"]
+    print(f"\n💾 Peak RSS {memory['peak_rss_kb'] / 1024:.1f} MB (before replay {memory['rss_before_kb'] / 1024:.1f} MB)"
+          + (f", traced peak {memory['tracemalloc_peak_bytes'] / 1e6:.1f} MB"
+             if memory["tracemalloc_peak_bytes"] is not None else ""))
+    cache = results["host_cache"]
+    print(f"🗂️ Host verdict cache: {cache['hits']} hits, {cache['misses']} misses")
+    print(f"📝 Events: {results['events']['written']} written, {results['events']['dropped']} dropped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay traffic through the Privacy Guard proxy hooks")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--flows", help="mitmproxy capture (mitmdump -w) to replay")
+    source.add_argument("--har", help="HAR export to replay")
+    source.add_argument("--synthetic", type=int, metavar="N", help=f"generate N flows (default {SYNTHETIC_FLOWS})")
+    parser.add_argument("--seed", type=int, default=SYNTHETIC_SEED)
+    parser.add_argument("--rules", default=None, help="rules JSON (default: proxy.py's RULES_PATH)")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--warmup", type=int, default=WARMUP)
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="also trace Python allocations (slows the replay down)")
+    parser.add_argument("--output", help=f"results file (default: {RESULTS_DIR}/<time>-<source>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="privacy-guard-bench-") as log_dir:
+        proxy = load_proxy(args.rules, log_dir)
+        if args.flows:
+            flows = load_mitmproxy_flows(args.flows)
+            source = {"type": "mitmproxy", "path": args.flows}
+        elif args.har:
+            flows = load_har_flows(args.har)
+            source = {"type": "har", "path": args.har}
+        else:
+            count = args.synthetic or SYNTHETIC_FLOWS
+            flows = synthetic_flows(proxy.privacy_rules, count, args.seed)
+            source = {"type": "synthetic", "seed": args.seed}
+        if not flows:
+            print("⚠️ No HTTP flows to replay")
+            return 1
+        source["flows"] = len(flows)
+        print(f"🔁 Replaying {len(flows)} {source['type']} flows "
+              f"({args.warmup} warmup + {args.repeat} measured passes)")
+        results = run_benchmark(proxy, flows, source, args.repeat, args.warmup, args.tracemalloc)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{source['type']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results saved to {output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Content-type aware request body parsers for Privacy Guard.
+Expose the (key, value) leaves of structured bodies so PII checks look at
+field names and string values instead of the raw serialized text.
+"""
+
+import re
+import json
+import urllib.parse
+
+# Bodies that are never scanned: media, archives, fonts, protobuf / gRPC
+BINARY_CONTENT_TYPES = (
+    "image/", "video/", "audio/", "font/", "application/octet-stream", "application/zip",
+    "application/gzip", "application/pdf", "application/wasm", "application/x-protobuf",
+    "application/protobuf", "application/grpc",
+)
+
+
+class BodyParser:
+    """A body format. leaves() yields (key, value) pairs, where value is the
+    string leaf or None for leaves that are not text (numbers, files); rewrite()
+    rebuilds the body with replace(key, value) applied to every leaf."""
+
+    def handles(self, content_type):
+        raise NotImplementedError
+
+    def leaves(self, body, content_type):
+        raise NotImplementedError
+
+    def rewrite(self, body, content_type, replace):
+        return body
+
+
+class SkipBodyParser(BodyParser):
+    """Binary formats (protobuf, media, archives): nothing to inspect"""
+
+    def handles(self, content_type):
+        return content_type.startswith(BINARY_CONTENT_TYPES)
+
+    def leaves(self, body, content_type):
+        return iter(())
+
+
+class JsonBodyParser(BodyParser):
+    """application/json and +json bodies; list items take their parent's key"""
+
+    def handles(self, content_type):
+        media_type = content_type.split(";")[0].strip()
+        return media_type in ("application/json", "text/json") or media_type.endswith("+json")
+
+    def leaves(self, body, content_type):
+        stack = [("", json.loads(body))]
+        while stack:
+            key, node = stack.pop()
+            if isinstance(node, dict):
+                stack.extend(reversed(list(node.items())))
+            elif isinstance(node, list):
+                stack.extend((key, item) for item in reversed(node))
+            else:
+                yield key, node if isinstance(node, str) else None
+
+    def rewrite(self, body, content_type, replace):
+        def walk(key, node):
+            if isinstance(node, dict):
+                return {k: walk(k, v) for k, v in node.items()}
+            if isinstance(node, list):
+                return [walk(key, item) for item in node]
+            new_value = replace(key, node if isinstance(node, str) else None)
+            return node if new_value is None else new_value
+        document = walk("", json.loads(body))
+        return json.dumps(document, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+class FormBodyParser(BodyParser):
+    """application/x-www-form-urlencoded bodies"""
+
+    def handles(self, content_type):
+        return "application/x-www-form-urlencoded" in content_type
+
+    def leaves(self, body, content_type):
+        text = body.decode("utf-8", errors="ignore")
+        return iter(urllib.parse.parse_qsl(text, keep_blank_values=True))
+
+    def rewrite(self, body, content_type, replace):
+        text = body.decode("utf-8", errors="ignore")
+        fields = []
+        for key, value in urllib.parse.parse_qsl(text, keep_blank_values=True):
+            new_value = replace(key, value)
+            fields.append((key, value if new_value is None else new_value))
+        return urllib.parse.urlencode(fields).encode("utf-8")
+
+
+class MultipartBodyParser(BodyParser):
+    """multipart/form-data bodies; file parts only contribute their field name
+    and are passed through rewrite() untouched"""
+
+    _NAME = re.compile(rb'\bname="([^"]*)"', re.IGNORECASE)
+
+    def handles(self, content_type):
+        return content_type.startswith("multipart/form-data")
+
+    def _parts(self, body, content_type):
+        """Return (delimiter, preamble, [(headers, content)], epilogue)"""
+        match = re.search(r'boundary="?([^";]+)"?', content_type, re.IGNORECASE)
+        if not match:
+            raise ValueError("multipart body without boundary")
+        # Boundaries are case-sensitive but callers may pass a lowercased
+        # Content-Type, so take the delimiter's spelling from the body
+        delimiter = b"--" + match.group(1).encode("latin-1")
+        start = body.lower().find(delimiter.lower())
+        if start < 0:
+            raise ValueError("multipart boundary not found in body")
+        delimiter = body[start:start + len(delimiter)]
+        chunks = body.split(delimiter)
+        parts = []
+        for chunk in chunks[1:-1]:
+            head, separator, content = chunk.partition(b"\r\n\r\n")
+            if not separator:
+                raise ValueError("malformed multipart part")
+            parts.append((head, content[:-2] if content.endswith(b"\r\n") else content))
+        return delimiter, chunks[0], parts, chunks[-1]
+
+    def _field(self, head):
+        name = self._NAME.search(head)
+        head_lower = head.lower()
+        is_file = b"filename=" in head_lower or (b"content-type:" in head_lower and b"text/" not in head_lower)
+        return (name.group(1).decode("utf-8", errors="ignore") if name else ""), is_file
+
+    def leaves(self, body, content_type):
+        _, _, parts, _ = self._parts(body, content_type)
+        for head, content in parts:
+            key, is_file = self._field(head)
+            yield key, None if is_file else content.decode("utf-8", errors="ignore")
+
+    def rewrite(self, body, content_type, replace):
+        delimiter, preamble, parts, epilogue = self._parts(body, content_type)
+        rebuilt = [preamble]
+        for head, content in parts:
+            key, is_file = self._field(head)
+            # File parts are never rewritten, whatever their field name
+            new_value = None if is_file else replace(key, content.decode("utf-8", errors="ignore"))
+            if new_value is not None:
+                content = new_value.encode("utf-8")
+            rebuilt.append(head + b"\r\n\r\n" + content + b"\r\n")
+        rebuilt.append(epilogue)
+        return delimiter.join(rebuilt)
+
+
+# First parser whose handles() accepts the content type wins
+BODY_PARSERS = [SkipBodyParser(), JsonBodyParser(), MultipartBodyParser(), FormBodyParser()]
+
+
+def register_body_parser(parser):
+    """Add a parser ahead of the built-in ones"""
+    BODY_PARSERS.insert(0, parser)
+
+
+def get_body_parser(content_type):
+    """Parser for a lowercased Content-Type, or None to treat the body as raw text"""
+    for parser in BODY_PARSERS:
+        if parser.handles(content_type):
+            return parser
+    return None
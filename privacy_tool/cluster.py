@@ -0,0 +1,255 @@
+"""
+Multi-process proxy mode for Privacy Guard.
+Runs several `mitmdump -s proxy.py` workers behind one listening port and
+collects their events into a single log.
+
+    python cluster.py --workers 4 [-- extra mitmdump options]
+
+Browsers keep using localhost:8080. Each client connection is relayed to
+the worker with the fewest open connections. Workers map the same
+precompiled rules artifact (rules/combined_rules.idx), so the tracker
+domain table is shared through the page cache instead of being copied
+into every process.
+"""
+
+import os
+import sys
+import time
+import shutil
+import signal
+import asyncio
+import argparse
+import subprocess
+from rule_index import artifact_is_current, write_rules_artifact
+from event_log import EventCollector, EventWriter, SegmentedEventLog
+from event_store import EventStore, SQLiteEventWriter
+import metrics
+
+# === Configuration ===
+RULES_PATH = "rules/combined_rules.json"
+PROXY_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy.py")
+LISTEN_HOST = "127.0.0.1"
+LISTEN_PORT = 8080  # The port browsers are configured with
+WORKER_HOST = "127.0.0.1"
+WORKER_BASE_PORT = 8090  # Workers listen on WORKER_BASE_PORT + 1 .. + N
+WORKER_COUNT = os.cpu_count() or 2
+WORKER_RESTART_DELAY = 2.0  # Seconds before a crashed worker is restarted
+RELAY_BUFFER_SIZE = 64 * 1024
+RULES_POLL_INTERVAL = 5.0  # Seconds between checks of the rules file, as in proxy.py
+# Log settings, as in proxy.py
+LOG_PATH = "logs/events.json"
+LOG_DIR = "logs/events"
+LOG_RETENTION_HOURS = 24 * 7
+LOG_COMPACT_AFTER_HOURS = 48
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 1.0  # Seconds; workers hold events at most this long before sending (proxy.py)
+LOG_REORDER_SLACK = 0.5  # Seconds allowed for a sent batch to reach the collector
+# Seconds events wait so workers' events merge in time order: longer than a
+# worker can hold an older event, so it always arrives before newer ones are written
+LOG_REORDER_DELAY = LOG_FLUSH_INTERVAL + LOG_REORDER_SLACK
+EVENT_DB_PATH = os.environ.get("PRIVACY_GUARD_EVENT_DB")
+# The launcher serves collector metrics here; worker i serves its own on METRICS_PORT + 1 + i
+METRICS_PORT = int(os.environ.get("PRIVACY_GUARD_METRICS_PORT", "9464"))
+
+
+def prepare_rules_artifact(rules_path=RULES_PATH):
+    """Build the rules artifact unless it matches the rules file, so workers map it instead of each compiling the JSON"""
+    if not artifact_is_current(rules_path):
+        print("🔨 Building rules artifact for the workers...")
+        write_rules_artifact(rules_path)
+
+
+def rules_signature(rules_path):
+    try:
+        stat = os.stat(rules_path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+async def keep_rules_artifact_current(rules_path=RULES_PATH, interval=RULES_POLL_INTERVAL):
+    """Rebuild the artifact when the rules file changes without one (e.g. edited by hand).
+
+    Workers never write the artifact; their watchers wait for this one. The
+    updater publishes the artifact before the JSON, so its runs are left alone.
+    """
+    signature = rules_signature(rules_path)
+    while True:
+        await asyncio.sleep(interval)
+        current = rules_signature(rules_path)
+        if current is None or current == signature:
+            continue
+        try:
+            await asyncio.to_thread(prepare_rules_artifact, rules_path)
+            signature = current
+        except Exception as e:
+            print(f"⚠️ Could not rebuild rules artifact: {e}")
+
+
+class WorkerPool:
+    """Starts the mitmdump workers and restarts any that exit"""
+
+    def __init__(self, count, collector_address, extra_args=()):
+        self.ports = [WORKER_BASE_PORT + i + 1 for i in range(count)]
+        self.collector_address = collector_address
+        self.extra_args = list(extra_args)
+        self.processes = {}
+        self.mitmdump = shutil.which("mitmdump")
+        if self.mitmdump is None:
+            raise FileNotFoundError("mitmdump not found on PATH (pip install mitmproxy)")
+
+    def start_worker(self, index, port):
+        env = dict(os.environ)
+        env["PRIVACY_GUARD_EVENT_COLLECTOR"] = f"{self.collector_address[0]}:{self.collector_address[1]}"
+        env["PRIVACY_GUARD_WORKER"] = str(index)
+        command = [self.mitmdump, "-q", "-s", PROXY_SCRIPT, "--listen-host", WORKER_HOST,
+                   "--listen-port", str(port)] + self.extra_args
+        self.processes[port] = subprocess.Popen(command, env=env)
+        print(f"👷 Worker {index} started on port {port} (pid {self.processes[port].pid})")
+
+    def start(self):
+        for index, port in enumerate(self.ports):
+            self.start_worker(index, port)
+
+    async def supervise(self):
+        while True:
+            await asyncio.sleep(WORKER_RESTART_DELAY)
+            for index, port in enumerate(self.ports):
+                code = self.processes[port].poll()
+                if code is not None:
+                    print(f"⚠️ Worker {index} on port {port} exited with code {code}, restarting")
+                    self.start_worker(index, port)
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class ConnectionDistributor:
+    """Relays each client connection to the least busy worker.
+
+    Proxy clients keep connections alive for many requests, so balancing
+    connections (not requests) spreads the load without parsing HTTP;
+    TLS is still terminated by the worker.
+    """
+
+    def __init__(self, ports):
+        self.active = {port: 0 for port in ports}
+        self.connections = 0
+
+    async def handle(self, client_reader, client_writer):
+        self.connections += 1
+        # Least connections first; fall through to the next worker if one is restarting
+        for port in sorted(self.active, key=self.active.get):
+            try:
+                worker_reader, worker_writer = await asyncio.open_connection(WORKER_HOST, port)
+            except OSError:
+                continue
+            self.active[port] += 1
+            try:
+                await asyncio.gather(_relay(client_reader, worker_writer),
+                                     _relay(worker_reader, client_writer))
+            finally:
+                self.active[port] -= 1
+                worker_writer.close()
+                client_writer.close()
+            return
+        client_writer.close()
+
+
+async def _relay(reader, writer):
+    """Copy one direction of a connection; half-close on EOF, close on error"""
+    try:
+        while True:
+            data = await reader.read(RELAY_BUFFER_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        # Closing this side ends the other direction's read as well
+        writer.close()
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+async def serve(pool, listen_host, listen_port):
+    distributor = ConnectionDistributor(pool.ports)
+    metrics.gauge("privacy_guard_worker_connections", "Open client connections per worker", ["port"],
+                  callback=lambda: {(str(port),): count for port, count in distributor.active.items()})
+    server = await asyncio.start_server(distributor.handle, listen_host, listen_port)
+    print(f"🚦 Distributing {listen_host}:{listen_port} across {len(pool.ports)} workers")
+    async with server:
+        await asyncio.gather(server.serve_forever(), pool.supervise(), keep_rules_artifact_current())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Privacy Guard as several mitmdump workers")
+    parser.add_argument("--workers", type=int, default=WORKER_COUNT)
+    parser.add_argument("--listen-host", default=LISTEN_HOST)
+    parser.add_argument("--listen-port", type=int, default=LISTEN_PORT)
+    parser.add_argument("mitmdump_args", nargs=argparse.REMAINDER,
+                        help="extra options passed to every worker (after --)")
+    args = parser.parse_args()
+    extra_args = args.mitmdump_args[1:] if args.mitmdump_args[:1] == ["--"] else args.mitmdump_args
+
+    prepare_rules_artifact()
+
+    # The only process that writes the event log
+    if EVENT_DB_PATH:
+        writer = SQLiteEventWriter(EventStore(EVENT_DB_PATH, retention_hours=LOG_RETENTION_HOURS),
+                                   max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                                   flush_interval=LOG_FLUSH_INTERVAL)
+    else:
+        event_log = SegmentedEventLog(LOG_DIR, retention_hours=LOG_RETENTION_HOURS,
+                                      compact_after_hours=LOG_COMPACT_AFTER_HOURS, legacy_path=LOG_PATH)
+        writer = EventWriter(event_log, max_queue=LOG_QUEUE_SIZE,
+                             batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL)
+    collector = EventCollector(writer, reorder_delay=LOG_REORDER_DELAY)
+    metrics.counter("privacy_guard_collector_events_received_total", "Events received from workers",
+                    callback=lambda: collector.received)
+
+    def event_counts():
+        stats = writer.stats()
+        return {("written",): stats["written"], ("dropped",): stats["dropped"], ("error",): stats["errors"]}
+
+    metrics.counter("privacy_guard_events_total", "Collected events handed to the log writer, by outcome",
+                    ["result"], callback=event_counts)
+    metrics.gauge("privacy_guard_event_queue_depth", "Events waiting for the log writer",
+                  callback=lambda: writer.stats()["queued"])
+    if METRICS_PORT:
+        try:
+            metrics.start_metrics_server(METRICS_PORT)
+        except OSError as e:
+            print(f"⚠️ Metrics endpoint unavailable on port {METRICS_PORT}: {e}")
+
+    pool = WorkerPool(args.workers, collector.address, extra_args)
+    pool.start()
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        asyncio.run(serve(pool, args.listen_host, args.listen_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("🛑 Stopping workers...")
+        pool.stop()
+        # Workers flush their queued events on exit; give them a moment to arrive
+        time.sleep(LOG_FLUSH_INTERVAL)
+        collector.close()
+        stats = writer.stats()
+        print(f"📝 Collected {collector.received} events: {stats['written']} written, "
+              f"{stats['dropped']} dropped, {stats['errors']} failed")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,509 @@
+"""
+Event log storage for Privacy Guard.
+Keeps file I/O off the proxy's request path.
+"""
+
+import os
+import json
+import heapq
+import itertools
+import queue
+import shutil
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+import metrics
+
+_STOP = object()
+
+LOG_FLUSH_SECONDS = metrics.histogram("privacy_guard_log_flush_seconds",
+                                      "Time to write one batch of events", ["writer"])
+
+HOURLY_FORMAT = "events_%Y%m%d_%H.json"
+DAILY_FORMAT = "events_%Y%m%d.json"
+
+
+def parse_event_time(timestamp):
+    """Parse an event timestamp into a naive local datetime"""
+    event_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if event_time.tzinfo is not None:
+        event_time = event_time.astimezone().replace(tzinfo=None)
+    return event_time
+
+
+def _segment_range(filename):
+    """Return the (start, end) datetimes covered by a segment file name"""
+    for name_format, length in ((HOURLY_FORMAT, timedelta(hours=1)), (DAILY_FORMAT, timedelta(days=1))):
+        try:
+            start = datetime.strptime(filename, name_format)
+        except ValueError:
+            continue
+        return start, start + length
+    return None
+
+
+class SegmentedEventLog:
+    """Event log stored as hourly JSON-lines segment files.
+
+    Events go to the segment for the hour of their timestamp
+    (events_YYYYMMDD_HH.json). manifest.json records the time range of every
+    segment so readers only open segments overlapping the window they need.
+
+    Maintenance runs whenever a new segment is started: segments that ended
+    more than retention_hours ago are deleted, and hourly segments of days
+    older than compact_after_hours are merged into one daily segment
+    (events_YYYYMMDD.json). A pre-segmentation events.json passed as
+    legacy_path is registered with its own time range and read in place;
+    retention never deletes it.
+    """
+
+    MANIFEST = "manifest.json"
+    LOCK = "maintenance.lock"
+
+    def __init__(self, directory, retention_hours=24 * 7, compact_after_hours=48, legacy_path=None):
+        self.directory = directory
+        self.retention_hours = retention_hours
+        self.compact_after_hours = compact_after_hours
+        self.legacy_path = legacy_path
+        self._lock = threading.RLock()
+        self._manifest = None
+        self._known_segments = set()
+
+    # --- Writing ---
+
+    def segment_path_for(self, event):
+        """Return the segment file an event belongs in, registering new segments"""
+        try:
+            event_time = parse_event_time(event["timestamp"])
+        except Exception:
+            event_time = datetime.now()
+        filename = event_time.strftime(HOURLY_FORMAT)
+        if filename not in self._known_segments:
+            self._register(filename)
+        return os.path.join(self.directory, filename)
+
+    def append(self, events):
+        """Synchronously append events to their segments"""
+        lines_by_path = {}
+        for event in events:
+            lines_by_path.setdefault(self.segment_path_for(event), []).append(json.dumps(event) + "\n")
+        for path, lines in lines_by_path.items():
+            with open(path, "a") as f:
+                f.write("".join(lines))
+
+    def clear(self):
+        """Delete every segment, the manifest and the legacy log"""
+        with self._lock:
+            for segment in self.segments():
+                _remove(segment["path"])
+            _remove(os.path.join(self.directory, self.MANIFEST))
+            if self.legacy_path:
+                _remove(self.legacy_path)
+            self._manifest = None
+            self._known_segments = set()
+
+    # --- Reading ---
+
+    def segments(self, start=None, end=None):
+        """List segments overlapping [start, end) as dicts with path, start and end datetimes"""
+        with self._lock:
+            manifest = self._load_manifest()
+            selected = []
+            for filename, entry in manifest.items():
+                seg_start = datetime.fromisoformat(entry["start"])
+                seg_end = datetime.fromisoformat(entry["end"])
+                if start is not None and seg_end <= start:
+                    continue
+                if end is not None and seg_start >= end:
+                    continue
+                selected.append({"path": os.path.join(self.directory, filename),
+                                 "start": seg_start, "end": seg_end})
+            return sorted(selected, key=lambda segment: segment["start"])
+
+    def read_events(self, start=None, end=None):
+        """Yield parsed events from segments overlapping [start, end), oldest first"""
+        for segment in self.segments(start, end):
+            try:
+                with open(segment["path"], "r") as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line.strip())
+                        except ValueError:
+                            continue
+            except FileNotFoundError:
+                continue
+
+    # --- Manifest ---
+
+    def _load_manifest(self):
+        """Load the manifest and reconcile it with the segment files on disk"""
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.directory, self.MANIFEST), "r") as f:
+                    self._manifest = json.load(f).get("segments", {})
+            except (FileNotFoundError, ValueError):
+                self._manifest = {}
+
+        changed = False
+        on_disk = set(os.listdir(self.directory)) if os.path.isdir(self.directory) else set()
+        for filename in list(self._manifest):
+            if not os.path.exists(os.path.join(self.directory, filename)):
+                del self._manifest[filename]
+                changed = True
+        # Segments created by another process (proxy vs API server)
+        for filename in on_disk:
+            if filename not in self._manifest:
+                seg_range = _segment_range(filename)
+                if seg_range:
+                    self._manifest[filename] = {"start": seg_range[0].isoformat(),
+                                                "end": seg_range[1].isoformat()}
+                    changed = True
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            legacy = os.path.relpath(self.legacy_path, self.directory)
+            if legacy not in self._manifest:
+                seg_range = _scan_time_range(self.legacy_path)
+                if seg_range:
+                    self._manifest[legacy] = {"start": seg_range[0].isoformat(),
+                                              "end": seg_range[1].isoformat()}
+                    changed = True
+
+        self._known_segments = set(self._manifest)
+        if changed:
+            self._save_manifest()
+        return self._manifest
+
+    def _save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.MANIFEST)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segments": self._manifest}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def _register(self, filename):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            open(os.path.join(self.directory, filename), "a").close()
+            self._load_manifest()
+        self.maintain()
+
+    # --- Maintenance ---
+
+    def maintain(self):
+        """Apply retention and compaction; skipped if another process holds the lock"""
+        lock_path = os.path.join(self.directory, self.LOCK)
+        try:
+            # Clear a lock left behind by a crashed process
+            if time.time() - os.path.getmtime(lock_path) > 600:
+                _remove(lock_path)
+        except OSError:
+            pass
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return
+        try:
+            with self._lock:
+                self._apply_retention()
+                self._compact()
+        except Exception as e:
+            print(f"Log maintenance failed: {e}")
+        finally:
+            os.close(fd)
+            _remove(lock_path)
+
+    def _apply_retention(self):
+        if not self.retention_hours:
+            return
+        cutoff = datetime.now() - timedelta(hours=self.retention_hours)
+        for segment in self.segments(end=cutoff):
+            if segment["end"] <= cutoff and _segment_range(os.path.basename(segment["path"])):
+                _remove(segment["path"])
+                print(f"🗑️ Removed expired log segment: {os.path.basename(segment['path'])}")
+        self._load_manifest()
+
+    def _compact(self):
+        if not self.compact_after_hours:
+            return
+        cutoff = datetime.now() - timedelta(hours=self.compact_after_hours)
+        hourly_by_day = {}
+        for segment in self.segments(end=cutoff):
+            filename = os.path.basename(segment["path"])
+            if segment["end"] <= cutoff and _segment_range(filename) and \
+                    segment["end"] - segment["start"] == timedelta(hours=1):
+                hourly_by_day.setdefault(segment["start"].date(), []).append(segment["path"])
+
+        for day, paths in hourly_by_day.items():
+            daily_path = os.path.join(self.directory, day.strftime(DAILY_FORMAT))
+            tmp_path = f"{daily_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as out:
+                for path in ([daily_path] if os.path.exists(daily_path) else []) + sorted(paths):
+                    with open(path, "r") as f:
+                        shutil.copyfileobj(f, out)
+            os.replace(tmp_path, daily_path)
+            for path in paths:
+                _remove(path)
+            print(f"📦 Compacted {len(paths)} log segments into {os.path.basename(daily_path)}")
+        self._load_manifest()
+
+
+def _scan_time_range(path):
+    """Return (first, last) event times of a JSON-lines log, or None"""
+    first = last = None
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    event_time = parse_event_time(json.loads(line)["timestamp"])
+                except Exception:
+                    continue
+                first = event_time if first is None else min(first, event_time)
+                last = event_time if last is None else max(last, event_time)
+    except FileNotFoundError:
+        return None
+    if first is None:
+        return None
+    return first, last + timedelta(microseconds=1)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class EventWriter:
+    """Background writer that appends events to a SegmentedEventLog.
+
+    write() only enqueues the event. A daemon thread drains the bounded
+    queue and writes in batches (every batch_size events or flush_interval
+    seconds, whichever comes first) through one open handle on the current
+    segment.
+
+    Backpressure policy: write() never blocks. When the queue is full the
+    new event is dropped and counted in ``dropped``.
+    """
+
+    def __init__(self, event_log, max_queue=10000, batch_size=100, flush_interval=1.0):
+        self.event_log = event_log
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._file = None
+        self._file_path = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, event):
+        """Queue an event for writing; returns False if it was dropped"""
+        if not self._closed:
+            try:
+                self._queue.put_nowait(event)
+                return True
+            except queue.Full:
+                pass
+        with self._lock:
+            self.dropped += 1
+        return False
+
+    def stats(self):
+        """Return writer counters"""
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "errors": self.errors,
+        }
+
+    def close(self, timeout=5.0):
+        """Flush queued events, stop the writer thread and close the file"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = self.flush_interval if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._timed_flush(batch)
+                self._close_file()
+                return
+
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._timed_flush(batch)
+                batch = []
+
+    def _timed_flush(self, batch):
+        if not batch:
+            return
+        start = time.perf_counter()
+        self._flush(batch)
+        LOG_FLUSH_SECONDS.observe(time.perf_counter() - start, type(self).__name__)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        lines_by_path = {}
+        for event in batch:
+            lines_by_path.setdefault(self.event_log.segment_path_for(event), []).append(event)
+        for path, events in lines_by_path.items():
+            try:
+                f = self._open_file(path)
+                f.write("".join(json.dumps(event) + "\n" for event in events))
+                f.flush()
+                self.written += len(events)
+            except Exception as e:
+                print(f"Logging failed: {e}")
+                self.errors += len(events)
+                self._close_file()
+        self.batches += 1
+
+    def _open_file(self, path):
+        # Switch segments on rollover; reopen if the segment was removed
+        # underneath us (e.g. the API's /clear)
+        if self._file is not None and (path != self._file_path or not os.path.exists(path)):
+            self._close_file()
+        if self._file is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._file = open(path, "a")
+            self._file_path = path
+        return self._file
+
+    def _close_file(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+            self._file_path = None
+
+
+class RemoteEventWriter(EventWriter):
+    """EventWriter for proxy workers: ships batches to an EventCollector.
+
+    Same queueing, batching and drop policy as EventWriter, but each batch
+    is sent as JSON lines over a local TCP connection instead of being
+    appended to a segment, so only the collector process writes the log.
+    """
+
+    def __init__(self, address, max_queue=10000, batch_size=100, flush_interval=1.0):
+        self.address = address
+        self._socket = None
+        super().__init__(None, max_queue=max_queue, batch_size=batch_size, flush_interval=flush_interval)
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        data = "".join(json.dumps(event) + "\n" for event in batch).encode("utf-8")
+        try:
+            if self._socket is None:
+                self._socket = socket.create_connection(self.address, timeout=5.0)
+            self._socket.sendall(data)
+            self.written += len(batch)
+        except OSError as e:
+            print(f"Logging failed: {e}")
+            self.errors += len(batch)
+            self._close_file()  # Reconnect on the next batch
+        self.batches += 1
+
+    def _close_file(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+
+
+class _CollectorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            self.server.collector.add(event)
+
+
+class EventCollector:
+    """Merges events sent by RemoteEventWriters into one EventWriter.
+
+    Each worker's events arrive in order, but batches from different
+    workers interleave. Events are held in a heap for reorder_delay seconds
+    after arrival and released oldest timestamp first, so the single log
+    stays ordered by time across workers. reorder_delay must exceed the
+    senders' flush interval (plus delivery time), the longest a worker can
+    hold an event back.
+    """
+
+    def __init__(self, writer, host="127.0.0.1", port=0, reorder_delay=1.5):
+        self.writer = writer
+        self.reorder_delay = reorder_delay
+        self.received = 0
+        self._heap = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = socketserver.ThreadingTCPServer((host, port), _CollectorHandler)
+        self._server.daemon_threads = True
+        self._server.collector = self
+        self.address = self._server.server_address
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name="event-collector", daemon=True),
+            threading.Thread(target=self._run, name="event-collector-release", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def add(self, event):
+        with self._lock:
+            heapq.heappush(self._heap, (str(event.get("timestamp", "")), next(self._sequence),
+                                        time.monotonic(), event))
+            self.received += 1
+
+    def _release(self, everything=False):
+        cutoff = time.monotonic() - self.reorder_delay
+        with self._lock:
+            while self._heap and (everything or self._heap[0][2] <= cutoff):
+                self.writer.write(heapq.heappop(self._heap)[3])
+
+    def _run(self):
+        while not self._stop.wait(self.reorder_delay / 2):
+            self._release()
+
+    def close(self, timeout=5.0):
+        """Stop accepting events, release the held ones and close the writer"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._stop.set()
+        self._threads[1].join(timeout)
+        self._release(everything=True)
+        self.writer.close(timeout)
@@ -0,0 +1,303 @@
+"""
+SQLite event store for Privacy Guard.
+Optional replacement for the JSON-lines log segments: events are indexed
+by site, time and hostname so the API answers with queries, not scans.
+
+    python event_store.py [--db logs/events.db] [log files...]
+
+imports existing events.json logs (and the hourly segments); running it again
+adds only the lines written since.
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from event_log import EventWriter, SegmentedEventLog, parse_event_time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    epoch REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    visited_site TEXT NOT NULL,
+    hostname TEXT NOT NULL,
+    hostname_rev TEXT NOT NULL,
+    session TEXT NOT NULL,
+    type TEXT NOT NULL,
+    detail TEXT NOT NULL,
+    tracker INTEGER NOT NULL,
+    pii INTEGER NOT NULL,
+    pii_types TEXT NOT NULL,
+    fingerprinting INTEGER NOT NULL,
+    storage INTEGER NOT NULL,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_site_time ON events (visited_site, epoch);
+CREATE INDEX IF NOT EXISTS events_hostname ON events (hostname_rev);
+CREATE INDEX IF NOT EXISTS events_time ON events (epoch);
+CREATE TABLE IF NOT EXISTS imports (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,  -- Bytes imported so far (complete lines only)
+    events INTEGER NOT NULL
+);
+"""
+
+_INSERT = ("INSERT INTO events (epoch, timestamp, visited_site, hostname, hostname_rev, session, type, "
+           "detail, tracker, pii, pii_types, fingerprinting, storage, event) "
+           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+IMPORT_BATCH_SIZE = 1000
+PRUNE_INTERVAL = 3600  # Seconds between retention passes
+
+
+def normalize_event(event):
+    """Normalize events from different sources (proxy vs extension)"""
+    normalized = {
+        "timestamp": event.get("timestamp", datetime.now().isoformat()),
+        "visited_site": event.get("visited_site", event.get("url", "unknown")).lower().strip(),
+        "hostname": event.get("hostname", event.get("url", "unknown")).lower(),
+        "session": event.get("session", ""),
+        "tracker": event.get("tracker", False),
+        "pii": event.get("pii", False),
+        "pii_types": event.get("pii_types", []),
+        "fingerprinting": event.get("fingerprinting", False),
+        "storage": event.get("storage", False),
+        "source": event.get("source", "extension"),
+        "detail": event.get("detail", ""),
+        "type": event.get("type", "")
+    }
+
+    # Handle extension-specific event types
+    if normalized["type"] == "fingerprinting":
+        normalized["fingerprinting"] = True
+    elif normalized["type"] == "storage":
+        normalized["storage"] = True
+    elif normalized["type"] == "pii":
+        normalized["pii"] = True
+
+    # Clean up visited_site
+    if normalized["visited_site"].startswith("www."):
+        normalized["visited_site"] = normalized["visited_site"][4:]
+
+    return normalized
+
+
+def _host_range(name):
+    """Bounds of hostname_rev values for subdomains of name"""
+    prefix = name[::-1] + "."
+    return prefix, prefix[:-1] + "/"  # '/' sorts right after '.'
+
+
+class EventStore:
+    """Events in an SQLite database (WAL mode, one connection per thread).
+
+    Each row keeps the normalized fields the API filters and aggregates on,
+    plus the original event as JSON. hostname_rev holds the hostname
+    reversed, so "this host or any subdomain" is an index range scan.
+    Rows older than retention_hours are deleted at most once per
+    PRUNE_INTERVAL, during appends.
+    """
+
+    def __init__(self, path, retention_hours=24 * 7):
+        self.path = path
+        self.retention_hours = retention_hours
+        self._local = threading.local()
+        self._last_prune = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10.0)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    # --- Writing ---
+
+    def _row(self, event):
+        normalized = normalize_event(event)
+        try:
+            epoch = parse_event_time(normalized["timestamp"]).timestamp()
+        except Exception:
+            epoch = time.time()
+        return (epoch, normalized["timestamp"], normalized["visited_site"], normalized["hostname"],
+                normalized["hostname"][::-1], normalized["session"], normalized["type"],
+                normalized["detail"], int(bool(normalized["tracker"])), int(bool(normalized["pii"])),
+                json.dumps(list(normalized["pii_types"] or [])), int(bool(normalized["fingerprinting"])),
+                int(bool(normalized["storage"])), json.dumps(event))
+
+    def append(self, events):
+        """Insert events in one transaction"""
+        connection = self._connection()
+        with connection:
+            connection.executemany(_INSERT, [self._row(event) for event in events])
+        self._maybe_prune()
+
+    def _maybe_prune(self):
+        now = time.time()
+        if not self.retention_hours or now - self._last_prune < PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM events WHERE epoch < ?", (now - self.retention_hours * 3600,))
+
+    def clear(self):
+        """Delete every event and the import records"""
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM events")
+            connection.execute("DELETE FROM imports")
+
+    # --- Reading ---
+
+    def first_occurrences(self, since=None, site=None):
+        """Yield (visited_site, entry) for the first event of every (site, hostname, type, detail)
+        since the given epoch, oldest first.
+
+        entry is (epoch, timestamp, hostname, session, tracker, pii, pii_types,
+        fingerprinting, storage, detail), the shape SiteStatsAggregator keeps.
+        """
+        # SQLite takes the bare columns from the row holding MIN(epoch)
+        sql = ("SELECT visited_site, MIN(epoch), timestamp, hostname, session, tracker, pii, pii_types, "
+               "fingerprinting, storage, detail FROM events WHERE epoch >= ?")
+        params = [since or 0]
+        if site is not None:
+            sql += " AND visited_site = ?"
+            params.append(site)
+        sql += " GROUP BY visited_site, hostname, type, detail ORDER BY 2"
+        for row in self._connection().execute(sql, params):
+            (visited_site, epoch, timestamp, hostname, session, tracker, pii, pii_types,
+             fingerprinting, storage, detail) = row
+            yield visited_site, (epoch, timestamp, hostname, session, bool(tracker), bool(pii),
+                                 tuple(json.loads(pii_types)), bool(fingerprinting), bool(storage), detail)
+
+    def changed_sites(self, after_id=None):
+        """Return (last row id, visited sites of rows added after after_id)"""
+        connection = self._connection()
+        if after_id is None:
+            return connection.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0], []
+        rows = connection.execute("SELECT visited_site, MAX(id) FROM events WHERE id > ? GROUP BY visited_site",
+                                  (after_id,)).fetchall()
+        return max([after_id] + [row[1] for row in rows]), [row[0] for row in rows]
+
+    def events_for_host(self, name, since=None, limit=10):
+        """Return (count, latest events) where the visited site is name or the hostname is name
+        or one of its subdomains"""
+        name = name.lower()
+        if name.startswith("www."):
+            name = name[4:]
+        low, high = _host_range(name)
+        where = ("(visited_site = ? OR hostname_rev = ? OR (hostname_rev >= ? AND hostname_rev < ?)) "
+                 "AND epoch >= ?")
+        params = (name, name[::-1], low, high, since or 0)
+        connection = self._connection()
+        count = connection.execute(f"SELECT COUNT(*) FROM events WHERE {where}", params).fetchone()[0]
+        rows = connection.execute(f"SELECT event FROM events WHERE {where} ORDER BY epoch DESC, id DESC LIMIT ?",
+                                  params + (limit,)).fetchall()
+        return count, [json.loads(row[0]) for row in reversed(rows)]
+
+    # --- Import ---
+
+    def import_log(self, path):
+        """Import a JSON-lines event log; returns the number of events added.
+
+        Each file's imported byte offset is recorded by absolute path, so
+        running the import again only reads lines appended since (the current
+        hourly segment may still be growing). A file smaller than its offset
+        was replaced and is imported from the start.
+        """
+        key = os.path.abspath(path)
+        connection = self._connection()
+        row = connection.execute("SELECT size, events FROM imports WHERE path = ?", (key,)).fetchone()
+        offset, events = row if row else (0, 0)
+        size = os.path.getsize(path)
+        if size == offset:
+            return 0
+        if size < offset:
+            offset, events = 0, 0
+
+        imported = 0
+        batch = []
+
+        def commit():
+            with connection:
+                connection.executemany(_INSERT, batch)
+                connection.execute("INSERT OR REPLACE INTO imports (path, size, events) VALUES (?, ?, ?)",
+                                   (key, offset, events + imported + len(batch)))
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    row = self._row(json.loads(line)) if line.strip() else None
+                except ValueError:
+                    if not line.endswith(b"\n"):
+                        break  # Still being written; read on the next run
+                    row = None
+                offset += len(line)
+                if row is None:
+                    continue
+                batch.append(row)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    commit()
+                    imported += len(batch)
+                    batch = []
+        commit()
+        return imported + len(batch)
+
+
+class SQLiteEventWriter(EventWriter):
+    """EventWriter that inserts each batch into an EventStore in one transaction"""
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            self.event_log.append(batch)
+            self.written += len(batch)
+        except sqlite3.Error as e:
+            print(f"Logging failed: {e}")
+            self.errors += len(batch)
+        self.batches += 1
+
+    def _close_file(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import Privacy Guard event logs into an SQLite store")
+    parser.add_argument("--db", default="logs/events.db")
+    parser.add_argument("logs", nargs="*",
+                        help="JSON-lines logs to import (default: logs/events.json and logs/events/)")
+    args = parser.parse_args()
+
+    paths = args.logs
+    if not paths:
+        event_log = SegmentedEventLog("logs/events", legacy_path="logs/events.json")
+        paths = [segment["path"] for segment in event_log.segments()]
+
+    store = EventStore(args.db, retention_hours=None)
+    total = 0
+    for path in paths:
+        try:
+            count = store.import_log(path)
+        except OSError as e:
+            print(f"⚠️ Could not import {path}: {e}")
+            continue
+        total += count
+        print(f"📥 {path}: {count} events")
+    print(f"✅ Imported {total} events into {args.db}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,11 @@
 
 const sessionMap = {};
 const tabDetectionCounts = {};
-const tabUpdateTimers = {};
+const tabHostnames = {};  // tabId -> normalized hostname the badge follows
+const siteData = {};  // normalized hostname -> latest /current data pushed by the server
 const API_BASE_URL = 'http://localhost:8081';
+let updateSource = null;  // One EventSource for every open tab's site
+let subscribedSites = '';
 
 function generateSessionId() {
     return Math.random().toString(36).substring(2) + Date.now().toString(36);
@@ -40,7 +43,7 @@ function updateBadge(tabId, count) {
     });
 }
 
-// Fetch privacy data from API (used by popup and badge updates)
+// Fetch privacy data from API (used by popup)
 async function fetchPrivacyData(hostname) {
     try {
         const normalizedHostname = normalizeHostname(hostname);
@@ -69,32 +72,54 @@ function calculateThreatCount(data) {
            (data.storage || 0) + (data.pii || 0);
 }
 
-// Periodically update badge for active tab
-async function updateTabBadge(tabId, hostname) {
-    if (!hostname) return;
+// Update badges of the tabs showing a site from pushed data
+function applySiteUpdate(update, isSnapshot) {
+    const hostname = update.site;
+    const previousCount = calculateThreatCount(siteData[hostname]);
+    // Snapshots carry every field, updates only the ones that changed
+    siteData[hostname] = isSnapshot ? update : Object.assign({}, siteData[hostname], update);
+    const threatCount = calculateThreatCount(siteData[hostname]);
     
-    try {
-        const result = await fetchPrivacyData(hostname);
-        if (result.success) {
-            const threatCount = calculateThreatCount(result.data);
-            updateBadge(tabId, threatCount);
-            
-            // Store count for this tab
+    Object.keys(tabHostnames).forEach(tabId => {
+        if (tabHostnames[tabId] === hostname) {
+            updateBadge(Number(tabId), threatCount);
             tabDetectionCounts[tabId] = threatCount;
-            
-            // Show browser notification for significant threats
-            if (threatCount >= 10 && threatCount % 10 === 0) {
-                showThreatNotification(hostname, threatCount);
-            }
-            
-            console.log(`🔢 [Background] Updated badge for tab ${tabId}: ${threatCount} threats`);
-        } else {
-            console.log(`⚠️ [Background] Could not update badge for ${hostname}: ${result.error}`);
         }
-        
-    } catch (error) {
-        console.log('❌ [Background] Error updating tab badge:', error);
+    });
+    
+    // Show browser notification each time another 10 threats are crossed
+    if (!isSnapshot && threatCount >= 10 && Math.floor(threatCount / 10) > Math.floor(previousCount / 10)) {
+        showThreatNotification(hostname, threatCount);
     }
+    
+    console.log(`🔢 [Background] ${hostname}: ${threatCount} threats`);
+}
+
+// Keep one server stream subscribed to the sites of the open tabs
+function refreshSubscriptions() {
+    const sites = [...new Set(Object.values(tabHostnames))].sort();
+    const key = sites.join(',');
+    if (key === subscribedSites) return;
+    
+    if (updateSource) {
+        updateSource.close();
+        updateSource = null;
+    }
+    subscribedSites = key;
+    Object.keys(siteData).forEach(hostname => {
+        if (!sites.includes(hostname)) delete siteData[hostname];
+    });
+    
+    // No open sites, no connection
+    if (sites.length === 0) return;
+    
+    // EventSource reconnects by itself; the server starts every stream with snapshots
+    updateSource = new EventSource(`${API_BASE_URL}/stream?sites=${encodeURIComponent(key)}`);
+    updateSource.addEventListener('snapshot', event => applySiteUpdate(JSON.parse(event.data), true));
+    updateSource.addEventListener('update', event => applySiteUpdate(JSON.parse(event.data), false));
+    updateSource.onerror = () => console.log('⚠️ [Background] Update stream interrupted, reconnecting');
+    
+    console.log(`📡 [Background] Subscribed to updates for: ${key}`);
 }
 
 // Show browser notification for high threat levels
@@ -111,20 +136,19 @@ function showThreatNotification(hostname, count) {
     }
 }
 
-// Set up periodic updates for a tab
+// Follow a tab's site through the update stream
 function setupTabMonitoring(tabId, hostname) {
-    // Clear existing timer
-    if (tabUpdateTimers[tabId]) {
-        clearInterval(tabUpdateTimers[tabId]);
-    }
+    const normalizedHostname = normalizeHostname(hostname.toLowerCase());
+    tabHostnames[tabId] = normalizedHostname;
     
-    // Initial update
-    updateTabBadge(tabId, hostname);
+    // Already subscribed: show the latest data right away
+    if (siteData[normalizedHostname]) {
+        const threatCount = calculateThreatCount(siteData[normalizedHostname]);
+        updateBadge(tabId, threatCount);
+        tabDetectionCounts[tabId] = threatCount;
+    }
     
-    // Set up periodic updates every 5 seconds
-    tabUpdateTimers[tabId] = setInterval(() => {
-        updateTabBadge(tabId, hostname);
-    }, 5000);
+    refreshSubscriptions();
     
     console.log(`👁️ [Background] Started monitoring tab ${tabId} for ${hostname}`);
 }
@@ -154,10 +178,8 @@ browser.tabs.onUpdated.addListener((tabId, changeInfo, tab) => {
 // Clean up when tabs are closed
 browser.tabs.onRemoved.addListener((tabId) => {
     delete tabDetectionCounts[tabId];
-    if (tabUpdateTimers[tabId]) {
-        clearInterval(tabUpdateTimers[tabId]);
-        delete tabUpdateTimers[tabId];
-    }
+    delete tabHostnames[tabId];
+    refreshSubscriptions();
     console.log(`🗑️ [Background] Cleaned up tab ${tabId}`);
 });
 
@@ -194,17 +216,6 @@ browser.webRequest.onBeforeRequest.addListener(
         
         if (isTracker) {
             console.log(`🚫 [Background] Blocked tracking request: ${hostname}`);
-            
-            // Trigger immediate badge update for this tab
-            if (details.tabId && details.tabId !== -1) {
-                browser.tabs.get(details.tabId).then(tab => {
-                    if (tab.url && tab.url.startsWith('http')) {
-                        const tabUrl = new URL(tab.url);
-                        updateTabBadge(details.tabId, tabUrl.hostname);
-                    }
-                }).catch(e => console.log('❌ [Background] Error getting tab:', e));
-            }
-            
             return { cancel: true };
         }
     },
@@ -32,25 +32,7 @@ function reportFinding(type, detail, extra_data = {}) {
 
     console.log(`🔍 Privacy finding: ${type} - ${detail}`, payload);
 
-    fetch("http://localhost:8081/log", {
-        method: "POST",
-        headers: {
-            "Content-Type": "application/json"
-        },
-        body: JSON.stringify(payload)
-    })
-    .then(response => {
-        if (!response.ok) {
-            throw new Error(`Server responded with status ${response.status}`);
-        }
-        return response.json();
-    })
-    .then(data => {
-        console.log("✅ Successfully logged privacy event:", data);
-    })
-    .catch(err => {
-        console.error("❌ Failed to report privacy finding:", err);
-    });
+    queueEvent(payload);
 }
 
 // ========== EXTENSION BADGE UPDATES (matches your original) ==========
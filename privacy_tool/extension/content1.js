@@ -31,25 +31,7 @@ function reportFinding(type, detail, extra_data = {}) {
 
     console.log(`🔍 Privacy finding: ${type} - ${detail}`, payload);
 
-    fetch("http://localhost:8081/log", {
-        method: "POST",
-        headers: {
-            "Content-Type": "application/json"
-        },
-        body: JSON.stringify(payload)
-    })
-    .then(response => {
-        if (!response.ok) {
-            throw new Error(`Server responded with status ${response.status}`);
-        }
-        return response.json();
-    })
-    .then(data => {
-        console.log("Successfully logged privacy event:", data);
-    })
-    .catch(err => {
-        console.error("Failed to report privacy finding:", err);
-    });
+    queueEvent(payload);
 }
 
 // ========== Extension Badge Updates ==========
@@ -373,10 +355,11 @@ function monitorOutgoingRequests() {
     window.fetch = function(url, options = {}) {
         const urlStr = typeof url === 'string' ? url : url.toString();
         
-        // Check if request is to third-party domain
+        // Check if request is to third-party domain (our own log uploads excluded)
         const isThirdParty = !urlStr.startsWith(window.location.origin) && 
                            !urlStr.startsWith('/') && 
-                           !urlStr.startsWith('./');
+                           !urlStr.startsWith('./') &&
+                           !urlStr.startsWith(LOG_BATCH_URL);
         
         if (isThirdParty) {
             reportFinding("tracker", "Third-party fetch request", {
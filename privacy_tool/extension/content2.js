@@ -27,26 +27,7 @@ function reportFinding(type, detail, extra_data = {}) {
     // ENHANCED: Always log to console for debugging
     console.log(`🔍 PRIVACY DETECTION: ${type.toUpperCase()} - ${detail}`, payload);
 
-    // Try to send to server (will work if server is running)
-    fetch("http://localhost:8081/log", {
-        method: "POST",
-        headers: {
-            "Content-Type": "application/json"
-        },
-        body: JSON.stringify(payload)
-    })
-    .then(response => {
-        if (!response.ok) {
-            throw new Error(`Server responded with status ${response.status}`);
-        }
-        return response.json();
-    })
-    .then(data => {
-        console.log("✅ Successfully logged privacy event:", data);
-    })
-    .catch(err => {
-        console.log("⚠️ Server logging failed (but detection still works):", err.message);
-    });
+    queueEvent(payload);
 }
 
 // ========== Extension Badge Updates ==========
@@ -84,14 +84,7 @@ function reportFinding(type, detail, extra_data = {}) {
     console.log(`🔍 PRIVACY DETECTION: ${type.toUpperCase()} - ${detail}`);
     console.log("📋 Detection payload:", payload);
     
-    // Try to send to server
-    fetch("http://localhost:8081/log", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(payload)
-    }).then(response => response.json())
-    .then(data => console.log("✅ Logged to server:", data))
-    .catch(err => console.log("⚠️ Server not available:", err.message));
+    queueEvent(payload);
 }
 
 // ========== STORAGE MONITORING ==========
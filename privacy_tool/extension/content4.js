@@ -20,6 +20,13 @@ console.log("🦊✅ Firefox Production Storage Detection Starting...");
                     pii: 0
                 };
                 
+                // === SERVER LOGGING ===
+                // The page context has no extension globals: events are posted
+                // to the content script, which batches them with event_batch.js
+                function queueEvent(event) {
+                    window.postMessage({ privacyGuardEvent: event }, "*");
+                }
+                
                 // === WORKING STORAGE HOOKS (Prototype Method) ===
                 function setupProductionStorageHooks() {
                     console.log("🔧 Setting up production storage hooks using prototype method...");
@@ -41,24 +48,18 @@ console.log("🦊✅ Firefox Production Storage Detection Starting...");
                             // Increment counter
                             window.privacyDetectionCounts.storage++;
                             
-                            // Send to server
-                            fetch("http://localhost:8081/log", {
-                                method: "POST",
-                                headers: { "Content-Type": "application/json" },
-                                body: JSON.stringify({
-                                    timestamp: new Date().toISOString(),
-                                    type: "storage",
-                                    detail: storageType + ".setItem",
-                                    url: window.location.hostname,
-                                    session: "firefox-prod-" + Date.now(),
-                                    storage_type: storageType,
-                                    operation: "setItem",
-                                    key: key,
-                                    source: "extension"
-                                })
-                            }).then(response => response.json())
-                            .then(data => console.log("✅ Logged to server:", data.status || "success"))
-                            .catch(e => console.log("⚠️ Server logging failed:", e.message));
+                            // Queue for the next batch to the server
+                            queueEvent({
+                                timestamp: new Date().toISOString(),
+                                type: "storage",
+                                detail: storageType + ".setItem",
+                                url: window.location.hostname,
+                                session: "firefox-prod-" + Date.now(),
+                                storage_type: storageType,
+                                operation: "setItem",
+                                key: key,
+                                source: "extension"
+                            });
                             
                             return originalLocalSetItem.call(this, key, value);
                         };
@@ -252,6 +253,13 @@ console.log("🦊✅ Firefox Production Storage Detection Starting...");
         }
     }
     
+    // Events from the page script go into the shared batch queue
+    window.addEventListener('message', function(event) {
+        if (event.source === window && event.data && event.data.privacyGuardEvent) {
+            queueEvent(event.data.privacyGuardEvent);
+        }
+    });
+    
     // Initialize
     if (document.readyState === 'loading') {
         document.addEventListener('DOMContentLoaded', injectProductionScript);
@@ -0,0 +1,66 @@
+// Shared event batching for the content scripts. The manifest lists this file
+// before the content script, so queueEvent() is defined when it runs.
+
+// ========== BATCHED REPORTING ==========
+// Findings are queued and sent together to /log/batch, on a timer, when
+// the queue is full, or when the page is hidden or unloaded
+const LOG_BATCH_URL = "http://localhost:8081/log/batch";
+const LOG_FLUSH_INTERVAL_MS = 2000;
+const LOG_MAX_BATCH = 200;
+let pendingEvents = [];
+let flushTimer = null;
+
+function queueEvent(payload) {
+    pendingEvents.push(payload);
+    if (pendingEvents.length >= LOG_MAX_BATCH) {
+        flushEvents();
+    } else if (!flushTimer) {
+        flushTimer = setTimeout(() => flushEvents(), LOG_FLUSH_INTERVAL_MS);
+    }
+}
+
+function flushEvents(unloading = false) {
+    if (flushTimer) {
+        clearTimeout(flushTimer);
+        flushTimer = null;
+    }
+    if (pendingEvents.length === 0) {
+        return;
+    }
+    const body = JSON.stringify(pendingEvents);
+    const count = pendingEvents.length;
+    pendingEvents = [];
+
+    // sendBeacon survives page unload; text/plain avoids a CORS preflight
+    if (unloading && navigator.sendBeacon &&
+        navigator.sendBeacon(LOG_BATCH_URL, new Blob([body], { type: "text/plain" }))) {
+        return;
+    }
+    fetch(LOG_BATCH_URL, {
+        method: "POST",
+        headers: {
+            "Content-Type": "application/json"
+        },
+        body: body,
+        keepalive: unloading
+    })
+    .then(response => {
+        if (!response.ok) {
+            throw new Error(`Server responded with status ${response.status}`);
+        }
+        return response.json();
+    })
+    .then(data => {
+        console.log(`✅ Logged ${count} privacy events:`, data.status);
+    })
+    .catch(err => {
+        console.error(`❌ Failed to report ${count} privacy findings:`, err);
+    });
+}
+
+window.addEventListener('pagehide', () => flushEvents(true));
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') {
+        flushEvents(true);
+    }
+});
@@ -0,0 +1,317 @@
+"""
+Adblock Plus filter engine for Privacy Guard.
+Matches request URLs against network filters (e.g. EasyPrivacy) without
+checking every rule: each filter is indexed under its rarest token.
+"""
+
+import re
+from collections import Counter
+
+# Tokens are runs of these characters; a filter is indexed under one token
+# that every URL it can match must contain as a whole token
+_TOKEN = re.compile(r"[a-z0-9%]{2,}")
+_TOKEN_CHARS = frozenset("abcdefghijklmnopqrstuvwxyz0123456789%")
+
+# Tokens present in nearly every URL make useless index keys
+_COMMON_TOKENS = frozenset(["http", "https", "www", "com", "net", "org", "js", "html", "php"])
+
+# Separator placeholder (^): anything but a letter, digit or _ - . %
+_SEPARATOR = r"(?:[^\w.%-]|$)"
+_HOST_ANCHOR = r"^[a-z][a-z0-9+.-]*://(?:[^/?#]*\.)?"
+_OPTIONS = re.compile(r"^[\w~,=|.*%:-]+$")
+
+# Request types by ABP option name; values are the types rules can match
+REQUEST_TYPES = {
+    "script": "script", "image": "image", "stylesheet": "stylesheet", "css": "stylesheet",
+    "xmlhttprequest": "xmlhttprequest", "xhr": "xmlhttprequest", "subdocument": "subdocument",
+    "frame": "subdocument", "object": "object", "media": "media", "font": "font",
+    "ping": "ping", "beacon": "ping", "websocket": "websocket", "other": "other",
+    "document": "document", "doc": "document",
+}
+
+# Sec-Fetch-Dest header values mapped to request types
+FETCH_DEST_TYPES = {
+    "script": {"script"}, "image": {"image"}, "style": {"stylesheet"},
+    "iframe": {"subdocument"}, "frame": {"subdocument"}, "document": {"document"},
+    "font": {"font"}, "audio": {"media"}, "video": {"media"}, "track": {"media"},
+    "object": {"object"}, "embed": {"object"}, "empty": {"xmlhttprequest", "ping", "websocket"},
+}
+
+# Options that only change how a flagged request is handled
+_IGNORED_OPTIONS = frozenset(["important", "match-case", "collapse", "~collapse"])
+
+_ALL_TYPES = frozenset(REQUEST_TYPES.values())
+_DEFAULT_TYPES = _ALL_TYPES - {"document"}
+_TYPE_SETS = {}
+
+
+def base_domain(hostname):
+    """Approximate registrable domain (no public suffix list): example.com, example.co.uk"""
+    labels = hostname.split(".")
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in ("co", "com", "net", "org", "gov", "ac", "edu"):
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _domain_matches(hostname, domain):
+    return hostname == domain or hostname.endswith("." + domain)
+
+
+class FilterRule:
+    """One parsed network filter"""
+
+    __slots__ = ("text", "exception", "regex_source", "substring", "third_party",
+                 "include_domains", "exclude_domains", "types", "_regex")
+
+    def __init__(self, text, exception, regex_source, substring, third_party,
+                 include_domains, exclude_domains, types):
+        self.text = text
+        self.exception = exception
+        self.regex_source = regex_source
+        self.substring = substring
+        self.third_party = third_party
+        self.include_domains = include_domains
+        self.exclude_domains = exclude_domains
+        self.types = types
+        self._regex = None
+
+    def fields(self):
+        """Constructor arguments, used to pickle rules compactly"""
+        return (self.text, self.exception, self.regex_source, self.substring, self.third_party,
+                self.include_domains, self.exclude_domains, self.types)
+
+    def matches(self, url, request_host, document_host, request_types):
+        """Check the filter's options, then its pattern, against a lowercased URL"""
+        if request_types is not None and not (self.types & request_types):
+            return False
+        if self.third_party is not None:
+            if document_host is None:
+                return False
+            if (base_domain(request_host) != base_domain(document_host)) != self.third_party:
+                return False
+        if self.include_domains or self.exclude_domains:
+            if document_host is None:
+                if self.include_domains:
+                    return False
+            else:
+                if self.include_domains and not any(_domain_matches(document_host, d) for d in self.include_domains):
+                    return False
+                if any(_domain_matches(document_host, d) for d in self.exclude_domains):
+                    return False
+        if self.substring is not None:
+            return self.substring in url
+        if self._regex is None:
+            self._regex = re.compile(self.regex_source, re.IGNORECASE)
+        return self._regex.search(url) is not None
+
+
+def parse_filter(line):
+    """Parse one filter list line into (FilterRule, tokens), or None if it is not a usable network filter"""
+    text = line.strip()
+    if not text or text.startswith(("!", "[")) or "##" in text or "#@#" in text or "#?#" in text or "#$#" in text:
+        return None
+
+    pattern = text
+    exception = pattern.startswith("@@")
+    if exception:
+        pattern = pattern[2:]
+
+    # Options follow the last '$' (unless it belongs to a /regex/ pattern)
+    options = []
+    dollar = pattern.rfind("$")
+    if dollar >= 0 and (not pattern.startswith("/") or dollar > pattern.rfind("/")):
+        option_text = pattern[dollar + 1:]
+        if option_text and _OPTIONS.match(option_text):
+            options = option_text.lower().split(",")
+            pattern = pattern[:dollar]
+
+    third_party = None
+    include_domains, exclude_domains = (), ()
+    allowed_types, excluded_types = set(), set()
+    for option in options:
+        name, _, value = option.partition("=")
+        negated = name.startswith("~")
+        name = name.lstrip("~")
+        if name in ("third-party", "3p"):
+            third_party = not negated
+        elif name in ("first-party", "1p"):
+            third_party = negated
+        elif name in ("domain", "from") and value:
+            domains = value.split("|")
+            include_domains = tuple(d for d in domains if d and not d.startswith("~"))
+            exclude_domains = tuple(d[1:] for d in domains if d.startswith("~"))
+        elif name in REQUEST_TYPES:
+            (excluded_types if negated else allowed_types).add(REQUEST_TYPES[name])
+        elif name == "all":
+            allowed_types |= _ALL_TYPES
+        elif option not in _IGNORED_OPTIONS:
+            # csp=, redirect=, removeparam=, popup ... do not flag requests
+            return None
+
+    if allowed_types:
+        types = frozenset(allowed_types)
+    else:
+        types = frozenset((_DEFAULT_TYPES | ({"document"} if exception else set())) - excluded_types)
+    if not types:
+        return None
+    # Share one object per distinct type set (smaller pickles)
+    types = _TYPE_SETS.setdefault(types, types)
+
+    regex_source = substring = None
+    tokens = ()
+    if len(pattern) > 2 and pattern.startswith("/") and pattern.endswith("/"):
+        regex_source = pattern[1:-1]
+        try:
+            re.compile(regex_source)
+        except re.error:
+            return None
+    else:
+        pattern = pattern.lower()
+        host_anchor = pattern.startswith("||")
+        start_anchor = not host_anchor and pattern.startswith("|")
+        pattern = pattern[2:] if host_anchor else pattern[1:] if start_anchor else pattern
+        end_anchor = pattern.endswith("|")
+        if end_anchor:
+            pattern = pattern[:-1]
+        pattern = pattern.strip("*") if not (host_anchor or start_anchor or end_anchor) else pattern
+        if not pattern and not host_anchor:
+            return None
+
+        if not (host_anchor or start_anchor or end_anchor) and not any(c in pattern for c in "*^"):
+            substring = pattern
+        else:
+            body = "".join(".*" if c == "*" else _SEPARATOR if c == "^" else re.escape(c) for c in pattern)
+            regex_source = (_HOST_ANCHOR if host_anchor else "^" if start_anchor else "") + body + ("$" if end_anchor else "")
+        tokens = _pattern_tokens(pattern, host_anchor or start_anchor, end_anchor)
+
+    rule = FilterRule(text, exception, regex_source, substring, third_party,
+                      include_domains, exclude_domains, types)
+    return rule, tokens
+
+
+def _pattern_tokens(pattern, start_anchored, end_anchored):
+    """Tokens of a plain pattern that must appear whole in any matching URL"""
+    tokens = []
+    for match in _TOKEN.finditer(pattern):
+        start, end = match.span()
+        if start == 0 and not start_anchored:
+            continue
+        if start > 0 and pattern[start - 1] == "*":
+            continue
+        if end == len(pattern) and not end_anchored:
+            continue
+        if end < len(pattern) and (pattern[end] == "*" or pattern[end] in _TOKEN_CHARS):
+            continue
+        tokens.append(match.group())
+    return tokens
+
+
+class FilterEngine:
+    """Token-indexed set of Adblock Plus network filters.
+
+    Each filter is stored under its rarest token; a URL is split into tokens
+    and only the filters under those tokens are checked. Filters without a
+    usable token (mostly /regex/ rules) sit behind one combined prefilter
+    regex, so they cost a single search when none of them can match. A
+    blocking match is dropped when an exception (@@) filter also matches
+    the request.
+    """
+
+    def __init__(self, lines=()):
+        parsed = []
+        for line in lines:
+            result = parse_filter(line)
+            if result:
+                parsed.append(result)
+
+        frequency = Counter(token for _, tokens in parsed for token in set(tokens))
+        indexed = []
+        for rule, tokens in parsed:
+            candidates = [t for t in tokens if t not in _COMMON_TOKENS] or tokens
+            token = min(candidates, key=lambda t: (frequency[t], -len(t))) if candidates else None
+            indexed.append((token, rule))
+        self._build(indexed)
+
+    def _build(self, indexed):
+        self.block_index, self.exception_index = {}, {}
+        self.block_untokenized, self.exception_untokenized = [], []
+        for token, rule in indexed:
+            if token is None:
+                (self.exception_untokenized if rule.exception else self.block_untokenized).append(rule)
+            else:
+                index = self.exception_index if rule.exception else self.block_index
+                index.setdefault(token, []).append(rule)
+        self.rule_count = len(indexed)
+        self._prefilters = {}
+
+    def __getstate__(self):
+        # Rules are pickled as plain field tuples and turned back into
+        # FilterRule objects one bucket at a time, on first lookup, so
+        # loading the artifact does not construct every rule up front.
+        # Regexes are compiled on first use, never pickled.
+        def dump(rules):
+            return [rule if isinstance(rule, tuple) else rule.fields() for rule in rules]
+        return {
+            "block_index": {token: dump(rules) for token, rules in self.block_index.items()},
+            "exception_index": {token: dump(rules) for token, rules in self.exception_index.items()},
+            "block_untokenized": dump(self.block_untokenized),
+            "exception_untokenized": dump(self.exception_untokenized),
+            "rule_count": self.rule_count,
+        }
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self.block_untokenized = [FilterRule(*fields) for fields in self.block_untokenized]
+        self.exception_untokenized = [FilterRule(*fields) for fields in self.exception_untokenized]
+        self._prefilters = {}
+
+    def __len__(self):
+        return self.rule_count
+
+    def match(self, url, request_host, document_host=None, request_types=None):
+        """Return the blocking filter matching a lowercased URL, or None.
+
+        document_host is the page that made the request (None if unknown);
+        request_types is a set of request types, or None to ignore type options.
+        """
+        if not self.rule_count:
+            return None
+        tokens = set(_TOKEN.findall(url))
+        rule = self._find(self.block_index, self.block_untokenized, tokens,
+                          url, request_host, document_host, request_types)
+        if rule is None:
+            return None
+        if self._find(self.exception_index, self.exception_untokenized, tokens,
+                      url, request_host, document_host, request_types):
+            return None
+        return rule
+
+    def _find(self, index, untokenized, tokens, url, request_host, document_host, request_types):
+        for token in tokens:
+            rules = index.get(token)
+            if rules is None:
+                continue
+            if isinstance(rules[0], tuple):
+                rules[:] = [FilterRule(*fields) for fields in rules]
+            for rule in rules:
+                if rule.matches(url, request_host, document_host, request_types):
+                    return rule
+        if untokenized and self._prefilter(untokenized).search(url):
+            for rule in untokenized:
+                if rule.matches(url, request_host, document_host, request_types):
+                    return rule
+        return None
+
+    def _prefilter(self, rules):
+        """Combined regex that matches whenever any of rules' patterns could"""
+        prefilter = self._prefilters.get(id(rules))
+        if prefilter is None:
+            alternatives = [re.escape(rule.substring) if rule.substring is not None else rule.regex_source
+                            for rule in rules]
+            try:
+                prefilter = re.compile("|".join(f"(?:{a})" for a in alternatives), re.IGNORECASE)
+            except re.error:
+                # e.g. backreferences renumbered by the combination
+                prefilter = re.compile("")
+            self._prefilters[id(rules)] = prefilter
+        return prefilter
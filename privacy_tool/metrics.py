@@ -0,0 +1,291 @@
+"""
+Metrics and leveled logging for Privacy Guard.
+Counters, gauges and latency histograms rendered in the Prometheus text
+format, plus a rate-limited logger for per-request messages.
+
+    privacy_guard_detector_seconds_bucket{detector="pii_scan",le="0.001"} 42
+
+The proxy serves them on 127.0.0.1:METRICS_PORT/metrics, the API server on
+its own /metrics route.
+"""
+
+import os
+import sys
+import time
+import bisect
+import logging
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === Configuration ===
+LOG_LEVEL = os.environ.get("PRIVACY_GUARD_LOG_LEVEL", "INFO").upper()
+LOG_RATE_LIMIT = 20  # Records let through per call site in each LOG_RATE_INTERVAL
+LOG_RATE_INTERVAL = 10.0  # Seconds
+# Seconds; detectors run in microseconds, log flushes and API routes in milliseconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# === Metric types ===
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples keyed by label values.
+
+    With a callback the values are read when metrics are rendered (from
+    counters the code already keeps) and nothing is recorded on the hot
+    path. The callback returns a number, or a dict of label value tuples
+    to numbers.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """Yield (name suffix, label names, label values, value)"""
+        if self.callback is not None:
+            values = self.callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield "", self.labelnames, labels, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_label_text(names, labels)} {_number(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    """Fixed buckets; observe() is a bisect and three additions under a lock"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *labels):
+        """Decorator recording the wrapped function's duration"""
+        def decorator(func):
+            @functools.wraps(func)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - start, *labels)
+            return timed
+        return decorator
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(state[0]), state[1], state[2]) for labels, state in self._values.items()}
+        names = self.labelnames + ("le",)
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield "_bucket", names, labels + (_number(bound),), cumulative
+            yield "_sum", self.labelnames, labels, total
+            yield "_count", self.labelnames, labels, count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric; registering a name again returns the existing metric.
+
+        Callback metrics are replaced instead, so a reloaded proxy script's
+        callbacks read the reloaded module's state.
+        """
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is None or metric.callback is not None:
+                self._metrics[metric.name] = metric
+                return metric
+            return existing
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=(), callback=None):
+    return REGISTRY.register(Counter(name, documentation, labelnames, callback))
+
+
+def gauge(name, documentation, labelnames=(), callback=None):
+    return REGISTRY.register(Gauge(name, documentation, labelnames, callback))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format"""
+    return REGISTRY.render()
+
+
+# === Exposition for processes without a web server (the proxy) ===
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are not worth a line each
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serve /metrics from a daemon thread; returns the server (call shutdown() to stop)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+# === Logging ===
+class RateLimitedLogger:
+    """Leveled logger that lets through at most `rate` records per `interval`
+    seconds for each message format.
+
+    Disabled levels cost one level check, and records over the limit are
+    dropped before a LogRecord is built. The number dropped is appended to
+    the next record let through for the same format.
+    """
+
+    def __init__(self, logger, rate=LOG_RATE_LIMIT, interval=LOG_RATE_INTERVAL):
+        self.logger = logger
+        self.rate = rate
+        self.interval = interval
+        self._windows = {}  # format -> [window start, passed, suppressed]
+        self._lock = threading.Lock()
+
+    def isEnabledFor(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(msg)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[msg] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if window[1] >= self.rate:
+                window[2] += 1
+                return
+            window[1] += 1
+        if suppressed:
+            msg = f"{msg} ({suppressed} similar messages suppressed)"
+        self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(logging.ERROR, msg, *args)
+
+
+def get_logger(name):
+    """Rate-limited logger under privacy_guard.*, printing to stdout at PRIVACY_GUARD_LOG_LEVEL.
+
+    Pass %-style arguments rather than f-strings, so nothing is formatted
+    for a disabled level or a dropped record.
+    """
+    root = logging.getLogger("privacy_guard")
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+        root.addHandler(handler)
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        root.propagate = False  # mitmproxy and Flask configure the root logger themselves
+    return RateLimitedLogger(root.getChild(name))
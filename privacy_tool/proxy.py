@@ -1,240 +1,714 @@
 import os
 import json
 import re
+import threading
+import time
 import urllib.parse
+from collections import Counter, namedtuple
 from mitmproxy import http
 from datetime import datetime
+from rule_index import CompiledRules, LRUCache, load_rules_artifact, write_rules_artifact
+from event_log import EventWriter, RemoteEventWriter, SegmentedEventLog
+from event_store import EventStore, SQLiteEventWriter
+from filter_engine import FETCH_DEST_TYPES, base_domain
+from body_parsers import BINARY_CONTENT_TYPES, get_body_parser
+import metrics
 
 # === Configuration ===
 RULES_PATH = "rules/combined_rules.json"
-LOG_PATH = "logs/events.json"
+LOG_PATH = "logs/events.json"  # Pre-segmentation log, still read in place
+LOG_DIR = "logs/events"
+LOG_RETENTION_HOURS = 24 * 7
+LOG_COMPACT_AFTER_HOURS = 48  # Hourly segments older than this are merged per day
+LOG_QUEUE_SIZE = 10000  # Events buffered before new ones are dropped
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 1.0  # Seconds
+# Set by cluster.py for its workers: events go to its collector ("host:port")
+EVENT_COLLECTOR = os.environ.get("PRIVACY_GUARD_EVENT_COLLECTOR")
+# Optional SQLite event store used instead of the log segments (e.g. "logs/events.db")
+EVENT_DB_PATH = os.environ.get("PRIVACY_GUARD_EVENT_DB")
+HOST_CACHE_SIZE = 4096  # Hosts whose rule verdicts are cached
+HOST_CACHE_TTL = 300.0  # Seconds
+RULES_POLL_INTERVAL = 5.0  # Seconds between checks of the rules file for changes
+RULES_ARTIFACT_WAIT = 30.0  # Seconds a cluster worker's reload waits for the launcher to rebuild the artifact
+PII_SCAN_WINDOW = 64 * 1024  # Characters of a body scanned by pii_regex_patterns (None = unlimited)
+STREAM_BODY_THRESHOLD = 1024 * 1024  # Bodies larger than this (or sent chunked over HTTP/1) are streamed
+STREAM_SCAN_LIMIT = 8 * 1024 * 1024  # Bytes of a streamed body scanned; the rest passes through
+STREAM_SCAN_BUDGET = 0.1  # Seconds spent scanning one streamed body before the rest passes through
+STREAM_OVERLAP = 256  # Bytes carried between chunks so matches spanning a boundary are found
+PIXEL_MAX_BYTES = 100  # Image responses smaller than this are logged as tracking pixels
+# Local Prometheus endpoint (0 disables); cluster workers use the next ports up
+METRICS_PORT = int(os.environ.get("PRIVACY_GUARD_METRICS_PORT", "9464"))
+WORKER_INDEX = os.environ.get("PRIVACY_GUARD_WORKER")
+# A regex match inside a structured leaf must be delimited by these
+LEAF_LEADING = set(" \t\r\n\"'(<[{:;,=")
+LEAF_TRAILING = set(" \t\r\n\"')>]}.,;:!?")
+
+# === Metrics ===
+log = metrics.get_logger("proxy")
+HOOK_SECONDS = metrics.histogram("privacy_guard_hook_seconds", "Time spent in each mitmproxy hook", ["hook"])
+DETECTOR_SECONDS = metrics.histogram("privacy_guard_detector_seconds",
+                                     "Time spent in each PrivacyRules detector", ["detector"])
+RULE_MATCHES = metrics.counter("privacy_guard_rule_matches_total", "Flows flagged, by rule family", ["family"])
+PII_MATCHES = metrics.counter("privacy_guard_pii_matches_total", "PII types found in requests", ["type"])
+ACTIONS = metrics.counter("privacy_guard_actions_total", "Requests blocked or rewritten", ["action"])
+
+# Host-level facts that do not depend on the URL path or body
+HostVerdict = namedtuple("HostVerdict",
+                         "tracker_rule tracker_entity fingerprinting_service suspicious_pattern whitelist_rule")
+
+def standalone_match(value, start, end):
+    """PIIRegexSet accept callback: the (already whitespace-trimmed) match, or
+    None when it is only a fragment of a longer token in the leaf"""
+    if (start and value[start - 1] not in LEAF_LEADING) or (end < len(value) and value[end] not in LEAF_TRAILING):
+        return None
+    return start, end
 
 class PrivacyRules:
-    def __init__(self, rules_path=RULES_PATH):
+    def __init__(self, rules_path=RULES_PATH, pii_scan_window=PII_SCAN_WINDOW, reloading=False):
         self.rules_path = rules_path
-        self.load_rules()
+        self.pii_scan_window = pii_scan_window
+        self.load_rules(reloading)
+        # Belongs to this rule set, so a reload starts with an empty cache
+        self.host_cache = LRUCache(HOST_CACHE_SIZE, HOST_CACHE_TTL)
     
-    def load_rules(self):
-        """Load and compile all rules from centralized file"""
+    def load_rules(self, reloading=False):
+        """Load compiled rules from the precompiled artifact, falling back to the JSON file.
+        
+        Only a proxy starting on its own writes a missing artifact. Cluster
+        workers share the launcher's, so their reloads wait for it to match
+        the rules file and fail (keeping the current rules) if it never does.
+        """
         if not os.path.exists(self.rules_path):
             raise FileNotFoundError(f"Rules file not found at: {self.rules_path}")
         
-        with open(self.rules_path, "r") as f:
+        compiled = load_rules_artifact(self.rules_path)
+        source = "artifact"
+        if compiled is None and reloading and WORKER_INDEX is not None:
+            deadline = time.monotonic() + RULES_ARTIFACT_WAIT
+            while compiled is None and time.monotonic() < deadline:
+                time.sleep(1.0)
+                compiled = load_rules_artifact(self.rules_path)
+            if compiled is None:
+                raise RuntimeError(f"No rules artifact matching {self.rules_path} after {RULES_ARTIFACT_WAIT:.0f}s")
+        if compiled is None:
+            with open(self.rules_path, "rb") as f:
+                raw = f.read()
             try:
-                self.rules = json.load(f)
+                rules = json.loads(raw)
             except json.JSONDecodeError as e:
                 raise ValueError(f"Invalid JSON in rules file: {e}")
+            compiled = CompiledRules(rules)
+            source = "json"
+            # Refresh the artifact so the next start is fast
+            if not reloading and WORKER_INDEX is None:
+                try:
+                    write_rules_artifact(self.rules_path, compiled=compiled, raw=raw)
+                except OSError as e:
+                    print(f"Warning: Could not write rules artifact: {e}")
         
-        # Load tracker domains
-        self.tracker_domains = set(self.rules.get("tracker_domains", []))
-        
-        # Load fingerprinting domains
-        self.fingerprinting_domains = set(self.rules.get("fingerprinting_domains", []))
-        
-        # Load PII patterns
-        self.pii_patterns = [p.lower() for p in self.rules.get("pii_patterns", [])]
-        
-        # Compile regex patterns from rules
-        self.pii_regex_patterns = {}
-        pii_regex = self.rules.get("pii_regex_patterns", {})
-        for name, pattern in pii_regex.items():
-            try:
-                self.pii_regex_patterns[name] = re.compile(pattern, re.IGNORECASE)
-            except re.error as e:
-                print(f"Warning: Invalid regex pattern for {name}: {e}")
-        
-        # Load suspicious form fields
-        self.suspicious_form_fields = self.rules.get("suspicious_form_fields", [])
+        # Expose the compiled indexes and matchers as attributes
+        vars(self).update(vars(compiled))
         
-        # Load tracking parameters  
-        self.tracking_parameters = self.rules.get("tracking_parameters", [])
-        
-        # Load actions
-        self.proxy_action = self.rules.get("actions", {}).get("proxy", "log")
-        
-        # Fingerprinting detection patterns
-        self.fingerprinting_url_patterns = [
-            "fingerprint", "fp-collect", "device-id", "browser-id", "client-id",
-            "visitor-id", "canvas-hash", "webgl-hash", "digital-fingerprint"
-        ]
-        
-        self.fingerprinting_params = [
-            "canvas_hash", "webgl_vendor", "webgl_renderer", "screen_resolution",
-            "timezone_offset", "browser_plugins", "font_list", "hardware_concurrency",
-            "device_memory", "user_agent_hash", "audio_hash", "client_rects",
-            "touch_support", "webgl_params", "canvas_fingerprint", "audio_fingerprint"
-        ]
-        
-        self.suspicious_domain_patterns = [
-            "googletourist", "googleanalytic", "facebookcdn", "twitterapi",
-            "amazonapi", "microsoftapi"
-        ]
-        
-        print(f"📋 Loaded rules: {len(self.tracker_domains)} tracker domains, "
+        print(f"📋 Loaded rules ({source}): {len(self.tracker_domains)} tracker domains, "
+              f"{len(self.tracker_url_patterns)} tracker URL rules, {len(self.filter_engine)} filters, "
               f"{len(self.pii_patterns)} PII patterns, {len(self.pii_regex_patterns)} regex patterns, "
-              f"{len(self.fingerprinting_domains)} fingerprinting domains")
+              f"{len(self.fingerprinting_domains)} fingerprinting domains, "
+              f"{self.tracker_entities.owner_count} tracker owners")
     
-    def is_tracker_domain(self, hostname):
-        """Check if hostname is a known tracker"""
+    @DETECTOR_SECONDS.time("host_verdict")
+    def compute_host_verdict(self, hostname):
+        """Evaluate every host-level rule for a lowercased hostname"""
+        service_domains = self.fingerprinting_domain_matcher.find_all(hostname)
+        suspicious_patterns = self.suspicious_domain_matcher.find_all(hostname)
+        suspicious_pattern = None
+        if suspicious_patterns and not any(legit in hostname for legit in ['google.com', 'facebook.com', 'twitter.com']):
+            suspicious_pattern = suspicious_patterns[0]
+        tracker_rule = self.tracker_domains.match(hostname)
+        # The whitelist only exempts hosts no tracker rule covers: the bundled
+        # rules list google.com, github.com and mozilla.org in both, and their
+        # bodies are still scanned and sanitized
+        whitelist_rule = None if tracker_rule else self.whitelist_domains.match(hostname)
+        return HostVerdict(
+            tracker_rule,
+            self.tracker_entities.get(tracker_rule) if tracker_rule else None,
+            service_domains[0] if service_domains else None,
+            suspicious_pattern,
+            whitelist_rule
+        )
+    
+    def host_verdict(self, hostname):
+        """Cached tracker / fingerprinting-service / suspicious-pattern verdict for a host"""
         hostname = hostname.lower()
-        return any(hostname == d or hostname.endswith(f".{d}") for d in self.tracker_domains)
+        verdict = self.host_cache.get(hostname)
+        if verdict is None:
+            verdict = self.compute_host_verdict(hostname)
+            self.host_cache.put(hostname, verdict)
+        return verdict
+    
+    def is_tracker_domain(self, hostname):
+        """Return the tracker rule matching hostname (or a parent domain), else None"""
+        return self.host_verdict(hostname).tracker_rule
+    
+    def tracker_entity(self, hostname):
+        """Return the TrackerEntity (owner, category, prevalence) of a tracker host, else None"""
+        return self.host_verdict(hostname).tracker_entity
+    
+    def is_whitelisted(self, hostname):
+        """Return the whitelist entry covering hostname, else None"""
+        return self.host_verdict(hostname).whitelist_rule
+    
+    @DETECTOR_SECONDS.time("tracker_url")
+    def is_tracker_url(self, url):
+        """Return the first tracker URL fragment rule found in a lowercased URL, else None"""
+        return self.tracker_url_matcher.search(url)
+    
+    @DETECTOR_SECONDS.time("tracker_filter")
+    def match_tracker_filter(self, url, hostname, document_host="", fetch_dest=""):
+        """Return the Adblock Plus filter that flags a lowercased URL, else None"""
+        rule = self.filter_engine.match(url, hostname, document_host.split(":")[0] or None,
+                                        FETCH_DEST_TYPES.get(fetch_dest.lower()))
+        return rule.text if rule else None
     
-    def detect_fingerprinting(self, url, body, headers):
-        """Detect fingerprinting attempts in requests"""
+    @DETECTOR_SECONDS.time("fingerprinting")
+    def detect_fingerprinting(self, url, body, headers, body_lower=None, hostname=None):
+        """Detect fingerprinting attempts in requests (hostname: the request's host, without the port)"""
         url_lower = url.lower()
-        body_lower = body.lower() if body else ""
-        hostname = url_lower.split('/')[2] if '//' in url_lower else url_lower.split('/')[0]
+        if body_lower is None:
+            body_lower = body.lower() if body else ""
+        if hostname is None:
+            hostname = urllib.parse.urlsplit(url_lower if '//' in url_lower else f"//{url_lower}").hostname or ""
+        
+        verdict = self.host_verdict(hostname)
         
         # Check if request is to a known fingerprinting service
-        for domain in self.fingerprinting_domains:
-            if domain in hostname:
-                return True, f"fingerprinting_service_{domain}"
+        if verdict.fingerprinting_service:
+            return True, f"fingerprinting_service_{verdict.fingerprinting_service}"
         
         # Check for suspicious domain patterns
-        for pattern in self.suspicious_domain_patterns:
-            if pattern in hostname and not any(legit in hostname for legit in ['google.com', 'facebook.com', 'twitter.com']):
-                return True, f"suspicious_domain_{pattern}"
+        if verdict.suspicious_pattern:
+            return True, f"suspicious_domain_{verdict.suspicious_pattern}"
         
         # Check URL for fingerprinting patterns
-        for pattern in self.fingerprinting_url_patterns:
-            if pattern in url_lower:
-                return True, f"fingerprinting_url_{pattern}"
+        url_patterns = self.fingerprinting_url_matcher.find_all(url_lower)
+        if url_patterns:
+            return True, f"fingerprinting_url_{url_patterns[0]}"
         
         # Check request body for fingerprinting parameters
-        detected_params = []
-        for param in self.fingerprinting_params:
-            if param in body_lower:
-                detected_params.append(param)
+        detected_params = self.fingerprinting_param_matcher.find_all(body_lower)
+        
+        # Check for suspicious parameter combinations
+        indicators = self.fingerprint_indicator_matcher.find_all(body_lower)
         
+        return self.body_fingerprinting_verdict(detected_params, len(indicators))
+    
+    def body_fingerprinting_verdict(self, detected_params, indicator_count):
+        """Turn fingerprinting parameters / indicator count found in a body into (flag, detail)"""
         if detected_params:
             return True, f"fingerprinting_params_{','.join(detected_params[:3])}"
         
-        # Check for suspicious parameter combinations
-        fingerprint_indicators = ["canvas", "webgl", "screen", "plugin", "font", "audio"]
-        indicator_count = sum(1 for indicator in fingerprint_indicators if indicator in body_lower)
-        
         if indicator_count >= 3:  # 3+ indicators suggests fingerprinting
             return True, f"fingerprinting_indicators_{indicator_count}"
         
         return False, None
     
-    def detect_pii(self, content, content_type=""):
-        """Enhanced PII detection using centralized rules"""
+    def scan_pii_regex(self, text, redact=False):
+        """PII regexes over the scan window of text.
+        
+        Returns (pii_types, text). With redact=True every match (overlapping
+        matches merged) is replaced by [REDACTED]; otherwise each pattern
+        stops at its first match. Text beyond pii_scan_window is passed
+        through unscanned.
+        """
+        if not text or not self.pii_regex:
+            return [], text
+        
+        window = self.pii_scan_window
+        head, tail = (text[:window], text[window:]) if window else (text, "")
+        if redact:
+            found, _, head = self.pii_regex.redact(head, '[REDACTED]')
+            return found, head + tail
+        return self.pii_regex.types(head), text
+    
+    @DETECTOR_SECONDS.time("pii_scan")
+    def inspect_pii(self, content, content_type="", redact=False, content_lower=None, raw_body=None):
+        """Detect PII and optionally produce the regex-redacted content in the same pass.
+        
+        Returns (detected_pii, redacted_content); redacted_content is None unless redact=True.
+        Bodies with a parser in body_parsers (JSON, multipart, forms) are inspected
+        leaf by leaf instead; their redacted_content is None and
+        sanitize_request_body rewrites the structure.
+        """
+        parser = get_body_parser(content_type)
+        if parser is not None:
+            try:
+                body = raw_body if raw_body is not None else content.encode('utf-8')
+                return self.inspect_structured_pii(parser, body, content_type), None
+            except ValueError:
+                pass  # Malformed body: fall back to scanning it as text
+        
         detected_pii = []
-        content_lower = content.lower()
+        if content_lower is None:
+            content_lower = content.lower()
         
         # Check basic patterns from rules
-        for pattern in self.pii_patterns:
-            if pattern in content_lower:
-                detected_pii.append(pattern.replace('=', ''))
+        for pattern in self.pii_matcher.find_all(content_lower):
+            detected_pii.append(pattern.replace('=', ''))
         
         # Check regex patterns from rules
-        for pii_type, regex in self.pii_regex_patterns.items():
-            if regex.search(content):
-                detected_pii.append(pii_type)
+        regex_types, redacted = self.scan_pii_regex(content, redact=redact)
+        detected_pii.extend(regex_types)
         
-        # Form field analysis
-        if 'application/x-www-form-urlencoded' in content_type or 'multipart/form-data' in content_type:
-            try:
-                parsed_data = urllib.parse.parse_qs(content)
-                for field_name in parsed_data.keys():
-                    field_lower = field_name.lower()
-                    # Check against suspicious form fields from rules
-                    for suspicious_field in self.suspicious_form_fields:
-                        if suspicious_field in field_lower:
-                            detected_pii.append(f"form_field_{field_lower}")
-                            break
-                    # Legacy checks
-                    if any(keyword in field_lower for keyword in ['email', 'phone', 'address', 'name', 'birth', 'ssn']):
-                        detected_pii.append(f"form_field_{field_lower}")
-            except:
-                pass
+        return list(set(detected_pii)), (redacted if redact else None)  # Remove duplicates
+    
+    def inspect_structured_pii(self, parser, body, content_type):
+        """One pass over a parsed body: key names against the keyword and form
+        field rules, PII regexes against string leaves only"""
+        detected_pii = set()
+        seen_keys = set()
+        seen_values = set()
+        regex_types = set()
+        # Leaf values share the regex scan window; repeated values are scanned once
+        budget = self.pii_scan_window or float('inf')
+        for key, value in parser.leaves(body, content_type):
+            key_lower = key.lower()
+            if key_lower and key_lower not in seen_keys:
+                seen_keys.add(key_lower)
+                for pattern in self.pii_matcher.find_all(key_lower + '='):
+                    detected_pii.add(pattern.replace('=', ''))
+                if self.form_field_matcher.search(key_lower) or self.pii_form_keyword_matcher.search(key_lower):
+                    detected_pii.add(f"form_field_{key_lower}")
+            if value and budget > 0 and value not in seen_values and len(regex_types) < len(self.pii_regex):
+                seen_values.add(value)
+                budget -= len(value)
+                regex_types.update(self.scan_leaf_pii(value)[0])
+        return list(detected_pii | regex_types)
+    
+    def scan_leaf_pii(self, value, redact=False):
+        """PII regex over one string leaf; returns (pii_types, value).
         
-        return list(set(detected_pii))  # Remove duplicates
+        A match only counts when it stands on its own in the leaf, so fragments
+        of identifiers (UUIDs, hashes, version strings) are not reported.
+        """
+        if not self.pii_regex:
+            return [], value
+        if redact:
+            found, _, value = self.pii_regex.redact(value, '[REDACTED]', accept=standalone_match)
+            return found, value
+        return self.pii_regex.spans(value, accept=standalone_match)[0], value
+    
+    def redact_leaf(self, key, value):
+        """body_parsers rewrite callback: new value for a leaf, or None to keep it"""
+        key_lower = key.lower()
+        if key_lower and (self.form_field_matcher.search(key_lower) or
+                          self.sanitize_form_keyword_matcher.search(key_lower)):
+            return '[REDACTED]'
+        if value:
+            found, redacted = self.scan_leaf_pii(value, redact=True)
+            if found:
+                return redacted
+        return None
     
+    def detect_pii(self, content, content_type=""):
+        """Enhanced PII detection using centralized rules"""
+        return self.inspect_pii(content, content_type)[0]
+    
+    @DETECTOR_SECONDS.time("tracking_params")
     def detect_tracking_parameters(self, url):
         """Detect tracking parameters in URLs"""
-        detected_params = []
         url_lower = url.lower()
-        
-        for param in self.tracking_parameters:
-            if f"{param}=" in url_lower or f"&{param}=" in url_lower:
-                detected_params.append(param)
-        
-        return detected_params
+        return [match[:-1] for match in self.tracking_parameter_matcher.find_all(url_lower)]
     
-    def sanitize_request_body(self, body, content_type):
-        """Remove or replace PII data in request bodies"""
+    @DETECTOR_SECONDS.time("sanitize")
+    def sanitize_request_body(self, body, content_type, redacted_text=None):
+        """Remove or replace PII data in request bodies
+        
+        Structured bodies are redacted in place, field by field. For other
+        bodies redacted_text is the output of inspect_pii(..., redact=True),
+        reused so the regex scan is not repeated.
+        """
         if not body:
             return body
         
-        try:
-            if 'application/x-www-form-urlencoded' in content_type:
-                parsed_data = urllib.parse.parse_qs(body.decode('utf-8', errors='ignore'))
-                for field_name, values in parsed_data.items():
-                    field_lower = field_name.lower()
-                    # Check against suspicious form fields
-                    should_redact = any(suspicious in field_lower for suspicious in self.suspicious_form_fields)
-                    if should_redact or any(keyword in field_lower for keyword in ['email', 'phone', 'address', 'ssn', 'credit']):
-                        parsed_data[field_name] = ['[REDACTED]']
-                return urllib.parse.urlencode(parsed_data, doseq=True).encode('utf-8')
-        except:
-            pass
+        parser = get_body_parser(content_type)
+        if parser is not None:
+            try:
+                return parser.rewrite(body, content_type, self.redact_leaf)
+            except ValueError:
+                pass
         
         # For other content types, use regex replacement
-        body_str = body.decode('utf-8', errors='ignore')
-        for pii_type, regex in self.pii_regex_patterns.items():
-            body_str = regex.sub('[REDACTED]', body_str)
+        if redacted_text is None:
+            redacted_text = self.scan_pii_regex(body.decode('utf-8', errors='ignore'), redact=True)[1]
         
-        return body_str.encode('utf-8')
+        return redacted_text.encode('utf-8')
 
 # Initialize rules
 privacy_rules = PrivacyRules()
 
+# === Hot Reload ===
+def reload_rules():
+    """Build a fresh PrivacyRules and swap it in with a single assignment.
+    
+    Hooks read privacy_rules once per flow, so in-flight flows finish with the
+    rule set they started with and never see a half-built one.
+    """
+    global privacy_rules
+    current = privacy_rules
+    try:
+        new_rules = PrivacyRules(current.rules_path, current.pii_scan_window, reloading=True)
+    except Exception as e:
+        print(f"⚠️ Rules reload failed, keeping current rules: {e}")
+        return False
+    privacy_rules = new_rules
+    print(f"🔄 Rules reloaded from {new_rules.rules_path}")
+    return True
+
+class RulesWatcher:
+    """Polls the rules file's mtime/size and reloads rules in a background thread"""
+    
+    def __init__(self, rules_path, interval=RULES_POLL_INTERVAL):
+        self.rules_path = rules_path
+        self.interval = interval
+        self._signature = self._stat()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rules-watcher", daemon=True)
+        self._thread.start()
+    
+    def _stat(self):
+        try:
+            stat = os.stat(self.rules_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            signature = self._stat()
+            # A failed reload (half-written file, artifact not rebuilt yet) is
+            # retried on the next poll
+            if signature is not None and signature != self._signature and reload_rules():
+                self._signature = signature
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join(self.interval)
+
+rules_watcher = RulesWatcher(privacy_rules.rules_path)
+
+# === Metrics Endpoint ===
+def _host_cache_lookups():
+    cache = privacy_rules.host_cache
+    return {("hit",): cache.hits, ("miss",): cache.misses}
+
+metrics.counter("privacy_guard_host_cache_lookups_total", "Host verdict cache lookups", ["result"],
+                callback=_host_cache_lookups)
+metrics.counter("privacy_guard_host_cache_evictions_total", "Host verdicts evicted from the cache",
+                callback=lambda: privacy_rules.host_cache.evictions)
+metrics.gauge("privacy_guard_host_cache_entries", "Host verdicts cached",
+              callback=lambda: len(privacy_rules.host_cache))
+
+metrics_server = None
+if METRICS_PORT:
+    metrics_port = METRICS_PORT + (1 + int(WORKER_INDEX) if WORKER_INDEX else 0)
+    try:
+        metrics_server = metrics.start_metrics_server(metrics_port)
+    except OSError as e:
+        print(f"⚠️ Metrics endpoint unavailable on port {metrics_port}: {e}")
+
+# === Streaming Body Inspection ===
+class StreamingBodyScanner:
+    """mitmproxy request.stream callable that inspects a body chunk by chunk.
+    
+    The body is handled as latin-1 text (one character per byte), so the
+    last `overlap` bytes are held back and rescanned with the next chunk to
+    catch matches that span a boundary. With redact=True, regex PII matches
+    are masked with '*' of the same length, which keeps Content-Length valid;
+    otherwise a PII pattern that has matched is not run again.
+    After scan_limit bytes, or scan_budget seconds of scanning, the rest of
+    the body is passed through unscanned, so a large upload is delayed by at
+    most about the budget plus one chunk's scan.
+    """
+    
+    def __init__(self, rules, content_type="", redact=False, overlap=STREAM_OVERLAP, scan_limit=STREAM_SCAN_LIMIT,
+                 scan_budget=STREAM_SCAN_BUDGET):
+        self.rules = rules
+        self.form = 'application/x-www-form-urlencoded' in content_type
+        self.redact = redact and bool(rules.pii_regex)
+        self.overlap = overlap
+        self.scan_limit = scan_limit
+        self.scan_budget = scan_budget
+        self.scan_seconds = 0.0
+        self.pii_types = []
+        self.form_fields = set()
+        self.fingerprint_params = []
+        self.fingerprint_indicators = set()
+        self.scanned = 0
+        self.redacted = 0
+        self._pending = ""
+        self._first = True
+    
+    @DETECTOR_SECONDS.time("stream_scan")
+    def __call__(self, chunk):
+        final = chunk == b""
+        text = self._pending + chunk.decode("latin-1")
+        if self.scanning and text:
+            start = time.perf_counter()
+            text = self._scan(text)
+            self.scan_seconds += time.perf_counter() - start
+            self.scanned += len(chunk)
+        
+        if final or not self.scanning:
+            out, self._pending = text, ""
+        else:
+            out, self._pending = text[:-self.overlap], text[-self.overlap:]
+        out = out.encode("latin-1")
+        if final:
+            return out
+        # An empty chunk would end a chunked HTTP/1 body early
+        return [out] if out else []
+    
+    @property
+    def scanning(self):
+        """False once the byte limit or the time budget is used up"""
+        return self.scanned < self.scan_limit and self.scan_seconds < self.scan_budget
+    
+    def _scan(self, text):
+        rules = self.rules
+        text_lower = text.lower()
+        self._add(self.pii_types, (p.replace('=', '') for p in rules.pii_matcher.find_all(text_lower)))
+        self._add(self.fingerprint_params, rules.fingerprinting_param_matcher.find_all(text_lower))
+        self.fingerprint_indicators.update(rules.fingerprint_indicator_matcher.find_all(text_lower))
+        
+        if self.form:
+            # Field names follow '&' (or start the body); a name cut by the
+            # overlap window has no '&' in front and is skipped
+            for field_name in re.findall(r'&([^=&]{1,256})=', ('&' if self._first else '') + text):
+                field_lower = urllib.parse.unquote_plus(field_name).lower()
+                if rules.form_field_matcher.search(field_lower) or rules.pii_form_keyword_matcher.search(field_lower):
+                    self.form_fields.add(f"form_field_{field_lower}")
+        self._first = False
+        
+        if not rules.pii_regex:
+            return text
+        if self.redact:
+            found, count, text = rules.pii_regex.redact(text, lambda match: '*' * len(match))
+            self._add(self.pii_types, found)
+            self.redacted += count
+            return text
+        self._add(self.pii_types, rules.pii_regex.types(text, skip=self.pii_types))
+        return text
+    
+    @staticmethod
+    def _add(found, items):
+        for item in items:
+            if item not in found:
+                found.append(item)
+    
+    def detected_pii(self):
+        return self.pii_types + sorted(self.form_fields)
+    
+    def fingerprinting(self):
+        return self.rules.body_fingerprinting_verdict(self.fingerprint_params, len(self.fingerprint_indicators))
+
+class ResponseByteCounter:
+    """Stream callable that passes a response body through and counts its bytes"""
+    
+    def __init__(self):
+        self.size = 0
+    
+    def __call__(self, chunk):
+        self.size += len(chunk)
+        return chunk
+
+def is_binary_content(content_type, content_encoding):
+    """Bodies that are never scanned: media, archives, protobuf, or still compressed"""
+    if content_encoding and content_encoding != "identity":
+        return True
+    return content_type.startswith(BINARY_CONTENT_TYPES)
+
 # === Log Event to File ===
+event_log = SegmentedEventLog(LOG_DIR, retention_hours=LOG_RETENTION_HOURS,
+                              compact_after_hours=LOG_COMPACT_AFTER_HOURS, legacy_path=LOG_PATH)
+if EVENT_COLLECTOR:
+    collector_host, _, collector_port = EVENT_COLLECTOR.rpartition(":")
+    event_writer = RemoteEventWriter((collector_host, int(collector_port)), max_queue=LOG_QUEUE_SIZE,
+                                     batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL)
+elif EVENT_DB_PATH:
+    event_writer = SQLiteEventWriter(EventStore(EVENT_DB_PATH, retention_hours=LOG_RETENTION_HOURS),
+                                     max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                                     flush_interval=LOG_FLUSH_INTERVAL)
+else:
+    event_writer = EventWriter(event_log, max_queue=LOG_QUEUE_SIZE,
+                               batch_size=LOG_BATCH_SIZE, flush_interval=LOG_FLUSH_INTERVAL)
+
 def log_event(event_data):
-    os.makedirs("logs", exist_ok=True)
+    """Queue an event for the background writer (never blocks the hook)"""
+    event_writer.write(event_data)
+
+def _event_counts():
+    stats = event_writer.stats()
+    return {("written",): stats["written"], ("dropped",): stats["dropped"], ("error",): stats["errors"]}
+
+metrics.counter("privacy_guard_events_total", "Events handed to the log writer, by outcome", ["result"],
+                callback=_event_counts)
+metrics.gauge("privacy_guard_event_queue_depth", "Events waiting for the log writer",
+              callback=lambda: event_writer.stats()["queued"])
+
+def get_visited_site(flow):
+    """Page context from the Referer header, without a leading www."""
+    referer = flow.request.headers.get("Referer", "").lower()
+    visited_site = ""
+    if "://" in referer:
+        visited_site = referer.split("://")[1].split("/")[0]
+        if visited_site.startswith("www."):
+            visited_site = visited_site[4:]
+    return visited_site
+
+def match_tracker(rules, flow, visited_site):
+    """Tracker rule (domain, URL fragment or ABP filter) for the flow's request, else None"""
+    host = flow.request.host.lower()
+    url = flow.request.pretty_url.lower()
+    return (rules.is_tracker_domain(host) or rules.is_tracker_url(url) or
+            rules.match_tracker_filter(url, host, visited_site,
+                                       flow.request.headers.get("Sec-Fetch-Dest", "")))
+
+def tracker_owner_fields(rules, host):
+    """Tracker Radar owner and category of a host, for its events"""
+    entity = rules.tracker_entity(host)
+    if entity is None:
+        return {"tracker_owner": None, "tracker_category": None}
+    return {"tracker_owner": entity.display_name or None, "tracker_category": entity.category or None}
+
+def flow_tracker_owner(rules, flow):
+    """tracker_owner_fields of the flow's host, looked up once and kept in its metadata"""
+    if "tracker_owner" not in flow.metadata:
+        flow.metadata["tracker_owner"] = tracker_owner_fields(rules, flow.request.host.lower())
+    return flow.metadata["tracker_owner"]
+
+def inspection_bypass(rules, flow, visited_site):
+    """'whitelist' or 'first_party' when the flow needs no body, PII or fingerprinting scan, else None"""
+    host = flow.request.host.lower()
+    verdict = rules.host_verdict(host)
+    if verdict.whitelist_rule:
+        return "whitelist"
+    # Same site as the page (per Referer) and not flagged by any host or URL rule
+    if (visited_site and not verdict.fingerprinting_service and not verdict.suspicious_pattern
+            and base_domain(host) == base_domain(visited_site.split(":")[0])
+            and not match_tracker(rules, flow, visited_site)):
+        return "first_party"
+    return None
+
+def flow_tracker_rule(rules, flow, visited_site):
+    """match_tracker for the flow, evaluated once and kept in its metadata.
+    
+    First-party bypassed flows were already checked by inspection_bypass.
+    """
+    if "tracker_rule" not in flow.metadata:
+        first_party = flow.metadata.get("inspection_bypass") == "first_party"
+        flow.metadata["tracker_rule"] = None if first_party else match_tracker(rules, flow, visited_site)
+    return flow.metadata["tracker_rule"]
+
+# Flows seen by request(), by inspection outcome
+inspection_counts = Counter()
+metrics.counter("privacy_guard_flows_total", "Flows seen by request(), by inspection outcome", ["outcome"],
+                callback=lambda: {(outcome,): count for outcome, count in inspection_counts.items()})
+
+# === Request Headers: choose buffered or streamed inspection ===
+@HOOK_SECONDS.time("requestheaders")
+def requestheaders(flow: http.HTTPFlow) -> None:
+    rules = privacy_rules
+    headers = flow.request.headers
+    content_type = headers.get("Content-Type", "").lower()
     try:
-        with open(LOG_PATH, "a") as f:
-            f.write(json.dumps(event_data) + "\n")
-    except Exception as e:
-        print(f"Logging failed: {e}")
+        content_length = int(headers["Content-Length"])
+    except (KeyError, ValueError):
+        content_length = None  # Chunked HTTP/1 upload, or HTTP/2 and HTTP/3 bodies sent without one
+    if content_length == 0 or flow.request.method in ("GET", "HEAD", "OPTIONS"):
+        return
+    
+    visited_site = get_visited_site(flow)
+    bypass = inspection_bypass(rules, flow, visited_site)
+    flow.metadata["inspection_bypass"] = bypass
+    matched_domain = flow_tracker_rule(rules, flow, visited_site)
+    if rules.proxy_action == "block" and matched_domain:
+        return  # Buffered so request() can answer with the block page
+    
+    if bypass or is_binary_content(content_type, headers.get("Content-Encoding", "").lower()):
+        flow.request.stream = True  # Forwarded as it arrives, never buffered
+        flow.metadata["body_inspection"] = "skipped"
+    elif ((content_length or 0) > STREAM_BODY_THRESHOLD
+          or "chunked" in headers.get("Transfer-Encoding", "").lower()):
+        scanner = StreamingBodyScanner(rules, content_type, redact=bool(matched_domain))
+        flow.request.stream = scanner
+        flow.metadata["body_inspection"] = "streamed"
 
 # === Request Interception ===
+@HOOK_SECONDS.time("request")
 def request(flow: http.HTTPFlow) -> None:
+    # One consistent rule set for the whole flow (a streamed body was
+    # scanned with the rules current when its headers arrived)
+    scanner = flow.request.stream if isinstance(flow.request.stream, StreamingBodyScanner) else None
+    rules = scanner.rules if scanner else privacy_rules
     host = flow.request.host.lower()
     url = flow.request.pretty_url.lower()
-    body = flow.request.content.decode(errors="ignore") if flow.request.content else ""
     content_type = flow.request.headers.get("Content-Type", "").lower()
     session_id = flow.request.headers.get("X-PrivacyProxy-Session", "").strip()
+    body_inspection = flow.metadata.get("body_inspection", "buffered")
 
     # Get page context from Referer header
-    referer = flow.request.headers.get("Referer", "").lower()
-    visited_site = ""
-    if "://" in referer:
-        visited_site = referer.split("://")[1].split("/")[0]
-        if visited_site.startswith("www."):
-            visited_site = visited_site[4:]
+    visited_site = get_visited_site(flow)
+    # Carried to response() so it does not re-derive them
+    flow.metadata["visited_site"] = visited_site
+    flow.metadata["session"] = session_id
+
+    # Whitelisted and first-party traffic skips the body, PII and fingerprinting scans
+    if "inspection_bypass" in flow.metadata:
+        bypass = flow.metadata["inspection_bypass"]
+    else:
+        bypass = inspection_bypass(rules, flow, visited_site)
+        flow.metadata["inspection_bypass"] = bypass
+    inspection_counts[bypass or "inspected"] += 1
 
     # Enhanced detection using centralized rules
-    matched_domain = privacy_rules.is_tracker_domain(host)
-    detected_pii = privacy_rules.detect_pii(body, content_type)
-    tracking_params = privacy_rules.detect_tracking_parameters(url)
-    has_pii = len(detected_pii) > 0
+    matched_domain = flow_tracker_rule(rules, flow, visited_site)
+    tracking_params = rules.detect_tracking_parameters(url)
     
-    # NEW: Enhanced fingerprinting detection
-    is_fingerprinting, fingerprint_detail = privacy_rules.detect_fingerprinting(url, body, flow.request.headers)
+    if bypass:
+        body_inspection = "skipped"
+        detected_pii, redacted_body = [], None
+        is_fingerprinting, fingerprint_detail = False, None
+    elif body_inspection == "buffered":
+        # Decode and lowercase the body once for every detector
+        body = flow.request.content.decode(errors="ignore") if flow.request.content else ""
+        body_lower = body.lower()
+        detected_pii, redacted_body = rules.inspect_pii(body, content_type, redact=bool(matched_domain),
+                                                        content_lower=body_lower, raw_body=flow.request.content)
+        # NEW: Enhanced fingerprinting detection
+        is_fingerprinting, fingerprint_detail = rules.detect_fingerprinting(url, body, flow.request.headers,
+                                                                            body_lower=body_lower, hostname=host)
+    else:
+        # The body was already forwarded chunk by chunk
+        detected_pii, redacted_body = (scanner.detected_pii() if scanner else []), None
+        is_fingerprinting, fingerprint_detail = rules.detect_fingerprinting(url, "", flow.request.headers,
+                                                                            hostname=host)
+        if not is_fingerprinting and scanner:
+            is_fingerprinting, fingerprint_detail = scanner.fingerprinting()
+    has_pii = len(detected_pii) > 0
 
     # Log all threats: trackers, PII, fingerprinting
     if matched_domain or has_pii or tracking_params or is_fingerprinting:
-        print(f"\n🔍 Intercepted at: {datetime.now()}")
-        print(f"Visited Site: {visited_site or 'Unknown'}")
-        print(f"Request Host: {host}")
-        print(f"Tracker Domain: {matched_domain}")
-        print(f"PII Detected: {detected_pii}")
-        print(f"Tracking Params: {tracking_params}")
-        print(f"Fingerprinting: {is_fingerprinting} ({fingerprint_detail})")
-        print(f"Content Type: {content_type}\n")
+        log.info("🔍 %s on %s: tracker=%s pii=%s params=%s fingerprinting=%s content=%s (body %s)",
+                 host, visited_site or "unknown", matched_domain, detected_pii, tracking_params,
+                 fingerprint_detail if is_fingerprinting else None, content_type, body_inspection)
+        if matched_domain:
+            RULE_MATCHES.inc("tracker")
+        if tracking_params:
+            RULE_MATCHES.inc("tracking_parameter")
+        if is_fingerprinting:
+            RULE_MATCHES.inc("fingerprinting")
+        for pii_type in detected_pii:
+            PII_MATCHES.inc(pii_type)
 
         # Log tracker/PII event
         if matched_domain or has_pii or tracking_params:
@@ -243,7 +717,9 @@ def request(flow: http.HTTPFlow) -> None:
                 "visited_site": visited_site or "unknown",
                 "hostname": host,
                 "url": url,
-                "tracker": matched_domain,
+                "tracker": bool(matched_domain),
+                "tracker_rule": matched_domain,
+                **flow_tracker_owner(rules, flow),
                 "pii": has_pii,
                 "pii_types": detected_pii,
                 "tracking_parameters": tracking_params,
@@ -275,49 +751,106 @@ def request(flow: http.HTTPFlow) -> None:
             })
 
         # Handle actions based on rules
-        if privacy_rules.proxy_action == "block" and matched_domain:
+        if rules.proxy_action == "block" and matched_domain:
             flow.response = http.Response.make(
                 403,
                 b"Blocked by Privacy Tool - Tracking domain detected.",
                 {"Content-Type": "text/plain"}
             )
+            ACTIONS.inc("blocked")
             return
 
         # Sanitize PII in requests to third parties
-        if has_pii and matched_domain:
-            print(f"🛡️ Sanitizing PII in request to {host}")
-            flow.request.content = privacy_rules.sanitize_request_body(flow.request.content, content_type)
+        if scanner and scanner.redacted:
+            ACTIONS.inc("masked_streamed")
+            log.info("🛡️ Masked %d PII matches in streamed request to %s", scanner.redacted, host)
+        if has_pii and matched_domain and body_inspection == "buffered":
+            ACTIONS.inc("sanitized")
+            log.info("🛡️ Sanitizing PII in request to %s", host)
+            flow.request.content = rules.sanitize_request_body(flow.request.content, content_type, redacted_body)
             # Update content-length header
             flow.request.headers["Content-Length"] = str(len(flow.request.content))
 
+# === Response Headers: stream bodies that are never inspected ===
+@HOOK_SECONDS.time("responseheaders")
+def responseheaders(flow: http.HTTPFlow) -> None:
+    headers = flow.response.headers
+    content_type = headers.get("Content-Type", "").lower()
+    try:
+        content_length = int(headers["Content-Length"])
+    except (KeyError, ValueError):
+        content_length = None
+    flow.metadata["response_size"] = content_length
+    
+    if "image" in content_type and content_length is None:
+        # Count the bytes as they pass so response() can still size a pixel
+        flow.response.stream = ResponseByteCounter()
+    elif content_type.startswith(BINARY_CONTENT_TYPES) or (content_length or 0) > STREAM_BODY_THRESHOLD:
+        flow.response.stream = True
+
+def response_size(flow):
+    """Response body size on the wire, without buffering or decoding it"""
+    if isinstance(flow.response.stream, ResponseByteCounter):
+        return flow.response.stream.size
+    if flow.metadata.get("response_size") is not None:
+        return flow.metadata["response_size"]
+    if flow.response.raw_content is not None:
+        return len(flow.response.raw_content)
+    return None
+
 # === Response Interception ===
+@HOOK_SECONDS.time("response")
 def response(flow: http.HTTPFlow) -> None:
     """Analyze responses for tracking pixels, scripts, etc."""
-    if flow.response.status_code == 200:
-        content_type = flow.response.headers.get("Content-Type", "").lower()
-        
-        # Check for tracking pixels (1x1 images)
-        if "image" in content_type and len(flow.response.content) < 100:
+    if flow.response.status_code != 200:
+        return
+    content_type = flow.response.headers.get("Content-Type", "").lower()
+    
+    # Check for tracking pixels (tiny images)
+    if "image" not in content_type:
+        return
+    size = response_size(flow)
+    if size is not None and size < PIXEL_MAX_BYTES:
+        RULE_MATCHES.inc("tracking_pixel")
+        if "visited_site" in flow.metadata:
+            visited_site = flow.metadata["visited_site"]
+            session_id = flow.metadata["session"]
+        else:
+            visited_site = get_visited_site(flow)
             session_id = flow.request.headers.get("X-PrivacyProxy-Session", "").strip()
-            referer = flow.request.headers.get("Referer", "").lower()
-            visited_site = ""
-            if "://" in referer:
-                visited_site = referer.split("://")[1].split("/")[0]
-                if visited_site.startswith("www."):
-                    visited_site = visited_site[4:]
-            
-            log_event({
-                "timestamp": datetime.now().isoformat(),
-                "visited_site": visited_site or "unknown",
-                "hostname": flow.request.host.lower(),
-                "url": flow.request.pretty_url.lower(),
-                "tracker": True,
-                "pii": False,
-                "pii_types": [],
-                "session": session_id,
-                "fingerprinting": False,
-                "storage": False,
-                "source": "proxy",
-                "method": "tracking_pixel",
-                "content_type": content_type
-            })
+        
+        log_event({
+            "timestamp": datetime.now().isoformat(),
+            "visited_site": visited_site or "unknown",
+            "hostname": flow.request.host.lower(),
+            "url": flow.request.pretty_url.lower(),
+            "tracker": True,
+            "tracker_rule": flow.metadata.get("tracker_rule"),
+            **flow_tracker_owner(privacy_rules, flow),
+            "pii": False,
+            "pii_types": [],
+            "session": session_id,
+            "fingerprinting": False,
+            "storage": False,
+            "source": "proxy",
+            "method": "tracking_pixel",
+            "content_type": content_type
+        })
+
+# === Shutdown ===
+def done():
+    """Flush pending events when mitmproxy shuts down or reloads the script"""
+    rules_watcher.stop()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+    event_writer.close()
+    stats = event_writer.stats()
+    print(f"📝 Event writer stopped: {stats['written']} written, {stats['dropped']} dropped, "
+          f"{stats['errors']} failed")
+    cache_stats = privacy_rules.host_cache.stats()
+    print(f"🗂️ Host verdict cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+          f"{cache_stats['evictions']} evictions")
+    bypassed = inspection_counts["whitelist"] + inspection_counts["first_party"]
+    print(f"⏭️ Inspection bypassed for {bypassed} of {sum(inspection_counts.values())} flows "
+          f"({inspection_counts['whitelist']} whitelisted, {inspection_counts['first_party']} first-party)")
@@ -0,0 +1,763 @@
+"""
+Lookup structures for Privacy Guard rules.
+Built once when rules are loaded so per-request matching stays cheap.
+"""
+
+import os
+import re
+import sys
+import json
+import mmap
+import pickle
+import struct
+import hashlib
+import zlib
+import time
+import array
+import bisect
+import random
+import threading
+from collections import OrderedDict
+from filter_engine import FilterEngine
+
+FINGERPRINT_INDICATORS = ["canvas", "webgl", "screen", "plugin", "font", "audio"]
+PII_FORM_KEYWORDS = ["email", "phone", "address", "name", "birth", "ssn"]
+SANITIZE_FORM_KEYWORDS = ["email", "phone", "address", "ssn", "credit"]
+
+ARTIFACT_MAGIC = b"PGRA"
+ARTIFACT_VERSION = 7
+# magic, version, source sha256, domain count, slot count, meta offset, meta length,
+# prefilter offset, prefilter word count
+_ARTIFACT_HEADER = struct.Struct("<4sI32sIIQQQI")
+_SLOT = struct.Struct("<IH")  # Absolute offset and length of a domain (length 0 = empty)
+
+# Tracker domain prefilter (see DomainPrefilter)
+PREFILTER_BITS_PER_DOMAIN = 12
+PREFILTER_PATTERN_BITS = 12  # 4096 bit patterns, picked by the top bits of the hash
+PREFILTER_PATTERN_PROBES = 5  # Bits set in each pattern
+PREFILTER_MAX_WORDS = 1 << (32 - PREFILTER_PATTERN_BITS)  # Word index and pattern index use disjoint hash bits
+PREFILTER_SEED = 0x5EED
+
+
+def _match_suffixes(contains, hostname):
+    """Return the longest suffix of hostname (at a label boundary) accepted by contains"""
+    if not hostname:
+        return None
+    hostname = hostname.lower()
+    if contains(hostname):
+        return hostname
+    index = hostname.find(".")
+    while index != -1:
+        suffix = hostname[index + 1:]
+        if contains(suffix):
+            return suffix
+        index = hostname.find(".", index + 1)
+    return None
+
+
+class DomainSuffixIndex:
+    """Hash-set index answering "is this hostname, or a parent of it, listed?"
+
+    A lookup walks the hostname's parent suffixes (a.b.example.com,
+    b.example.com, example.com, com) so it costs O(number of labels)
+    instead of a scan over every listed domain.
+    """
+
+    def __init__(self, domains=()):
+        self.domains = set()
+        for domain in domains:
+            self.add(domain)
+
+    def add(self, domain):
+        """Add a domain rule to the index"""
+        if domain:
+            self.domains.add(domain.lower())
+
+    def __len__(self):
+        return len(self.domains)
+
+    def __contains__(self, domain):
+        return domain in self.domains
+
+    def __iter__(self):
+        return iter(self.domains)
+
+    def match(self, hostname):
+        """Return the most specific listed domain covering hostname, or None"""
+        return _match_suffixes(self.domains.__contains__, hostname)
+
+
+class DomainPrefilter:
+    """Pattern-blocked Bloom filter over domains: answers "definitely not listed".
+
+    Each domain sets PREFILTER_PATTERN_PROBES bits inside one 64-bit word.
+    A single crc32 picks the word (low bits) and one of a table of
+    precomputed bit patterns (top bits), so a probe is one hash, two
+    indexings and a mask test. False positives fall through to the exact
+    table. words and patterns are sequences of 64-bit ints (memoryviews
+    over the artifact once written).
+    """
+
+    def __init__(self, words, patterns):
+        self._words = words
+        self._patterns = patterns
+        self._mask = len(words) - 1
+        self._shift = 32 - PREFILTER_PATTERN_BITS
+
+    @staticmethod
+    def patterns():
+        """The 64-bit patterns a domain's bits are taken from"""
+        rng = random.Random(PREFILTER_SEED)
+        return [sum(1 << bit for bit in rng.sample(range(64), PREFILTER_PATTERN_PROBES))
+                for _ in range(1 << PREFILTER_PATTERN_BITS)]
+
+    @classmethod
+    def build(cls, keys, bits_per_domain=PREFILTER_BITS_PER_DOMAIN):
+        """Filter over encoded domain names"""
+        keys = list(keys)
+        word_count = 1
+        while word_count * 64 < len(keys) * bits_per_domain and word_count < PREFILTER_MAX_WORDS:
+            word_count *= 2
+        patterns = cls.patterns()
+        words = [0] * word_count
+        mask = word_count - 1
+        shift = 32 - PREFILTER_PATTERN_BITS
+        for key in keys:
+            h = zlib.crc32(key)
+            words[h & mask] |= patterns[h >> shift]
+        return cls(words, patterns)
+
+    def might_contain(self, key):
+        """False only if the encoded domain was never added"""
+        h = zlib.crc32(key)
+        pattern = self._patterns[h >> self._shift]
+        return self._words[h & self._mask] & pattern == pattern
+
+    def to_bytes(self):
+        """Words then patterns, as native 64-bit ints"""
+        return array.array("Q", self._words).tobytes() + array.array("Q", self._patterns).tobytes()
+
+    @property
+    def nbytes(self):
+        return 8 * (len(self._words) + len(self._patterns))
+
+    def false_positive_rate(self, keys):
+        """Share of encoded non-member domains the filter lets through"""
+        keys = list(keys)
+        return sum(1 for key in keys if self.might_contain(key)) / len(keys) if keys else 0.0
+
+
+class DomainHashTable:
+    """Read-only open-addressing hash table of domains inside a mapped artifact.
+
+    Domains are stored sorted in one blob; a slot array (crc32, linear
+    probing) indexes them. Nothing is copied at load time and the pages are
+    shared by every process mapping the same file. With a prefilter, suffixes
+    it rules out skip the table probe.
+    """
+
+    def __init__(self, buffer, count, slot_count, slots_offset, prefilter=None):
+        self._buffer = buffer
+        self._count = count
+        self._mask = slot_count - 1
+        self._slots_offset = slots_offset
+        self.prefilter = prefilter
+        if prefilter is None:
+            self._probe = self._lookup
+        else:
+            might_contain, lookup = prefilter.might_contain, self._lookup
+            self._probe = lambda key: might_contain(key) and lookup(key)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        """Bytes of the slot array and domain blob"""
+        blob_size = sum(_SLOT.unpack_from(self._buffer, self._slots_offset + slot * _SLOT.size)[1]
+                        for slot in range(self._mask + 1))
+        return (self._mask + 1) * _SLOT.size + blob_size
+
+    def __contains__(self, domain):
+        return self._probe(domain.lower().encode("utf-8", errors="ignore"))
+
+    def _lookup(self, key):
+        buffer = self._buffer
+        unpack = _SLOT.unpack_from
+        base = self._slots_offset
+        mask = self._mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            offset, length = unpack(buffer, base + slot * _SLOT.size)
+            if not length:
+                return False
+            if length == len(key) and buffer[offset:offset + length] == key:
+                return True
+            slot = (slot + 1) & mask
+
+    def __iter__(self):
+        unpack = _SLOT.unpack_from
+        entries = []
+        for slot in range(self._mask + 1):
+            offset, length = unpack(self._buffer, self._slots_offset + slot * _SLOT.size)
+            if length:
+                entries.append((offset, length))
+        for offset, length in sorted(entries):
+            yield self._buffer[offset:offset + length].decode("utf-8")
+
+    def match(self, hostname):
+        """Return the most specific listed domain covering hostname, or None"""
+        if not hostname:
+            return None
+        # Same walk as _match_suffixes, but over bytes to encode only once
+        key = hostname.lower().encode("utf-8", errors="ignore")
+        lookup = self._probe
+        if lookup(key):
+            return key.decode("utf-8")
+        index = key.find(b".")
+        while index != -1:
+            suffix = key[index + 1:]
+            if lookup(suffix):
+                return suffix.decode("utf-8")
+            index = key.find(b".", index + 1)
+        return None
+
+
+class TrackerEntity:
+    """Owner, category and prevalence of one tracker domain.
+
+    Owner names and categories are shared strings from the index tables,
+    so a record costs four slots.
+    """
+
+    __slots__ = ("owner", "display_name", "category", "prevalence")
+
+    def __init__(self, owner, display_name, category, prevalence):
+        self.owner = owner
+        self.display_name = display_name
+        self.category = category
+        self.prevalence = prevalence
+
+    def __repr__(self):
+        return f"TrackerEntity({self.owner!r}, {self.category!r}, {self.prevalence!r})"
+
+
+class TrackerEntityIndex:
+    """Tracker domain -> TrackerEntity, from the rules' tracker_entities section.
+
+    The section is stored interned:
+
+        {"owners": [[name, display name], ...], "categories": [...],
+         "domains": {domain: [owner index, category index, prevalence]}}
+
+    An index of -1 means unknown. Keys are tracker_domains entries, so the
+    rule returned by a domain match looks the entity up directly.
+    """
+
+    def __init__(self, section=None):
+        section = section or {}
+        owners = [(sys.intern(name), display or name) for name, display in section.get("owners", [])]
+        categories = [sys.intern(category) for category in section.get("categories", [])]
+        self._domains = {}
+        for domain, (owner_index, category_index, prevalence) in section.get("domains", {}).items():
+            name, display_name = owners[owner_index] if owner_index >= 0 else ("", "")
+            category = categories[category_index] if category_index >= 0 else ""
+            self._domains[domain] = TrackerEntity(name, display_name, category, prevalence)
+        self.owner_count = len(owners)
+
+    def __len__(self):
+        return len(self._domains)
+
+    def get(self, domain):
+        """Entity of a tracker domain rule, else None"""
+        return self._domains.get(domain)
+
+    @staticmethod
+    def decode(section):
+        """{domain: (owner, display name, category, prevalence)} from a section (inverse of encode)"""
+        section = section or {}
+        owners = section.get("owners", [])
+        categories = section.get("categories", [])
+        entities = {}
+        for domain, (owner_index, category_index, prevalence) in section.get("domains", {}).items():
+            owner, display_name = owners[owner_index] if owner_index >= 0 else ("", "")
+            entities[domain] = (owner, display_name, categories[category_index] if category_index >= 0 else "",
+                                prevalence)
+        return entities
+
+    @staticmethod
+    def encode(entities):
+        """Section for a {domain: (owner, display name, category, prevalence)} dict"""
+        owners, categories, domains = {}, {}, {}
+        for domain in sorted(entities):
+            owner, display_name, category, prevalence = entities[domain]
+            owner_index = owners.setdefault((owner, display_name), len(owners)) if owner else -1
+            category_index = categories.setdefault(category, len(categories)) if category else -1
+            domains[domain] = [owner_index, category_index, prevalence]
+        return {"owners": [list(owner) for owner in owners], "categories": list(categories), "domains": domains}
+
+
+class LazyRegex:
+    """re.Pattern stand-in that compiles on first use.
+
+    Compiled patterns cannot be serialized, so the artifact stores only the
+    source and the cost of compiling moves from startup to the first match.
+    """
+
+    def __init__(self, pattern, flags=0, compiled=None):
+        self.pattern = pattern
+        self.flags = flags
+        self._compiled = compiled
+
+    def compile(self):
+        if self._compiled is None:
+            self._compiled = re.compile(self.pattern, self.flags)
+        return self._compiled
+
+    def __getattr__(self, name):
+        # search / finditer / sub / ... are delegated to the compiled pattern
+        return getattr(self.compile(), name)
+
+    def __getstate__(self):
+        return {"pattern": self.pattern, "flags": self.flags}
+
+    def __setstate__(self, state):
+        self.pattern = state["pattern"]
+        self.flags = state["flags"]
+        self._compiled = None
+
+
+class PIIRegexSet:
+    """The PII regex patterns, scanned one by one with overlapping matches resolved.
+
+    The patterns overlap (license_plate matches the start of an SSN or a
+    phone number), so a single alternation would let the leftmost pattern
+    win and leave the rest of the value in the clear. Here every pattern
+    is run separately; where matches overlap the longest one wins (the
+    earlier pattern on a tie) and the others are dropped.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = dict(patterns)  # PII type -> LazyRegex
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def types(self, text, skip=()):
+        """PII types with at least one match in text (each pattern stops at its first match).
+
+        Types in skip, already found elsewhere, are not searched for.
+        """
+        return [name for name, regex in self.patterns.items() if name not in skip and regex.search(text)]
+
+    def spans(self, text, accept=None):
+        """Return (pii types, non-overlapping (start, end) spans in order) for text.
+
+        Leading and trailing whitespace is trimmed from every match (the phone
+        pattern may start on a separator). accept(text, start, end) may trim
+        a match further, returning the new (start, end), or reject it with
+        None; the pattern is then retried just past the rejected match's
+        start. Types are those of the spans kept.
+        """
+        names = list(self.patterns)
+        candidates = []
+        for order, regex in enumerate(self.patterns.values()):
+            position = 0
+            while position <= len(text):
+                match = regex.search(text, position)
+                if match is None:
+                    break
+                start, end = match.span()
+                while start < end and text[start].isspace():
+                    start += 1
+                while end > start and text[end - 1].isspace():
+                    end -= 1
+                span = accept(text, start, end) if accept is not None and start < end else (start, end)
+                if span is None or span[0] >= span[1]:
+                    position = match.start() + 1
+                    continue
+                candidates.append((span[0], span[1], order))
+                position = max(match.end(), match.start() + 1)
+
+        starts, ends, kept = [], [], set()
+        for start, end, order in sorted(candidates, key=lambda c: (c[0] - c[1], c[2], c[0])):
+            index = bisect.bisect_right(starts, start)
+            if (index and ends[index - 1] > start) or (index < len(starts) and starts[index] < end):
+                continue
+            starts.insert(index, start)
+            ends.insert(index, end)
+            kept.add(order)
+        return [names[order] for order in sorted(kept)], list(zip(starts, ends))
+
+    def redact(self, text, replacement, accept=None):
+        """Return (pii types, span count, text with every span replaced).
+
+        replacement is a string, or a function of the matched text.
+        """
+        found, spans = self.spans(text, accept)
+        if not spans:
+            return found, 0, text
+        pieces = []
+        position = 0
+        for start, end in spans:
+            pieces.append(text[position:start])
+            pieces.append(replacement(text[start:end]) if callable(replacement) else replacement)
+            position = end
+        pieces.append(text[position:])
+        return found, len(spans), "".join(pieces)
+
+
+class PatternMatcher:
+    """Multi-substring matcher that reports every pattern found in one pass.
+
+    The patterns are compiled into a single trie-shaped regex (an
+    Aho-Corasick style automaton run by the C regex engine), so scanning a
+    body costs one pass instead of one ``in`` test per pattern.
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = list(dict.fromkeys(p for p in patterns if p))
+        # The regex reports the longest pattern at each start position, so
+        # remember which shorter patterns share that start (its prefixes).
+        self._prefixes = {
+            pattern: [p for p in self.patterns if pattern.startswith(p)]
+            for pattern in self.patterns
+        }
+        self._regex = LazyRegex(_trie_regex(self.patterns)) if self.patterns else None
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def search(self, text):
+        """Return the leftmost pattern found in text, or None"""
+        if not text or self._regex is None:
+            return None
+        match = self._regex.search(text)
+        return match.group() if match else None
+
+    def find_all(self, text):
+        """Return every pattern occurring in text, in declaration order"""
+        if not text or self._regex is None:
+            return []
+        found = set()
+        search = self._regex.search
+        prefixes = self._prefixes
+        total = len(self.patterns)
+        pos = 0
+        while len(found) < total:
+            match = search(text, pos)
+            if match is None:
+                break
+            found.update(prefixes[match.group()])
+            pos = match.start() + 1
+        return [p for p in self.patterns if p in found]
+
+
+def _trie_regex(patterns):
+    """Build a regex matching any of patterns, structured as a prefix trie"""
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return _trie_node_regex(trie)
+
+
+def _trie_node_regex(node):
+    branches = [re.escape(char) + _trie_node_regex(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        # Greedy optional tail: prefer the longest pattern ending here
+        return "(?:" + body + ")?"
+    return body
+
+
+class LRUCache:
+    """Bounded least-recently-used cache whose entries expire after ttl seconds"""
+
+    def __init__(self, max_size=4096, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Return cache counters"""
+        return {"size": len(self._entries), "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+
+class CompiledRules:
+    """Everything PrivacyRules needs at match time, built from a rules dict"""
+
+    def __init__(self, rules):
+        # Sections compiled into their own indexes below are not kept twice
+        self.rules = {k: v for k, v in rules.items()
+                      if k not in ("tracker_domains", "tracker_entities", "tracker_filters")}
+
+        # Load tracker domains into a suffix index
+        self.tracker_domains = DomainSuffixIndex(rules.get("tracker_domains", []))
+
+        # Owner / category / prevalence of tracker domains (from Tracker Radar)
+        self.tracker_entities = TrackerEntityIndex(rules.get("tracker_entities"))
+
+        # Load URL fragment rules kept apart from the tracker domains
+        self.tracker_url_patterns = [p.lower() for p in rules.get("tracker_url_patterns", [])]
+
+        # Index Adblock Plus network filters (per source list) for URL matching
+        filter_lists = rules.get("tracker_filters", {})
+        if isinstance(filter_lists, dict):
+            filter_lists = [line for lines in filter_lists.values() for line in lines]
+        self.filter_engine = FilterEngine(filter_lists)
+
+        # Load whitelisted sites (the host or any parent domain)
+        self.whitelist_domains = DomainSuffixIndex(rules.get("whitelist", {}).get("domains", []))
+
+        # Load fingerprinting domains
+        fingerprinting_domains = rules.get("fingerprinting_domains", [])
+        self.fingerprinting_domains = set(fingerprinting_domains)
+
+        # Load PII patterns
+        self.pii_patterns = [p.lower() for p in rules.get("pii_patterns", [])]
+
+        # Compile regex patterns from rules
+        self.pii_regex_patterns = {}
+        pii_regex = rules.get("pii_regex_patterns", {})
+        for name, pattern in pii_regex.items():
+            try:
+                self.pii_regex_patterns[name] = LazyRegex(pattern, re.IGNORECASE,
+                                                          re.compile(pattern, re.IGNORECASE))
+            except re.error as e:
+                print(f"Warning: Invalid regex pattern for {name}: {e}")
+
+        # Each pattern is scanned on its own and overlapping matches merged
+        self.pii_regex = PIIRegexSet(self.pii_regex_patterns)
+
+        # Load suspicious form fields
+        self.suspicious_form_fields = rules.get("suspicious_form_fields", [])
+
+        # Load tracking parameters
+        self.tracking_parameters = rules.get("tracking_parameters", [])
+
+        # Load actions
+        self.proxy_action = rules.get("actions", {}).get("proxy", "log")
+
+        # Fingerprinting detection patterns
+        self.fingerprinting_url_patterns = [
+            "fingerprint", "fp-collect", "device-id", "browser-id", "client-id",
+            "visitor-id", "canvas-hash", "webgl-hash", "digital-fingerprint"
+        ]
+
+        self.fingerprinting_params = [
+            "canvas_hash", "webgl_vendor", "webgl_renderer", "screen_resolution",
+            "timezone_offset", "browser_plugins", "font_list", "hardware_concurrency",
+            "device_memory", "user_agent_hash", "audio_hash", "client_rects",
+            "touch_support", "webgl_params", "canvas_fingerprint", "audio_fingerprint"
+        ]
+
+        self.suspicious_domain_patterns = [
+            "googletourist", "googleanalytic", "facebookcdn", "twitterapi",
+            "amazonapi", "microsoftapi"
+        ]
+
+        # Compile one multi-pattern matcher per substring rule family
+        self.pii_matcher = PatternMatcher(self.pii_patterns)
+        self.tracker_url_matcher = PatternMatcher(self.tracker_url_patterns)
+        self.form_field_matcher = PatternMatcher(self.suspicious_form_fields)
+        self.pii_form_keyword_matcher = PatternMatcher(PII_FORM_KEYWORDS)
+        self.sanitize_form_keyword_matcher = PatternMatcher(SANITIZE_FORM_KEYWORDS)
+        self.tracking_parameter_matcher = PatternMatcher(f"{p}=" for p in self.tracking_parameters)
+        self.fingerprinting_domain_matcher = PatternMatcher(fingerprinting_domains)
+        self.suspicious_domain_matcher = PatternMatcher(self.suspicious_domain_patterns)
+        self.fingerprinting_url_matcher = PatternMatcher(self.fingerprinting_url_patterns)
+        self.fingerprinting_param_matcher = PatternMatcher(self.fingerprinting_params)
+        self.fingerprint_indicator_matcher = PatternMatcher(FINGERPRINT_INDICATORS)
+
+    def __getstate__(self):
+        # Tracker domains live in the artifact's hash table, not the pickle
+        state = dict(vars(self))
+        state.pop("tracker_domains", None)
+        return state
+
+    def __setstate__(self, state):
+        vars(self).update(state)
+        self.tracker_domains = DomainSuffixIndex()
+
+
+# === Precompiled rules artifact ===
+#
+# Layout: header | sorted domain blob | slot array | pickled CompiledRules
+# (without the tracker domains). The artifact is keyed by the SHA-256 of the
+# rules JSON it was built from, so an edited rules file is never shadowed by
+# a stale artifact.
+
+def artifact_path_for(rules_path):
+    """Return the artifact path that accompanies a rules JSON file"""
+    return os.path.splitext(rules_path)[0] + ".idx"
+
+
+def _file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def artifact_is_current(rules_path, artifact_path=None):
+    """True if the artifact exists, has this ARTIFACT_VERSION and was built from rules_path as it is now.
+
+    Only the header is read.
+    """
+    artifact_path = artifact_path or artifact_path_for(rules_path)
+    try:
+        with open(artifact_path, "rb") as f:
+            header = f.read(_ARTIFACT_HEADER.size)
+    except OSError:
+        return False
+    if len(header) < _ARTIFACT_HEADER.size:
+        return False
+    magic, version, source_hash = _ARTIFACT_HEADER.unpack(header)[:3]
+    return magic == ARTIFACT_MAGIC and version == ARTIFACT_VERSION and source_hash == _file_sha256(rules_path)
+
+
+def write_rules_artifact(rules_path, artifact_path=None, compiled=None, raw=None):
+    """Build the precompiled artifact for rules_path; returns the artifact path
+
+    A caller that already compiled the rules passes them as compiled together
+    with the raw JSON bytes they were compiled from.
+    """
+    artifact_path = artifact_path or artifact_path_for(rules_path)
+    if raw is None:
+        with open(rules_path, "rb") as f:
+            raw = f.read()
+    source_hash = hashlib.sha256(raw).digest()
+    if compiled is None:
+        compiled = CompiledRules(json.loads(raw))
+
+    domains = sorted(compiled.tracker_domains)
+    slot_count = 1
+    while slot_count < max(4 * len(domains), 8):  # Load factor <= 0.25 keeps misses short
+        slot_count *= 2
+    mask = slot_count - 1
+
+    blob = bytearray()
+    slots = bytearray(slot_count * _SLOT.size)
+    blob_offset = _ARTIFACT_HEADER.size
+    keys = []
+    for domain in domains:
+        key = domain.encode("utf-8")
+        if not key or len(key) > 0xFFFF:
+            continue
+        slot = zlib.crc32(key) & mask
+        while _SLOT.unpack_from(slots, slot * _SLOT.size)[1]:
+            slot = (slot + 1) & mask
+        _SLOT.pack_into(slots, slot * _SLOT.size, blob_offset + len(blob), len(key))
+        blob += key
+        keys.append(key)
+
+    # Pad after the blob so the slots end, and the prefilter starts, 8-byte aligned
+    padding = b"\0" * (-(blob_offset + len(blob) + len(slots)) % 8)
+    prefilter = DomainPrefilter.build(keys)
+    prefilter_offset = blob_offset + len(blob) + len(padding) + len(slots)
+    prefilter_bytes = prefilter.to_bytes()
+
+    meta = pickle.dumps(compiled, protocol=pickle.HIGHEST_PROTOCOL)
+    meta_offset = prefilter_offset + len(prefilter_bytes)
+    header = _ARTIFACT_HEADER.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION, source_hash, len(keys), slot_count,
+                                   meta_offset, len(meta), prefilter_offset, len(prefilter._words))
+
+    tmp_path = f"{artifact_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(blob)
+        f.write(padding)
+        f.write(slots)
+        f.write(prefilter_bytes)
+        f.write(meta)
+    os.replace(tmp_path, artifact_path)
+    return artifact_path
+
+
+def prefilter_stats(table, samples=100000):
+    """Measured false-positive rate and memory of a DomainHashTable's prefilter.
+
+    The rate is taken over random hostnames that are not in the table, so it
+    is the share of non-tracker suffix probes that still reach the table.
+    """
+    rng = random.Random(PREFILTER_SEED)
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
+    tlds = ("com", "net", "org", "io", "de", "co.uk")
+    probes = []
+    while len(probes) < samples:
+        hostname = "".join(rng.choices(alphabet, k=rng.randint(4, 14))) + "." + rng.choice(tlds)
+        if hostname not in table:
+            probes.append(hostname.encode("utf-8"))
+    prefilter = table.prefilter
+    return {
+        "domains": len(table),
+        "bits_per_domain": 8 * len(prefilter._words) * 8 / max(len(table), 1),
+        "false_positive_rate": prefilter.false_positive_rate(probes),
+        "prefilter_bytes": prefilter.nbytes,
+        "table_bytes": table.nbytes,
+    }
+
+
+def load_rules_artifact(rules_path, artifact_path=None):
+    """Load CompiledRules from the artifact, or None if it is missing or stale"""
+    artifact_path = artifact_path or artifact_path_for(rules_path)
+    try:
+        with open(artifact_path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        magic, version = struct.unpack_from("<4sI", buffer, 0)
+        if magic != ARTIFACT_MAGIC or version != ARTIFACT_VERSION:
+            return None
+        (_, _, source_hash, count, slot_count, meta_offset, meta_length,
+         prefilter_offset, prefilter_words) = _ARTIFACT_HEADER.unpack_from(buffer, 0)
+        if source_hash != _file_sha256(rules_path):
+            return None
+        compiled = pickle.loads(buffer[meta_offset:meta_offset + meta_length])
+        # Header, blob, padding, slots, prefilter words and patterns, meta
+        slots_offset = prefilter_offset - slot_count * _SLOT.size
+        view = memoryview(buffer)[prefilter_offset:meta_offset].cast("Q")
+        prefilter = DomainPrefilter(view[:prefilter_words], view[prefilter_words:])
+        compiled.tracker_domains = DomainHashTable(buffer, count, slot_count, slots_offset, prefilter)
+        return compiled
+    except Exception as e:
+        print(f"Warning: Ignoring unreadable rules artifact {artifact_path}: {e}")
+        return None
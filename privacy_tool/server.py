@@ -1,11 +1,33 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 import json
+import logging
 import os
-from collections import defaultdict
+import queue
+import threading
+import time
 from datetime import datetime, timedelta
+from event_log import SegmentedEventLog, parse_event_time
+from event_store import EventStore, normalize_event
+from rule_index import CompiledRules, LRUCache, load_rules_artifact
+import metrics
 
-LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "events.json")
+LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "events.json")  # Pre-segmentation log
+LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "events")
+LOG_RETENTION_HOURS = 24 * 7
+LOG_COMPACT_AFTER_HOURS = 48
+LOG_BATCH_MAX_EVENTS = 1000  # Largest array accepted by /log/batch
+# Optional SQLite store replacing the log segments (same variable as proxy.py)
+EVENT_DB_PATH = os.environ.get("PRIVACY_GUARD_EVENT_DB")
+STREAM_COALESCE = 0.05  # Seconds changes are gathered before a push
+STREAM_POLL_INTERVAL = 0.5  # Seconds between checks for events written by the proxy
+STREAM_REFRESH_INTERVAL = 60  # Seconds between re-checks of subscribed sites (events ageing out)
+STREAM_KEEPALIVE = 15  # Seconds between keepalive comments on an idle stream
+STREAM_QUEUE_SIZE = 100  # Updates buffered per subscriber before new ones are dropped
+# Rules whose Tracker Radar owners group each site's trackers by company
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules", "combined_rules.json")
+OWNER_CACHE_SIZE = 8192
+OWNER_RELOAD_INTERVAL = 60  # Seconds between checks for updated rules
 
 app = Flask(__name__)
 
@@ -18,131 +40,319 @@ CORS(app, resources={
     }
 })
 
-# === Unified event processing ===
-def normalize_event(event):
-    """Normalize events from different sources (proxy vs extension)"""
-    normalized = {
-        "timestamp": event.get("timestamp", datetime.now().isoformat()),
-        "visited_site": event.get("visited_site", event.get("url", "unknown")).lower().strip(),
-        "hostname": event.get("hostname", event.get("url", "unknown")).lower(),
-        "session": event.get("session", ""),
-        "tracker": event.get("tracker", False),
-        "pii": event.get("pii", False),
-        "pii_types": event.get("pii_types", []),
-        "fingerprinting": event.get("fingerprinting", False),
-        "storage": event.get("storage", False),
-        "source": event.get("source", "extension"),
-        "detail": event.get("detail", ""),
-        "type": event.get("type", "")
+# === Metrics and logging ===
+log = metrics.get_logger("api")
+API_REQUESTS = metrics.counter("privacy_guard_api_requests_total", "API requests by route and status",
+                               ["endpoint", "status"])
+API_SECONDS = metrics.histogram("privacy_guard_api_request_seconds",
+                                "Time to produce each API response (streams: until headers)", ["endpoint"])
+EVENTS_INGESTED = metrics.counter("privacy_guard_api_events_total", "Extension events stored")
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or "unmatched"  # Route names keep the label set small
+    if "request_start" in g:
+        API_SECONDS.observe(time.perf_counter() - g.request_start, endpoint)
+    API_REQUESTS.inc(endpoint, str(response.status_code))
+    return response
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Counters and latency histograms in the Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# === Incremental site statistics ===
+def empty_site_stats():
+    """Stats shape returned for a site with no events"""
+    return {
+        "tracker": 0, "pii": 0, "fingerprinting": 0, "storage": 0,
+        "trackers": [], "pii_types": [], "fingerprint_apis": [],
+        "storage_methods": [], "last_seen": None, "sessions": [], "session_count": 0,
+        "tracker_owners": {}
     }
-    
-    # Handle extension-specific event types
-    if normalized["type"] == "fingerprinting":
-        normalized["fingerprinting"] = True
-    elif normalized["type"] == "storage":
-        normalized["storage"] = True
-    elif normalized["type"] == "pii":
-        normalized["pii"] = True
-    
-    # Clean up visited_site
-    if normalized["visited_site"].startswith("www."):
-        normalized["visited_site"] = normalized["visited_site"][4:]
-    
-    return normalized
 
-# === Load and aggregate site statistics ===
-def load_site_stats(hours_limit=24):
-    """Load site statistics with optional time filtering"""
-    if not os.path.exists(LOG_PATH):
-        print(f"[ERROR] Log file not found: {LOG_PATH}")
-        return {}
-
-    print(f"[INFO] Reading from: {LOG_PATH}")
-    stats = defaultdict(lambda: {
-        "tracker": 0, 
-        "pii": 0, 
-        "fingerprinting": 0, 
-        "storage": 0,
-        "trackers": set(),
-        "pii_types": set(),
-        "fingerprint_apis": set(),
-        "storage_methods": set(),
-        "last_seen": None,
-        "sessions": set(),
-        "unique_events": set()  # Track unique events to avoid duplicates
-    })
-    
-    cutoff_time = datetime.now() - timedelta(hours=hours_limit) if hours_limit else None
-    
-    with open(LOG_PATH, "r") as f:
-        for line in f:
+class TrackerOwnerLookup:
+    """Tracker hostname -> owner display name, from the rules' entity index.
+
+    A hostname costs one domain-table match and one dict lookup, cached per
+    hostname; the rules are reloaded when the rules file changes.
+    """
+
+    def __init__(self, rules_path, reload_interval=OWNER_RELOAD_INTERVAL):
+        self.rules_path = rules_path
+        self.reload_interval = reload_interval
+        self._compiled = None
+        self._mtime = None
+        self._checked = 0
+        self._cache = LRUCache(OWNER_CACHE_SIZE, ttl=24 * 3600)  # Cleared when the rules change
+        self._lock = threading.Lock()
+
+    def _load(self):
+        now = time.time()
+        if now - self._checked < self.reload_interval:
+            return self._compiled
+        self._checked = now
+        try:
+            mtime = os.stat(self.rules_path).st_mtime
+        except OSError:
+            return self._compiled
+        if mtime != self._mtime:
             try:
-                event = json.loads(line.strip())
-                event = normalize_event(event)
-                
-                # Time filtering
-                if cutoff_time:
-                    try:
-                        event_time = datetime.fromisoformat(event["timestamp"].replace('Z', '+00:00'))
-                        if event_time < cutoff_time:
-                            continue
-                    except:
-                        continue
-                
-                site = event["visited_site"]
-                site_stats = stats[site]
-                
-                # Create unique event identifier to avoid duplicates
-                event_key = f"{event['hostname']}_{event['type']}_{event.get('detail', '')}"
-                
-                # Skip if we've already counted this exact event
-                if event_key in site_stats["unique_events"]:
-                    continue
-                
-                site_stats["unique_events"].add(event_key)
-                
-                # Update counters and details
-                if event["tracker"]:
-                    site_stats["tracker"] += 1
-                    site_stats["trackers"].add(event["hostname"])
-                
-                if event["pii"]:
-                    site_stats["pii"] += 1
-                    site_stats["pii_types"].update(event.get("pii_types", []))
-                
-                if event["fingerprinting"]:
-                    site_stats["fingerprinting"] += 1
-                    site_stats["fingerprint_apis"].add(event.get("detail", "unknown"))
-                
-                if event["storage"]:
-                    site_stats["storage"] += 1
-                    site_stats["storage_methods"].add(event.get("detail", "unknown"))
-                
-                # Track sessions and timing
-                if event["session"]:
-                    site_stats["sessions"].add(event["session"])
-                site_stats["last_seen"] = event["timestamp"]
-                
+                compiled = load_rules_artifact(self.rules_path)
+                if compiled is None:
+                    with open(self.rules_path, "r") as f:
+                        compiled = CompiledRules(json.load(f))
+            except (OSError, ValueError) as e:
+                log.warning("Could not load tracker owners from %s: %s", self.rules_path, e)
+                return self._compiled
+            self._compiled, self._mtime = compiled, mtime
+            self._cache.clear()
+        return self._compiled
+
+    def owner(self, hostname):
+        """Owner display name of a tracker hostname, else None"""
+        with self._lock:
+            compiled = self._load()
+        if compiled is None:
+            return None
+        owner = self._cache.get(hostname, False)
+        if owner is False:
+            rule = compiled.tracker_domains.match(hostname)
+            entity = compiled.tracker_entities.get(rule) if rule else None
+            owner = (entity.display_name or None) if entity else None
+            self._cache.put(hostname, owner)
+        return owner
+
+tracker_owners = TrackerOwnerLookup(RULES_PATH)
+
+def build_site_stats(entries):
+    """Stats for a site from its deduplicated event entries, oldest first"""
+    stats = empty_site_stats()
+    trackers, pii_types, fingerprint_apis, storage_methods, sessions = [], [], [], [], []
+    last_seen_epoch = None
+    for (epoch, timestamp, hostname, session, tracker, pii, types,
+         fingerprinting, storage, detail) in entries:
+        if tracker:
+            stats["tracker"] += 1
+            trackers.append(hostname)
+        if pii:
+            stats["pii"] += 1
+            pii_types.extend(types)
+        if fingerprinting:
+            stats["fingerprinting"] += 1
+            fingerprint_apis.append(detail)
+        if storage:
+            stats["storage"] += 1
+            storage_methods.append(detail)
+        if session:
+            sessions.append(session)
+        if last_seen_epoch is None or epoch >= last_seen_epoch:
+            last_seen_epoch = epoch
+            stats["last_seen"] = timestamp
+    stats["trackers"] = list(dict.fromkeys(trackers))
+    # Distinct tracker hosts per owning company
+    for hostname in stats["trackers"]:
+        owner = tracker_owners.owner(hostname)
+        if owner:
+            stats["tracker_owners"][owner] = stats["tracker_owners"].get(owner, 0) + 1
+    stats["pii_types"] = list(dict.fromkeys(pii_types))
+    stats["fingerprint_apis"] = list(dict.fromkeys(fingerprint_apis))
+    stats["storage_methods"] = list(dict.fromkeys(storage_methods))
+    stats["sessions"] = list(dict.fromkeys(sessions))
+    stats["session_count"] = len(stats["sessions"])
+    return stats
+
+class SiteStatsAggregator:
+    """Long-lived per-site statistics kept in per-minute buckets.
+
+    The aggregator tails the log segments inside its retention window (only
+    reading bytes appended since the last refresh) and accepts events logged
+    by this server directly, so a /latest or /current query merges a site's
+    buckets instead of re-parsing the whole log. Buckets older than
+    retention_hours are discarded.
+
+    Within a query window each (hostname, type, detail) key is counted once,
+    at its first occurrence, matching the original log-scan deduplication.
+    Applying the same event twice is therefore harmless, which is why events
+    recorded directly need no bookkeeping when the tail reaches them.
+    """
+
+    BUCKET_SECONDS = 60
+
+    def __init__(self, event_log, retention_hours=24):
+        self.event_log = event_log
+        self.retention_hours = retention_hours
+        self.on_change = None  # Called with a site whenever its stats may have changed
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """Forget all aggregated state and re-read the log on next refresh"""
+        with self._lock:
+            self._sites = {}  # site -> {bucket: {event_key: entry}}
+            self._offsets = {}  # segment path -> (inode, bytes consumed)
+            self._last_prune = 0
+
+    def refresh(self):
+        """Apply events appended to the log since the last refresh"""
+        with self._lock:
+            start = None
+            if self.retention_hours:
+                start = datetime.now() - timedelta(hours=self.retention_hours)
+            segments = self.event_log.segments(start=start)
+            live_paths = {segment["path"] for segment in segments}
+            for path in [p for p in self._offsets if p not in live_paths]:
+                del self._offsets[path]
+            for segment in segments:
+                self._tail(segment["path"])
+
+    def _tail(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._offsets.pop(path, None)
+            return
+        inode, offset = self._offsets.get(path, (stat.st_ino, 0))
+        if inode != stat.st_ino or stat.st_size < offset:
+            offset = 0
+        if stat.st_size == offset:
+            self._offsets[path] = (stat.st_ino, offset)
+            return
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(stat.st_size - offset)
+
+        # Only consume complete lines; a partial last line is read next time
+        end = data.rfind(b"\n") + 1
+        for raw_line in data[:end].splitlines():
+            line = raw_line.strip()
+            if not line:
+                continue
+            try:
+                self._apply(json.loads(line))
             except Exception as e:
-                print(f"[Error] Failed to parse line: {line.strip()}")
-                print(f"Reason: {e}")
+                log.warning("Failed to parse line %r: %s", line.decode(errors="replace"), e)
+        self._offsets[path] = (stat.st_ino, offset + end)
+
+    def record(self, event):
+        """Apply an event logged by this process"""
+        with self._lock:
+            self._apply(event)
+
+    def _apply(self, event):
+        event = normalize_event(event)
+        try:
+            event_time = parse_event_time(event["timestamp"])
+        except Exception:
+            return
+        epoch = event_time.timestamp()
+        if self.retention_hours and epoch < time.time() - self.retention_hours * 3600:
+            return
+
+        bucket = int(epoch // self.BUCKET_SECONDS)
+        entries = self._sites.setdefault(event["visited_site"], {}).setdefault(bucket, {})
+        event_key = f"{event['hostname']}_{event['type']}_{event.get('detail', '')}"
+        if event_key in entries:
+            return
+        if self.on_change is not None:
+            self.on_change(event["visited_site"])
+        entries[event_key] = (
+            epoch, event["timestamp"], event["hostname"], event["session"],
+            bool(event["tracker"]), bool(event["pii"]), tuple(event.get("pii_types", [])),
+            bool(event["fingerprinting"]), bool(event["storage"]), event.get("detail", "unknown")
+        )
+
+    def _prune(self):
+        now = time.time()
+        if not self.retention_hours or now - self._last_prune < self.BUCKET_SECONDS:
+            return
+        self._last_prune = now
+        oldest = int((now - self.retention_hours * 3600) // self.BUCKET_SECONDS)
+        for site in list(self._sites):
+            buckets = self._sites[site]
+            for bucket in [b for b in buckets if b < oldest]:
+                del buckets[bucket]
+            if not buckets:
+                del self._sites[site]
+
+    def _merge(self, buckets, cutoff):
+        entries = []
+        seen_keys = set()
+        for bucket in sorted(buckets):
+            if cutoff is not None and (bucket + 1) * self.BUCKET_SECONDS <= cutoff:
                 continue
+            for event_key, entry in buckets[bucket].items():
+                if event_key in seen_keys or (cutoff is not None and entry[0] < cutoff):
+                    continue
+                seen_keys.add(event_key)
+                entries.append(entry)
+        return build_site_stats(entries) if entries else None
+
+    def _cutoff(self, hours_limit):
+        return time.time() - hours_limit * 3600 if hours_limit else None
+
+    def query(self, hours_limit=24):
+        """Return {site: stats} for events in the last hours_limit hours"""
+        self.refresh()
+        with self._lock:
+            self._prune()
+            cutoff = self._cutoff(hours_limit)
+            stats = {}
+            for site, buckets in self._sites.items():
+                site_stats = self._merge(buckets, cutoff)
+                if site_stats is not None:
+                    stats[site] = site_stats
+            return stats
+
+    def query_site(self, site, hours_limit=1):
+        """Return stats for one site, or None if it has no events in the window"""
+        self.refresh()
+        with self._lock:
+            buckets = self._sites.get(site)
+            if not buckets:
+                return None
+            return self._merge(buckets, self._cutoff(hours_limit))
 
-    # Convert sets to lists for JSON serialization and remove unique_events
-    for site_stats in stats.values():
-        site_stats["trackers"] = list(site_stats["trackers"])
-        site_stats["pii_types"] = list(site_stats["pii_types"])
-        site_stats["fingerprint_apis"] = list(site_stats["fingerprint_apis"])
-        site_stats["storage_methods"] = list(site_stats["storage_methods"])
-        site_stats["sessions"] = list(site_stats["sessions"])
-        site_stats["session_count"] = len(site_stats["sessions"])
-        del site_stats["unique_events"]  # Remove from output
-
-    print(f"\n🔍 Detected {len(stats)} sites in last {hours_limit} hours:")
-    for site_key, site_data in stats.items():
-        total = site_data["tracker"] + site_data["pii"] + site_data["fingerprinting"] + site_data["storage"]
-        print(f"  - [{site_key}]: {total} threats")
-    return dict(stats)
+event_log = SegmentedEventLog(LOG_DIR, retention_hours=LOG_RETENTION_HOURS,
+                              compact_after_hours=LOG_COMPACT_AFTER_HOURS, legacy_path=LOG_PATH)
+site_aggregator = SiteStatsAggregator(event_log)
+
+# With EVENT_DB_PATH set, events are written to and queried from SQLite
+event_store = None
+if EVENT_DB_PATH:
+    event_store = EventStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), EVENT_DB_PATH),
+                             retention_hours=LOG_RETENTION_HOURS)
+
+def store_site_stats(hours_limit, site=None):
+    """Site statistics from the SQLite store (one indexed, grouped query)"""
+    since = time.time() - hours_limit * 3600 if hours_limit else None
+    entries_by_site = {}
+    for visited_site, entry in event_store.first_occurrences(since, site):
+        entries_by_site.setdefault(visited_site, []).append(entry)
+    return {visited_site: build_site_stats(entries) for visited_site, entries in entries_by_site.items()}
+
+# === Load and aggregate site statistics ===
+def load_site_stats(hours_limit=24):
+    """Load site statistics with optional time filtering"""
+    if event_store is not None:
+        stats = store_site_stats(hours_limit)
+    elif hours_limit and hours_limit <= site_aggregator.retention_hours:
+        stats = site_aggregator.query(hours_limit)
+    else:
+        # Window longer than the live aggregator keeps: aggregate the full log once
+        stats = SiteStatsAggregator(event_log, retention_hours=None).query(hours_limit)
+
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("🔍 Detected %d sites in last %s hours", len(stats), hours_limit)
+        for site_key, site_data in stats.items():
+            total = site_data["tracker"] + site_data["pii"] + site_data["fingerprinting"] + site_data["storage"]
+            log.debug("  - [%s]: %d threats", site_key, total)
+    return stats
 
 def generate_site_summary(site_data):
     """Generate a human-readable summary for the site"""
@@ -172,36 +382,220 @@ def generate_site_summary(site_data):
 @app.route("/latest")
 def latest():
     """Get latest site statistics (last 24 hours)"""
-    print(f"[API] /latest endpoint called")
     stats = load_site_stats(24)
-    print(f"[API] Returning stats for {len(stats)} sites")
+    log.debug("/latest returning stats for %d sites", len(stats))
     return jsonify(stats)
 
 @app.route("/current/<hostname>")
 def current_site_session(hostname):
     """Get current session data for active browsing"""
-    print(f"[API] /current/{hostname} endpoint called")
-    
     # Normalize hostname
     normalized_hostname = hostname.lower()
     if normalized_hostname.startswith("www."):
         normalized_hostname = normalized_hostname[4:]
     
-    stats = load_site_stats(1)  # Last hour only
-    
     # Try both original and normalized hostname
-    site_data = stats.get(hostname.lower(), stats.get(normalized_hostname, {
-        "tracker": 0, "pii": 0, "fingerprinting": 0, "storage": 0,
-        "trackers": [], "pii_types": [], "fingerprint_apis": [], 
-        "storage_methods": [], "sessions": [], "session_count": 0
-    }))
-    
-    # Add summary message
-    site_data["summary"] = generate_site_summary(site_data)
+    site_data = current_site_data(hostname.lower(), normalized_hostname)
     
-    print(f"[API] Returning data for {hostname}: {site_data}")
+    log.debug("/current/%s returning %s", hostname, site_data)
     return jsonify(site_data)
 
+def current_site_data(*sites):
+    """Last hour of stats for the first of sites with events, with its summary message (the /current payload)"""
+    site_data = None
+    for site in sites:
+        if event_store is not None:
+            site_data = store_site_stats(1, site).get(site)
+        else:
+            site_data = site_aggregator.query_site(site, 1)
+        if site_data is not None:
+            break
+    if site_data is None:
+        site_data = empty_site_stats()
+    site_data["summary"] = generate_site_summary(site_data)
+    return site_data
+
+# === Live updates (Server-Sent Events) ===
+class SiteUpdateBroker:
+    """Pushes changed /current data to the subscribers of a site.
+
+    Sites are marked as changed when events are ingested here (/log,
+    /log/batch) and when the publisher thread picks up events written by
+    the proxy. Changes are coalesced for STREAM_COALESCE seconds, and each
+    subscriber of a site receives only the fields that differ from the
+    last push. With no subscribers the thread sleeps and nothing is polled.
+    """
+
+    def __init__(self, snapshot, poll_changes):
+        self.snapshot = snapshot  # site -> /current payload
+        self.poll_changes = poll_changes  # Marks sites changed by other processes
+        self._subscribers = {}  # site -> set of queues
+        self._dirty = set()
+        self._last_sent = {}  # site -> payload last pushed
+        self.subscriptions = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="site-updates", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, sites):
+        """Register a queue that receives (site, delta) updates for sites.
+
+        Returns the queue and the current payload of each site; deltas
+        follow on from those.
+        """
+        subscription = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+        with self._condition:
+            for site in sites:
+                self._subscribers.setdefault(site, set()).add(subscription)
+            self.subscriptions += 1
+            self._condition.notify()
+        snapshots = {}
+        for site in sorted(sites):
+            snapshots[site] = self.snapshot(site)
+            with self._condition:
+                self._last_sent.setdefault(site, snapshots[site])
+        return subscription, snapshots
+
+    def unsubscribe(self, subscription):
+        with self._condition:
+            self.subscriptions -= 1
+            for site in list(self._subscribers):
+                self._subscribers[site].discard(subscription)
+                if not self._subscribers[site]:
+                    del self._subscribers[site]
+                    self._last_sent.pop(site, None)
+                    self._dirty.discard(site)
+
+    def mark(self, site):
+        """Note that a site's stats may have changed"""
+        with self._condition:
+            if site in self._subscribers:
+                self._dirty.add(site)
+                self._condition.notify()
+
+    def mark_all(self):
+        """Note that every subscribed site may have changed"""
+        with self._condition:
+            self._dirty.update(self._subscribers)
+            self._condition.notify()
+
+    def _run(self):
+        last_refresh = time.monotonic()
+        while True:
+            with self._condition:
+                while not self._subscribers:
+                    self._condition.wait()
+                if not self._dirty:
+                    self._condition.wait(STREAM_POLL_INTERVAL)
+            try:
+                self.poll_changes()
+            except Exception as e:
+                log.warning("Polling for changes failed: %s", e)
+            time.sleep(STREAM_COALESCE)
+            if time.monotonic() - last_refresh >= STREAM_REFRESH_INTERVAL:
+                # Counts also drop as events leave the one-hour window
+                last_refresh = time.monotonic()
+                self.mark_all()
+            with self._condition:
+                dirty, self._dirty = self._dirty, set()
+            for site in dirty:
+                self._publish(site)
+
+    def _publish(self, site):
+        try:
+            payload = self.snapshot(site)
+        except Exception as e:
+            log.warning("Could not compute update for %s: %s", site, e)
+            return
+        with self._condition:
+            last = self._last_sent.get(site, {})
+            delta = {key: value for key, value in payload.items() if last.get(key) != value}
+            subscribers = list(self._subscribers.get(site, ()))
+            if not delta or not subscribers:
+                return
+            self._last_sent[site] = payload
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait((site, delta))
+            except queue.Full:
+                # Slow client: replace its backlog with the full payload
+                with subscription.mutex:
+                    subscription.queue.clear()
+                subscription.put_nowait((site, payload))
+
+def poll_store_changes():
+    """Mark sites with rows added to the SQLite store since the last poll"""
+    global last_store_id
+    last_store_id, sites = event_store.changed_sites(last_store_id)
+    for site in sites:
+        site_updates.mark(site)
+
+if event_store is not None:
+    last_store_id = event_store.changed_sites(None)[0]
+    site_updates = SiteUpdateBroker(current_site_data, poll_store_changes)
+else:
+    site_updates = SiteUpdateBroker(current_site_data, site_aggregator.refresh)
+    site_aggregator.on_change = site_updates.mark
+metrics.gauge("privacy_guard_stream_subscribers", "Open /stream connections",
+              callback=lambda: site_updates.subscriptions)
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/stream")
+def stream_site_updates():
+    """Server-Sent Events for ?sites=a.com,b.com: a snapshot per site, then deltas as events arrive"""
+    sites = set()
+    for site in request.args.get("sites", "").split(","):
+        site = site.strip().lower()
+        if site.startswith("www."):
+            site = site[4:]
+        if site:
+            sites.add(site)
+    if not sites:
+        return jsonify({"error": "No sites given"}), 400
+    log.info("📡 /stream subscribed to %s", sorted(sites))
+
+    subscription, snapshots = site_updates.subscribe(sites)
+
+    def generate():
+        try:
+            for site, site_data in snapshots.items():
+                yield server_sent_event("snapshot", dict(site_data, site=site))
+            while True:
+                try:
+                    site, delta = subscription.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield server_sent_event("update", dict(delta, site=site))
+        finally:
+            site_updates.unsubscribe(subscription)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def record_extension_events(events):
+    """Normalize extension events and store them with one append (or one transaction)"""
+    now = datetime.now().isoformat()
+    enhanced_events = []
+    for event in events:
+        enhanced_event = normalize_event(event)
+        enhanced_event["timestamp"] = now
+        enhanced_event["source"] = "extension"
+        enhanced_events.append(enhanced_event)
+
+    if event_store is not None:
+        event_store.append(enhanced_events)  # One transaction
+        for site in {enhanced_event["visited_site"] for enhanced_event in enhanced_events}:
+            site_updates.mark(site)
+    else:
+        event_log.append(enhanced_events)
+        for enhanced_event in enhanced_events:
+            site_aggregator.record(enhanced_event)  # Marks changed sites
+    EVENTS_INGESTED.inc(amount=len(enhanced_events))
+    return enhanced_events
+
 @app.route("/log", methods=["POST", "OPTIONS"])
 def log_event():
     """Accept events from browser extension"""
@@ -214,21 +608,37 @@ def log_event():
         if not event:
             return jsonify({"error": "No JSON data provided"}), 400
 
-        print(f"[API] Received event: {event}")
+        enhanced_event = record_extension_events([event])[0]
 
-        # Normalize and enhance event
-        enhanced_event = normalize_event(event)
-        enhanced_event["timestamp"] = datetime.now().isoformat()
-        enhanced_event["source"] = "extension"
+        log.debug("Logged event: %s", enhanced_event)
+        return jsonify({"status": "logged", "normalized": enhanced_event}), 200
 
-        with open(LOG_PATH, "a") as f:
-            f.write(json.dumps(enhanced_event) + "\n")
+    except Exception as e:
+        log.error("Error logging event: %s", e)
+        return jsonify({"error": str(e)}), 500
 
-        print(f"[API] Logged event: {enhanced_event}")
-        return jsonify({"status": "logged", "normalized": enhanced_event}), 200
+@app.route("/log/batch", methods=["POST", "OPTIONS"])
+def log_event_batch():
+    """Accept a JSON array of events buffered by the extension"""
+    if request.method == "OPTIONS":
+        return "", 200
+    
+    try:
+        # force: navigator.sendBeacon posts the array as text/plain
+        events = request.get_json(force=True, silent=True)
+        if isinstance(events, dict):
+            events = events.get("events")
+        if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+            return jsonify({"error": "Expected a JSON array of events"}), 400
+        if len(events) > LOG_BATCH_MAX_EVENTS:
+            return jsonify({"error": f"At most {LOG_BATCH_MAX_EVENTS} events per batch"}), 413
+
+        record_extension_events(events)
+        log.debug("Logged batch of %d events", len(events))
+        return jsonify({"status": "logged", "count": len(events)}), 200
 
     except Exception as e:
-        print(f"[API] Error logging event: {e}")
+        log.error("Error logging event batch: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/clear", methods=["POST", "OPTIONS"])
@@ -238,41 +648,56 @@ def clear_logs():
         return "", 200
         
     try:
-        if os.path.exists(LOG_PATH):
-            os.remove(LOG_PATH)
-        print("[API] Logs cleared")
+        event_log.clear()
+        site_aggregator.reset()
+        if event_store is not None:
+            global last_store_id
+            event_store.clear()
+            last_store_id = 0  # Row ids restart after a full delete
+        site_updates.mark_all()
+        log.info("Logs cleared")
         return jsonify({"status": "cleared"}), 200
     except Exception as e:
-        print(f"[API] Error clearing logs: {e}")
+        log.error("Error clearing logs: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/debug/<hostname>")
 def debug_site(hostname):
     """Debug endpoint to see raw data for a site"""
-    print(f"[DEBUG] Debug endpoint called for {hostname}")
+    # Optional ?hours=N only opens the segments overlapping that window
+    hours = request.args.get("hours", type=float)
+    start = datetime.now() - timedelta(hours=hours) if hours else None
+    if event_store is not None:
+        # The site itself, or the host and its subdomains, via the indexes
+        total, recent = event_store.events_for_host(hostname, start.timestamp() if start else None)
+        return jsonify({
+            "hostname": hostname,
+            "total_events": total,
+            "recent_events": recent,
+            "database": event_store.path
+        })
     
-    if not os.path.exists(LOG_PATH):
+    segments = event_log.segments(start=start)
+    if not segments:
         return jsonify({"error": "No log file found"})
     
     events = []
-    with open(LOG_PATH, "r") as f:
-        for line in f:
-            try:
-                event = json.loads(line.strip())
-                if hostname.lower() in event.get("visited_site", "").lower() or \
-                   hostname.lower() in event.get("hostname", "").lower():
-                    events.append(event)
-            except:
-                continue
+    for event in event_log.read_events(start=start):
+        if hostname.lower() in event.get("visited_site", "").lower() or \
+           hostname.lower() in event.get("hostname", "").lower():
+            events.append(event)
     
     return jsonify({
         "hostname": hostname,
         "total_events": len(events),
         "recent_events": events[-10:],  # Last 10 events
-        "log_file": LOG_PATH
+        "log_dir": LOG_DIR,
+        "segments_scanned": len(segments)
     })
 
 if __name__ == "__main__":
     print("[SERVER] Starting Privacy Guard Flask API with enhanced CORS...")
-    print(f"[SERVER] Log file: {LOG_PATH}")
-    app.run(host='127.0.0.1', port=8081, debug=True)
+    print(f"[SERVER] Log directory: {LOG_DIR}")
+    if event_store is not None:
+        print(f"[SERVER] Event database: {event_store.path}")
+    app.run(host='127.0.0.1', port=8081, debug=True, threaded=True)
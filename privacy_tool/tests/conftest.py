@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules are flat scripts run from privacy_tool/ with relative rule and log paths
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("PRIVACY_GUARD_METRICS_PORT", "0")
@@ -0,0 +1,24 @@
+from body_parsers import get_body_parser
+from proxy import privacy_rules as rules
+
+CONTENT_TYPE = "multipart/form-data; boundary=xyz"
+FILE_BYTES = b"\x89PNG\r\n\x1a\n 123-45-6789 jane@example.com"
+
+
+def multipart(*parts):
+    body = b"".join(b"--xyz\r\nContent-Disposition: form-data; " + head + b"\r\n\r\n" + content + b"\r\n"
+                    for head, content in parts)
+    return body + b"--xyz--\r\n"
+
+
+def test_file_parts_are_not_rewritten():
+    body = multipart((b'name="email"', b"jane@example.com"),
+                     (b'name="email"; filename="contact.png"\r\nContent-Type: image/png', FILE_BYTES))
+    rewritten = rules.sanitize_request_body(body, CONTENT_TYPE)
+    assert rewritten == multipart((b'name="email"', b"[REDACTED]"),
+                                  (b'name="email"; filename="contact.png"\r\nContent-Type: image/png', FILE_BYTES))
+
+
+def test_file_parts_contribute_only_their_field_name():
+    body = multipart((b'name="avatar"; filename="a.png"\r\nContent-Type: image/png', FILE_BYTES))
+    assert list(get_body_parser(CONTENT_TYPE).leaves(body, CONTENT_TYPE)) == [("avatar", None)]
@@ -0,0 +1,31 @@
+import json
+
+from event_store import EventStore
+
+
+def append(path, *events):
+    with open(path, "a") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+
+def event(hostname):
+    return {"timestamp": "2026-10-17T10:00:00", "visited_site": "example.com", "hostname": hostname}
+
+
+def test_import_resumes_a_segment_that_is_still_growing(tmp_path):
+    store = EventStore(str(tmp_path / "events.db"), retention_hours=None)
+    segment = tmp_path / "2026-10-17T10.jsonl"
+    append(segment, event("a.tracker.com"), event("b.tracker.com"))
+    with open(segment, "a") as f:
+        f.write('{"timestamp": "2026-10-17T10:00:01", "hostn')  # Line half-written by the proxy
+
+    assert store.import_log(str(segment)) == 2
+    with open(segment, "a") as f:
+        f.write('ame": "c.tracker.com"}\n')
+    append(segment, event("d.tracker.com"))
+    assert store.import_log(str(segment)) == 2
+    assert store.import_log(str(segment)) == 0
+
+    hostnames = [row[0] for row in store._connection().execute("SELECT hostname FROM events ORDER BY id")]
+    assert hostnames == ["a.tracker.com", "b.tracker.com", "c.tracker.com", "d.tracker.com"]
@@ -0,0 +1,64 @@
+import pytest
+
+import proxy
+from benchmark import make_flow
+
+
+@pytest.fixture
+def events(monkeypatch):
+    logged = []
+    monkeypatch.setattr(proxy, "log_event", logged.append)
+    return logged
+
+
+def send(url, body, referer):
+    flow = make_flow("POST", url, {"Referer": referer, "Content-Type": "text/plain"}, body)
+    proxy.requestheaders(flow)
+    proxy.request(flow)
+    return flow
+
+
+def test_first_party_skips_body_scans_but_not_url_checks(events):
+    flow = send("https://api.example.com/comments?utm_source=news", b"mail jane@example.com",
+                "https://www.example.com/article")
+    assert flow.metadata["inspection_bypass"] == "first_party"
+    assert flow.metadata["body_inspection"] == "skipped"
+    assert [event["tracking_parameters"] for event in events] == [["utm_source"]]
+    assert events[0]["pii"] is False  # The body was not scanned
+    assert flow.request.content == b"mail jane@example.com"
+
+
+def test_whitelisted_host_still_reports_tracking_parameters(events):
+    flow = send("https://www.firefox.com/session?utm_campaign=spring", b"email=jane@example.com",
+                "https://www.firefox.com/")
+    assert flow.metadata["inspection_bypass"] == "whitelist"
+    assert events[0]["tracking_parameters"] == ["utm_campaign"]
+    assert events[0]["pii"] is False
+
+
+def test_host_on_whitelist_and_tracker_list_is_inspected(events):
+    assert proxy.privacy_rules.host_verdict("www.google.com").tracker_rule == "google.com"
+    flow = send("https://www.google.com/log?utm_source=x", b"email=jane@example.com", "https://news.example.com/")
+    assert flow.metadata["inspection_bypass"] is None
+    assert events[0]["pii"] is True
+    assert b"jane@example.com" not in flow.request.content
+
+
+def test_tracker_owner_is_looked_up_once_per_flow(events, monkeypatch):
+    lookups = []
+    lookup = proxy.tracker_owner_fields
+    monkeypatch.setattr(proxy, "tracker_owner_fields", lambda rules, host: lookups.append(host) or lookup(rules, host))
+    flow = make_flow("GET", "https://collector.github.com/p.gif?utm_source=x", {"Referer": "https://github.com/"},
+                     status=200, response_headers={"Content-Type": "image/gif"}, response_content=b"GIF89a")
+    proxy.request(flow)
+    proxy.response(flow)
+    assert len(events) == 2
+    assert lookups == ["collector.github.com"]
+
+
+def test_fingerprinting_host_lookup_ignores_the_port():
+    rules = proxy.PrivacyRules(proxy.privacy_rules.rules_path)
+    detected, detail = rules.detect_fingerprinting("https://api.bluecava.com:8443/v1", "", {})
+    assert detected and detail == "fingerprinting_service_bluecava.com"
+    assert rules.host_cache.get("api.bluecava.com") is not None
+    assert rules.host_cache.get("api.bluecava.com:8443") is None
@@ -0,0 +1,32 @@
+import pytest
+
+from proxy import privacy_rules as rules
+
+
+@pytest.mark.parametrize("pii_type, text, redacted", [
+    ("email", "mail jane.doe@example.com now", "mail [REDACTED] now"),
+    ("phone", "call me at 555-123-4567", "call me at [REDACTED]"),
+    ("ssn", "my ssn 123-45-6789 ok", "my ssn [REDACTED] ok"),
+    ("credit_card", "card 4111 1111 1111 1111 ok", "card [REDACTED] ok"),
+    ("zip_code", "zip 90210 ok", "zip [REDACTED] ok"),
+    ("ip_address", "ip 10.0.0.1", "ip [REDACTED]"),
+    ("url", "see https://example.com/a?b=1 ok", "see [REDACTED] ok"),
+    ("date_mmddyyyy", "born 12/31/1990 ok", "born [REDACTED] ok"),
+    ("license_plate", "plate ABC-1234", "plate [REDACTED]"),
+])
+def test_each_pii_type_is_detected_and_fully_redacted(pii_type, text, redacted):
+    assert pii_type in rules.scan_pii_regex(text)[0]
+    found, result = rules.scan_pii_regex(text, redact=True)
+    assert pii_type in found
+    assert result == redacted
+
+
+def test_longest_overlapping_match_wins():
+    # license_plate also matches "ssn 123", "me 555" and "ip 10"
+    assert rules.scan_pii_regex("my ssn 123-45-6789 ok", redact=True) == (["ssn"], "my ssn [REDACTED] ok")
+    assert rules.scan_pii_regex("ip 10.0.0.1", redact=True) == (["ip_address"], "ip [REDACTED]")
+
+
+def test_leaf_match_must_stand_alone():
+    assert rules.scan_leaf_pii("123-45-6789", redact=True) == (["ssn"], "[REDACTED]")
+    assert rules.scan_leaf_pii("id-123-45-6789x", redact=True) == ([], "id-123-45-6789x")
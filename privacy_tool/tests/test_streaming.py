@@ -0,0 +1,54 @@
+import time
+
+from benchmark import make_flow
+from proxy import STREAM_SCAN_BUDGET, StreamingBodyScanner, privacy_rules as rules, requestheaders
+
+CHUNK = 64 * 1024
+
+
+def stream(scanner, body):
+    out = []
+    for start in range(0, len(body), CHUNK):
+        out.extend(scanner(body[start:start + CHUNK]))
+    out.append(scanner(b""))
+    return b"".join(out)
+
+
+def test_pii_spanning_patterns_is_fully_masked():
+    scanner = StreamingBodyScanner(rules, "text/plain", redact=True)
+    body = b"ssn 123-45-6789 then call 555-123-4567"
+    assert stream(scanner, body) == b"ssn *********** then call ************"
+    assert scanner.pii_types == ["phone", "ssn"]
+
+
+def test_match_across_chunk_boundary_is_masked():
+    scanner = StreamingBodyScanner(rules, "text/plain", redact=True)
+    body = b"x" * (CHUNK - 5) + b" 123-45-6789 " + b"y" * 100
+    out = stream(scanner, body)
+    assert len(out) == len(body)
+    assert b"6789" not in out
+
+
+def test_large_upload_scan_time_stays_within_budget():
+    body = b"log line with nothing to see\n" * 150000  # ~4 MB
+    scanner = StreamingBodyScanner(rules, "text/plain", redact=True)
+    start = time.perf_counter()
+    out = stream(scanner, body)
+    elapsed = time.perf_counter() - start
+    assert out == body
+    assert scanner.scanned < len(body)
+    # The budget plus the chunk that crossed it, with slack for slow machines
+    assert elapsed < STREAM_SCAN_BUDGET + 0.4
+
+
+def test_small_body_without_content_length_is_buffered():
+    flow = make_flow("POST", "https://doubleclick.net/collect", {"Content-Type": "application/json"},
+                     b'{"email": "jane@example.com"}')
+    del flow.request.headers["Content-Length"]  # As HTTP/2 clients often send it
+    requestheaders(flow)
+    assert not flow.request.stream
+    assert "body_inspection" not in flow.metadata
+
+    flow.request.headers["Transfer-Encoding"] = "chunked"
+    requestheaders(flow)
+    assert isinstance(flow.request.stream, StreamingBodyScanner)
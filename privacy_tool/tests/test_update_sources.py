@@ -0,0 +1,80 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from update_trackers import EnhancedTrackerListUpdater
+
+ETAG = '"tds-v1"'
+LAST_MODIFIED = "Mon, 05 Oct 2026 10:00:00 GMT"
+TDS = {"trackers": {"tracker.example": {"owner": {"name": "Example Inc."}, "prevalence": 0.2,
+                                        "categories": ["Analytics"]}}}
+
+
+class TrackerListHandler(BaseHTTPRequestHandler):
+    """Stand-in for the Tracker Radar CDN honouring conditional requests"""
+
+    requests = []
+
+    def do_GET(self):
+        TrackerListHandler.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = json.dumps(TDS).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def tracker_list_url():
+    TrackerListHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TrackerListHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/tds.json"
+    server.shutdown()
+    server.server_close()
+
+
+def make_updater(tmp_path):
+    updater = EnhancedTrackerListUpdater(rules_file=str(tmp_path / "rules.json"), timeout=5)
+    updater.backup_dir = str(tmp_path / "backups")
+    updater.sources_dir = str(tmp_path / "sources")
+    return updater
+
+
+def test_second_run_sends_validators_and_skips_unchanged_source(tmp_path, tracker_list_url):
+    rules = make_updater(tmp_path).get_default_rules()
+    rules["auto_update"]["sources"] = [{"name": "DuckDuckGo Tracker Radar", "url": tracker_list_url,
+                                        "type": "json", "enabled": True}]
+    with open(tmp_path / "rules.json", "w") as f:
+        json.dump(rules, f)
+
+    updater = make_updater(tmp_path)
+    new_domains, validation_passed = updater.run_update()
+    assert validation_passed and new_domains == 1
+    assert "If-None-Match" not in TrackerListHandler.requests[0]
+    with open(tmp_path / "rules.json") as f:
+        source = json.load(f)["auto_update"]["sources"][0]
+    assert source["etag"] == ETAG
+    assert source["last_modified"] == LAST_MODIFIED
+
+    updater = make_updater(tmp_path)
+    sources = updater.get_sources(updater.load_existing_rules())
+    assert updater.download_sources(sources) == ([], ["DuckDuckGo Tracker Radar"])
+    assert TrackerListHandler.requests[1]["If-None-Match"] == ETAG
+    assert TrackerListHandler.requests[1]["If-Modified-Since"] == LAST_MODIFIED
+    artifact = tmp_path / "rules.idx"
+    built = artifact.stat().st_mtime_ns
+    assert make_updater(tmp_path).run_update() == (0, True)
+    assert artifact.stat().st_mtime_ns == built  # Unchanged rules: the artifact is not rebuilt
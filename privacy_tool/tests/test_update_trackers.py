@@ -0,0 +1,101 @@
+import json
+import os
+
+import pytest
+
+import proxy
+from proxy import PrivacyRules
+from rule_index import TrackerEntityIndex, artifact_is_current, artifact_path_for, write_rules_artifact
+from update_trackers import EnhancedTrackerListUpdater
+
+
+@pytest.fixture
+def updater(tmp_path):
+    updater = EnhancedTrackerListUpdater(rules_file=str(tmp_path / "rules.json"))
+    updater.backup_dir = str(tmp_path / "backups")
+    updater.sources_dir = str(tmp_path / "sources")
+    return updater
+
+
+def write_rules(updater, **sections):
+    rules = updater.get_default_rules()
+    rules.update(sections)
+    with open(updater.rules_file, "w") as f:
+        json.dump(rules, f)
+
+
+def test_whitelisted_parent_keeps_specific_tracker_rules(updater):
+    write_rules(updater, tracker_domains=["github.com", "collector.github.com", "ads.example.com", "example.com"],
+                whitelist={"domains": ["github.com"]})
+    assert updater.update_rules_file([])[1]
+
+    with open(updater.rules_file) as f:
+        domains = json.load(f)["tracker_domains"]
+    assert "collector.github.com" in domains
+    assert "ads.example.com" not in domains  # Still collapsed outside the whitelist
+
+    verdict = PrivacyRules(updater.rules_file).host_verdict("collector.github.com")
+    assert verdict.tracker_rule == "collector.github.com"
+    assert verdict.whitelist_rule is None
+
+
+def test_wildcard_tld_entries_are_dropped(updater):
+    assert updater.classify_entry("www.ebay.") == (None, None)
+    assert updater.classify_entry("-click-tracker.") == ("pattern", "-click-tracker.")
+
+    write_rules(updater, tracker_domains=["example.com"], tracker_url_patterns=["www.ebay.", "-click-tracker."])
+    assert updater.update_rules_file([])[1]
+    rules = PrivacyRules(updater.rules_file)
+    assert rules.is_tracker_url("https://www.ebay.com/signin") is None
+    assert rules.is_tracker_url("https://cdn.example.org/x-click-tracker.gif") == "-click-tracker."
+
+
+def test_tracker_owners_carried_over_when_tracker_radar_not_parsed(updater):
+    entities = {"doubleclick.net": ("Google LLC", "Google", "Advertising", 0.6),
+                "delisted.example": ("Example Inc.", "Example", "", 0.1)}
+    write_rules(updater, tracker_domains=["doubleclick.net"], tracker_entities=TrackerEntityIndex.encode(entities))
+    assert updater.update_rules_file([])[1]  # e.g. Tracker Radar answered 304
+
+    with open(updater.rules_file) as f:
+        section = json.load(f)["tracker_entities"]
+    assert TrackerEntityIndex.decode(section) == {"doubleclick.net": entities["doubleclick.net"]}
+
+
+def test_rules_file_is_published_with_a_matching_artifact(updater):
+    write_rules(updater, tracker_domains=["ads.example.com"])
+    assert updater.update_rules_file([])[1]
+    assert artifact_is_current(updater.rules_file)  # Already there when the new JSON appears
+
+
+def test_worker_reload_waits_for_the_artifact_instead_of_writing_it(updater, monkeypatch):
+    write_rules(updater, tracker_domains=["ads.example.com"])
+    PrivacyRules(updater.rules_file)
+    artifact = artifact_path_for(updater.rules_file)
+    built = os.stat(artifact).st_mtime_ns
+    write_rules(updater, tracker_domains=["ads.example.com", "pixel.example.net"])  # Edited, artifact now stale
+
+    monkeypatch.setattr(proxy, "WORKER_INDEX", "1")
+    monkeypatch.setattr(proxy, "RULES_ARTIFACT_WAIT", 0)
+    with pytest.raises(RuntimeError):
+        PrivacyRules(updater.rules_file, reloading=True)
+    assert os.stat(artifact).st_mtime_ns == built
+
+    write_rules_artifact(updater.rules_file)  # As the cluster launcher does
+    assert PrivacyRules(updater.rules_file, reloading=True).host_verdict("pixel.example.net").tracker_rule
+
+
+def test_backup_delta_records_only_changed_tracker_owners(updater):
+    google = ("Google LLC", "Google", "Advertising", 0.6)
+    entities = {"doubleclick.net": google, "google-analytics.com": google}
+    write_rules(updater, tracker_domains=sorted(entities), tracker_entities=TrackerEntityIndex.encode(entities))
+    updater.tracker_entities = dict(entities, **{"doubleclick.net": google[:3] + (0.7,)})
+    assert updater.update_rules_file([])[1]
+
+    delta_file, = updater.list_backup_deltas()
+    delta = updater.load_json(os.path.join(updater.backup_dir, delta_file))
+    assert "tracker_entities" not in delta["rules"]
+    assert delta["entities"] == {"set": {"doubleclick.net": list(google[:3]) + [0.7]}, "removed": []}
+
+    with open(updater.rules_file) as f:
+        assert updater.restore_backup()["tracker_entities"] == json.load(f)["tracker_entities"]
+    assert TrackerEntityIndex.decode(updater.restore_backup(steps_back=1)["tracker_entities"]) == entities
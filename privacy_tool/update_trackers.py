@@ -7,34 +7,227 @@ Downloads and integrates major privacy tracker lists into centralized rules.json
 import requests
 import json
 import re
+import os
 import time
-import shutil
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from rule_index import (DomainSuffixIndex, TrackerEntityIndex, artifact_is_current, load_rules_artifact,
+                        prefilter_stats, write_rules_artifact)
+from filter_engine import parse_filter
+
+DEFAULT_SOURCES = [
+    {"name": "DuckDuckGo Tracker Radar", "url": "https://staticcdn.duckduckgo.com/trackerblocking/v4/tds.json",
+     "type": "json", "enabled": True},
+    {"name": "EasyPrivacy", "url": "https://easylist.to/easylist/easyprivacy.txt",
+     "type": "adblock_filter", "enabled": True},
+    {"name": "Disconnect.me", "url": "https://services.disconnect.me/disconnect-plaintext.json",
+     "type": "json", "enabled": True}
+]
+
+# A filter that names only a host ("||tracker.com^") is a plain tracker domain
+HOST_FILTER = re.compile(r'^\|\|[a-z0-9.-]+\^?$', re.IGNORECASE)
+
+# Hostname validation for the normalization stage
+HOSTNAME_LABEL = re.compile(r'^(?!-)[a-z0-9_-]{1,63}(?<!-)$')
+TOP_LEVEL_LABEL = re.compile(r'^(?:[a-z]{2,63}|xn--[a-z0-9-]{1,59})$')
+FILE_EXTENSIONS = {"js", "gif", "png", "jpg", "jpeg", "svg", "css", "php", "html", "htm",
+                   "aspx", "asp", "cgi", "json", "xml", "swf", "ico", "webp"}
+
+# Sections a backup delta records as changes; the rest are copied whole
+DIFFED_SECTIONS = ("tracker_domains", "tracker_filters", "tracker_entities")
 
 class EnhancedTrackerListUpdater:
-    def __init__(self, rules_file="rules/combined_rules.json"):
+    def __init__(self, rules_file="rules/combined_rules.json", timeout=30):
         self.rules_file = rules_file
         self.new_domains = set()
         self.backup_dir = "rules/backups"
+        self.sources_dir = "rules/sources"
+        # Domains parsed from each source in this run, keyed by URL
+        self.source_domains = {}
+        self.parsed_sources = []
+        self.removed_domains = set()
+        # URL fragment rules found in source lists (kept out of tracker_domains)
+        self.url_patterns = set()
+        # Adblock Plus network filters parsed in this run, keyed by source name
+        self.source_filters = {}
+        # Tracker Radar owner metadata parsed in this run: domain -> (owner, display name, category, prevalence);
+        # None when Tracker Radar was not parsed (unchanged or failed)
+        self.tracker_entities = None
+        self.timeout = timeout
+        # ETag / Last-Modified of sources downloaded in this run, keyed by URL
+        self.source_validators = {}
+        
+        # One pooled session shared by the concurrent downloads
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'PrivacyGuard/3.0 (Educational Research)'
+        self.size_connection_pool(len(DEFAULT_SOURCES))
+        
+    def create_backup(self, previous_rules, new_rules):
+        """Record an update as a delta against the base snapshot.
         
-    def create_backup(self):
-        """Create backup of current rules file"""
-        import os
+        rules/backups/base.json holds one full copy of the rules; every update
+        adds a delta_<timestamp>.json with the domains, filters and tracker
+        owners it added and removed plus the (small) remaining sections it wrote. A running proxy can
+        apply the newest delta instead of reloading the whole list. Once
+        there are more than backup_count deltas the oldest is folded into
+        the base.
+        """
         os.makedirs(self.backup_dir, exist_ok=True)
+        base_path = os.path.join(self.backup_dir, "base.json")
         
-        if os.path.exists(self.rules_file):
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = f"{self.backup_dir}/combined_rules_{timestamp}.json"
-            shutil.copy2(self.rules_file, backup_file)
-            print(f"📁 Created backup: {backup_file}")
-            
-            # Keep only last 5 backups
-            backups = sorted([f for f in os.listdir(self.backup_dir) if f.startswith("combined_rules_")])
-            if len(backups) > 5:
-                for old_backup in backups[:-5]:
-                    os.remove(os.path.join(self.backup_dir, old_backup))
-                    print(f"🗑️ Removed old backup: {old_backup}")
+        if not os.path.exists(base_path):
+            for old_delta in self.list_backup_deltas():
+                os.remove(os.path.join(self.backup_dir, old_delta))
+            self.write_json_atomically(base_path, previous_rules)
+            print(f"📁 Created base snapshot: {base_path}")
+        else:
+            # The rules file was edited by hand since the last update
+            restored = self.restore_backup()
+            if set(restored["tracker_domains"]) != set(previous_rules.get("tracker_domains", [])) or \
+                    restored["tracker_filters"] != previous_rules.get("tracker_filters", {}) or \
+                    self.entity_delta(restored, previous_rules) != {"set": {}, "removed": []} or \
+                    {key: value for key, value in restored.items() if key not in DIFFED_SECTIONS} != \
+                    {key: value for key, value in previous_rules.items() if key not in DIFFED_SECTIONS}:
+                self.write_backup_delta(restored, previous_rules, "manual edit")
+        
+        delta_path = self.write_backup_delta(previous_rules, new_rules, "update")
+        print(f"📁 Created backup delta: {delta_path}")
+        
+        # Keep only the last backup_count deltas
+        backup_count = new_rules.get("auto_update", {}).get("backup_count", 5)
+        deltas = self.list_backup_deltas()
+        if len(deltas) > backup_count:
+            base = self.load_json(base_path)
+            for old_delta in deltas[:-backup_count]:
+                delta_file = os.path.join(self.backup_dir, old_delta)
+                base = self.apply_delta(base, self.load_json(delta_file))
+                os.remove(delta_file)
+                print(f"🗑️ Folded old backup into base: {old_delta}")
+            self.write_json_atomically(base_path, base)
+    
+    def write_backup_delta(self, previous_rules, new_rules, reason):
+        """Write the difference between two rules dicts as a backup delta"""
+        previous_domains = set(previous_rules.get("tracker_domains", []))
+        new_domains = set(new_rules.get("tracker_domains", []))
+        previous_filters = previous_rules.get("tracker_filters", {})
+        new_filters = new_rules.get("tracker_filters", {})
+        filter_delta = {}
+        for name in set(previous_filters) | set(new_filters):
+            before, after = set(previous_filters.get(name, [])), set(new_filters.get(name, []))
+            if before != after:
+                filter_delta[name] = {"added": sorted(after - before), "removed": sorted(before - after)}
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        delta_path = os.path.join(self.backup_dir, f"delta_{timestamp}.json")
+        self.write_json_atomically(delta_path, {
+            "created": datetime.now().isoformat(),
+            "reason": reason,
+            "added": sorted(new_domains - previous_domains),
+            "removed": sorted(previous_domains - new_domains),
+            "filters": filter_delta,
+            "entities": self.entity_delta(previous_rules, new_rules),
+            "rules": {key: value for key, value in new_rules.items() if key not in DIFFED_SECTIONS}
+        })
+        return delta_path
+    
+    def entity_delta(self, previous_rules, new_rules):
+        """Tracker owner entries set (added or changed) and removed between two rules dicts"""
+        before = TrackerEntityIndex.decode(previous_rules.get("tracker_entities"))
+        after = TrackerEntityIndex.decode(new_rules.get("tracker_entities"))
+        return {
+            "set": {domain: list(entity) for domain, entity in sorted(after.items())
+                    if tuple(before.get(domain, ())) != tuple(entity)},
+            "removed": sorted(set(before) - set(after))
+        }
+    
+    def list_backup_deltas(self):
+        """Return backup delta file names, oldest first"""
+        if not os.path.isdir(self.backup_dir):
+            return []
+        return sorted(f for f in os.listdir(self.backup_dir) if f.startswith("delta_") and f.endswith(".json"))
+    
+    def apply_delta(self, rules, delta):
+        """Return the rules produced by applying a backup delta to rules"""
+        domains = set(rules.get("tracker_domains", []))
+        domains.difference_update(delta.get("removed", []))
+        domains.update(delta.get("added", []))
+        filters = {name: set(lines) for name, lines in rules.get("tracker_filters", {}).items()}
+        for name, change in delta.get("filters", {}).items():
+            lines = filters.setdefault(name, set())
+            lines.difference_update(change["removed"])
+            lines.update(change["added"])
+        updated = dict(delta.get("rules", {}))
+        updated["tracker_domains"] = sorted(domains)
+        updated["tracker_filters"] = {name: sorted(lines) for name, lines in filters.items() if lines}
+        # Older deltas carry the whole owner table in "rules" instead
+        if "entities" in delta:
+            entities = TrackerEntityIndex.decode(rules.get("tracker_entities"))
+            for domain in delta["entities"]["removed"]:
+                entities.pop(domain, None)
+            entities.update(delta["entities"]["set"])
+            updated["tracker_entities"] = TrackerEntityIndex.encode(entities)
+        return updated
+    
+    def restore_backup(self, steps_back=0):
+        """Rebuild the rules as of a backup: the newest one, or steps_back updates before it"""
+        rules = self.load_json(os.path.join(self.backup_dir, "base.json"))
+        deltas = self.list_backup_deltas()
+        for delta_file in deltas[:len(deltas) - steps_back]:
+            rules = self.apply_delta(rules, self.load_json(os.path.join(self.backup_dir, delta_file)))
+        return rules
+    
+    def load_json(self, path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    
+    def write_json_atomically(self, path, data):
+        """Write compact JSON to a temp file and rename it over path"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    
+    def source_snapshot_path(self, source):
+        """Path of the domain list a source produced on its last successful run"""
+        slug = re.sub(r'[^a-z0-9]+', '_', source.get("name", source["url"]).lower()).strip('_')
+        return os.path.join(self.sources_dir, f"{slug}.txt")
+    
+    def load_source_snapshot(self, source):
+        """Return the domains a source produced last time (empty if never fetched)"""
+        try:
+            with open(self.source_snapshot_path(source), 'r') as f:
+                return set(line.strip() for line in f if line.strip())
+        except FileNotFoundError:
+            return set()
+    
+    def save_source_snapshots(self):
+        """Store the domain list of every source parsed in this run"""
+        os.makedirs(self.sources_dir, exist_ok=True)
+        for source in self.parsed_sources:
+            path = self.source_snapshot_path(source)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write("".join(domain + "\n" for domain in sorted(self.source_domains[source["url"]])))
+            os.replace(tmp_path, path)
+    
+    def compute_domain_delta(self, existing_domains, sources):
+        """Return (added, removed) tracker domains from the per-source deltas.
+        
+        A domain is removed only when a source listed it last run, no source
+        lists it now and nobody added it by hand (it is in some snapshot).
+        Sources that failed or were not modified keep their last snapshot.
+        """
+        previous_auto, current_auto = set(), set()
+        for source in sources:
+            previous = self.load_source_snapshot(source)
+            previous_auto |= previous
+            current_auto |= self.source_domains.get(source["url"], previous)
+        added = current_auto - existing_domains
+        removed = (existing_domains & previous_auto) - current_auto
+        return added, removed
     
     def load_existing_rules(self):
         """Load existing rules file"""
@@ -59,108 +252,194 @@ class EnhancedTrackerListUpdater:
             "suspicious_form_fields": [],
             "tracking_parameters": [],
             "actions": {"proxy": "sanitize", "extension": "block"},
-            "auto_update": {"enabled": True, "last_update": None},
+            "auto_update": {"enabled": True, "last_update": None,
+                            "sources": [dict(source) for source in DEFAULT_SOURCES]},
             "statistics": {},
             "metadata": {"created_by": "Privacy Guard Enhanced"}
         }
     
-    def download_duckduckgo_trackers(self):
-        """Download DuckDuckGo Tracker Radar database"""
-        print("📡 Downloading DuckDuckGo Tracker Radar...")
-        try:
-            response = requests.get(
-                "https://staticcdn.duckduckgo.com/trackerblocking/v4/tds.json", 
-                timeout=30,
-                headers={'User-Agent': 'PrivacyGuard/3.0 (Educational Research)'}
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            trackers = data.get("trackers", {})
-            added_count = 0
-            for domain, info in trackers.items():
-                clean_domain = self.extract_main_domain(domain)
-                if clean_domain and clean_domain not in self.new_domains:
-                    self.new_domains.add(clean_domain)
-                    added_count += 1
-                    
-            print(f"✅ DuckDuckGo: Added {added_count} new domains")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Failed to download DuckDuckGo list: {e}")
-            return False
+    def get_sources(self, rules):
+        """Return the enabled sources from auto_update.sources (or the defaults)"""
+        sources = rules.get("auto_update", {}).get("sources") or DEFAULT_SOURCES
+        return [source for source in sources if source.get("enabled", True)]
     
-    def download_disconnect_trackers(self):
-        """Download Disconnect.me tracker list"""
-        print("📡 Downloading Disconnect.me tracker list...")
-        try:
-            response = requests.get(
-                "https://services.disconnect.me/disconnect-plaintext.json", 
-                timeout=30,
-                headers={'User-Agent': 'PrivacyGuard/3.0 (Educational Research)'}
-            )
+    def get_source_parser(self, source):
+        """Pick the parser for a source from its name, URL or type"""
+        description = f"{source.get('name', '')} {source.get('url', '')}".lower()
+        if "duckduckgo" in description:
+            return self.parse_duckduckgo_trackers
+        if "disconnect" in description:
+            return self.parse_disconnect_trackers
+        if source.get("type") == "adblock_filter" or "easyprivacy" in description:
+            return self.parse_easyprivacy_list
+        return None
+    
+    def size_connection_pool(self, count):
+        """Pool one connection per concurrently downloaded source"""
+        adapter = HTTPAdapter(pool_connections=max(count, 1), pool_maxsize=max(count, 1))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    
+    def fetch_source(self, source):
+        """Conditionally download one source.
+        
+        Sends the ETag / Last-Modified validators stored for the source and
+        returns (status_code, response); status 304 means unchanged.
+        """
+        headers = {}
+        if source.get("etag"):
+            headers["If-None-Match"] = source["etag"]
+        if source.get("last_modified"):
+            headers["If-Modified-Since"] = source["last_modified"]
+        response = self.session.get(source["url"], timeout=self.timeout, headers=headers)
+        if response.status_code != 304:
             response.raise_for_status()
-            data = response.json()
-            
-            added_count = 0
-            # Parse Disconnect's nested structure
-            categories = data.get("categories", {})
-            for category_name, category_data in categories.items():
-                if isinstance(category_data, list):
-                    for item in category_data:
-                        if isinstance(item, dict):
-                            for company, domains in item.items():
-                                if isinstance(domains, dict):
-                                    for domain_list in domains.values():
-                                        if isinstance(domain_list, list):
-                                            for domain in domain_list:
-                                                clean_domain = self.extract_main_domain(domain)
-                                                if clean_domain and clean_domain not in self.new_domains:
-                                                    self.new_domains.add(clean_domain)
-                                                    added_count += 1
-                                                    
-            print(f"✅ Disconnect.me: Added {added_count} new domains")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Failed to download Disconnect list: {e}")
-            return False
+        return response.status_code, response
     
-    def download_easyprivacy_list(self):
-        """Download EasyPrivacy filter list"""
-        print("📡 Downloading EasyPrivacy list...")
+    def download_sources(self, sources):
+        """Fetch all sources concurrently, then parse the changed ones in order.
+        
+        Returns (successful, unchanged) lists of source names. Validators of
+        successfully parsed sources are kept in self.source_validators.
+        """
+        print(f"📡 Downloading {len(sources)} sources concurrently...")
+        self.size_connection_pool(len(sources))
+        successful, unchanged = [], []
+        with ThreadPoolExecutor(max_workers=max(len(sources), 1)) as pool:
+            futures = [(source, pool.submit(self.fetch_source, source)) for source in sources]
+            for source, future in futures:
+                name = source.get("name", source["url"])
+                try:
+                    status, response = future.result()
+                except Exception as e:
+                    print(f"❌ Failed to download {name}: {e}")
+                    continue
+                
+                if status == 304:
+                    print(f"⏭️ {name}: not modified, skipped")
+                    unchanged.append(name)
+                    continue
+                
+                parser = self.get_source_parser(source)
+                if parser is None:
+                    print(f"⚠️ {name}: no parser for source type {source.get('type')}")
+                    continue
+                try:
+                    parsed_domains, filters = parser(response)
+                    domains, patterns = self.normalize_entries(parsed_domains, collapse=False)
+                except Exception as e:
+                    print(f"❌ Failed to parse {name}: {e}")
+                    continue
+                
+                previous = self.load_source_snapshot(source)
+                print(f"✅ {name}: {len(domains)} domains "
+                      f"(+{len(domains - previous)} / -{len(previous - domains)} since last run)"
+                      + (f", {len(filters)} URL filters" if filters else ""))
+                self.source_filters[name] = filters
+                self.new_domains |= domains
+                self.url_patterns |= patterns
+                self.source_domains[source["url"]] = domains
+                self.parsed_sources.append(source)
+                successful.append(name)
+                self.source_validators[source["url"]] = {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified")
+                }
+        return successful, unchanged
+    
+    def parse_duckduckgo_trackers(self, response):
+        """Return (domains, filters) from the DuckDuckGo Tracker Radar database"""
+        data = response.json()
+        
+        trackers = data.get("trackers", {})
+        owners = data.get("entities", {})
+        domains = set()
+        entities = {}
+        for domain, info in trackers.items():
+            clean_domain = self.extract_main_domain(domain)
+            if clean_domain:
+                domains.add(clean_domain)
+                entity = self.parse_tracker_entity(info, owners)
+                # Several tracker hosts can share a main domain: keep the most prevalent
+                if entity and (clean_domain not in entities or entity[3] > entities[clean_domain][3]):
+                    entities[clean_domain] = entity
+        self.tracker_entities = entities
+        return domains, []
+    
+    def parse_tracker_entity(self, info, owners):
+        """Return (owner, display name, category, prevalence) of a Tracker Radar entry, else None.
+        
+        The display name comes from the entities section when the owner is
+        listed there, so every domain of a company groups under one name.
+        """
+        if not isinstance(info, dict):
+            return None
+        owner = info.get("owner") if isinstance(info.get("owner"), dict) else {}
+        name = owner.get("name", "")
+        listed = owners.get(name) if isinstance(owners.get(name), dict) else {}
+        display_name = listed.get("displayName") or owner.get("displayName") or name
+        categories = info.get("categories") or []
+        category = categories[0] if categories else ""
+        if not name and not category:
+            return None
         try:
-            response = requests.get(
-                "https://easylist.to/easylist/easyprivacy.txt", 
-                timeout=30,
-                headers={'User-Agent': 'PrivacyGuard/3.0 (Educational Research)'}
-            )
-            response.raise_for_status()
-            content = response.text
-            
-            added_count = 0
-            # Parse AdBlock Plus filter format
-            for line in content.split('\n'):
-                line = line.strip()
-                if line and not line.startswith('!') and not line.startswith('['):
-                    # Extract domains from filter rules
+            prevalence = round(float(info.get("prevalence") or 0), 6)
+        except (TypeError, ValueError):
+            prevalence = 0.0
+        return name, display_name, category, prevalence
+    
+    def parse_disconnect_trackers(self, response):
+        """Return (domains, filters) from the Disconnect.me tracker list"""
+        data = response.json()
+        
+        found = set()
+        # Parse Disconnect's nested structure
+        categories = data.get("categories", {})
+        for category_name, category_data in categories.items():
+            if isinstance(category_data, list):
+                for item in category_data:
+                    if isinstance(item, dict):
+                        for company, domains in item.items():
+                            if isinstance(domains, dict):
+                                for domain_list in domains.values():
+                                    if isinstance(domain_list, list):
+                                        for domain in domain_list:
+                                            clean_domain = self.extract_main_domain(domain)
+                                            if clean_domain:
+                                                found.add(clean_domain)
+        return found, []
+    
+    def parse_easyprivacy_list(self, response):
+        """Return (domains, filters) from the EasyPrivacy filter list.
+        
+        Plain "||host^" rules become tracker domains; every other network rule
+        (paths, @@ exceptions, $third-party / $domain= options) is kept verbatim
+        for the proxy's filter engine.
+        """
+        content = response.text
+        
+        domains = set()
+        filters = set()
+        # Parse AdBlock Plus filter format
+        for line in content.split('\n'):
+            line = line.strip()
+            if line and not line.startswith('!') and not line.startswith('['):
+                if HOST_FILTER.match(line):
                     domain = self.extract_domain_from_filter(line)
-                    if domain:
-                        clean_domain = self.extract_main_domain(domain)
-                        if clean_domain and clean_domain not in self.new_domains:
-                            self.new_domains.add(clean_domain)
-                            added_count += 1
-                            
-            print(f"✅ EasyPrivacy: Added {added_count} new domains")
-            return True
-            
-        except Exception as e:
-            print(f"❌ Failed to download EasyPrivacy list: {e}")
-            return False
+                    clean_domain = self.extract_main_domain(domain) if domain else None
+                    if clean_domain:
+                        domains.add(clean_domain)
+                        continue
+                if parse_filter(line):
+                    filters.add(line)
+        return domains, sorted(filters)
     
     def extract_domain_from_filter(self, filter_rule):
         """Extract domain from AdBlock Plus filter rule"""
+        # Exception (@@) and element hiding (##, #@#, #?#) rules name no tracker
+        if filter_rule.startswith('@@') or '#' in filter_rule.split('$')[0]:
+            return None
+        
         # Remove filter syntax
         rule = filter_rule.replace('||', '').replace('^', '').replace('*', '')
         rule = rule.split('$')[0]  # Remove filter options
@@ -211,10 +490,74 @@ class EnhancedTrackerListUpdater:
             
         return domain
     
+    def classify_entry(self, entry):
+        """Classify a tracker list entry.
+        
+        Returns ("domain", hostname) for a valid hostname, ("pattern", fragment)
+        for a URL fragment such as "%2fevent.gif%3f" or "-click-tracker.",
+        and (None, None) for anything else (exception rules, comments, markers).
+        
+        Wildcard-TLD hosts ("www.ebay.", left by "||www.ebay.*/path" filters)
+        are dropped: as URL substrings they match whole first-party sites,
+        and the filter itself is kept in tracker_filters.
+        """
+        if not isinstance(entry, str):
+            return None, None
+        entry = entry.strip().lower()
+        if not entry or entry.startswith(('@@', '!', '[')) or '#' in entry or ' ' in entry:
+            return None, None
+        
+        # A trailing dot is a wildcard TLD ("adservice.google.*"), not a hostname
+        if entry.endswith('.') and all(HOSTNAME_LABEL.match(label) for label in entry[:-1].split('.')):
+            return None, None
+        hostname = entry
+        labels = hostname.split('.')
+        if len(hostname) <= 253 and len(labels) >= 2 and \
+                all(HOSTNAME_LABEL.match(label) for label in labels) and \
+                TOP_LEVEL_LABEL.match(labels[-1]) and labels[-1] not in FILE_EXTENSIONS:
+            return "domain", hostname
+        
+        if len(entry) >= 4 and any(char.isalnum() for char in entry) and \
+                not any(char in entry for char in '<>"\''):
+            return "pattern", entry
+        return None, None
+    
+    def normalize_entries(self, entries, collapse=True, whitelist=()):
+        """Validate list entries and split them into (domains, url_patterns).
+        
+        With collapse, hostnames already covered by a listed parent domain are
+        dropped: the proxy matches subdomains of every listed domain anyway.
+        Hostnames under a whitelisted domain are kept, since only a tracker
+        rule more specific than the whitelist entry overrides it
+        (collector.github.com under github.com).
+        """
+        domains, patterns = set(), set()
+        for entry in entries:
+            kind, value = self.classify_entry(entry)
+            if kind == "domain":
+                domains.add(value)
+            elif kind == "pattern":
+                patterns.add(value)
+        
+        if collapse:
+            whitelisted = DomainSuffixIndex(whitelist)
+            covered = set()
+            for domain in domains:
+                if whitelisted.match(domain):
+                    continue
+                labels = domain.split('.')
+                if any('.'.join(labels[i:]) in domains for i in range(1, len(labels) - 1)):
+                    covered.add(domain)
+            domains -= covered
+        return domains, patterns
+    
     def calculate_statistics(self, rules):
         """Calculate and update statistics"""
         stats = {
             "total_tracker_domains": len(rules.get("tracker_domains", [])),
+            "total_tracker_url_patterns": len(rules.get("tracker_url_patterns", [])),
+            "total_tracker_filters": sum(len(lines) for lines in rules.get("tracker_filters", {}).values()),
+            "total_tracker_entities": len(rules.get("tracker_entities", {}).get("owners", [])),
             "total_pii_patterns": len(rules.get("pii_patterns", [])),
             "total_pii_regex_patterns": len(rules.get("pii_regex_patterns", {})),
             "total_fingerprint_apis": len(rules.get("fingerprinting_apis", [])),
@@ -227,73 +570,162 @@ class EnhancedTrackerListUpdater:
         }
         return stats
     
-    def update_rules_file(self):
-        """Update the rules file with new domains and statistics"""
-        print("📝 Updating centralized rules file...")
+    def update_rules_file(self, sources):
+        """Apply the per-source domain delta to the rules file.
         
-        # Create backup first
-        self.create_backup()
+        Returns (added_domains, validation_passed). The new rules are
+        validated in memory and written compactly to a temp file that is
+        renamed over the rules file, so readers never see a partial write.
+        """
+        print("📝 Updating centralized rules file...")
         
         # Load existing rules
-        rules = self.load_existing_rules()
-        existing_domains = set(rules.get("tracker_domains", []))
+        previous_rules = self.load_existing_rules()
+        rules = dict(previous_rules)
+        existing_domains = set(previous_rules.get("tracker_domains", []))
         
-        # Remove existing domains to get only new ones
-        truly_new_domains = self.new_domains - existing_domains
+        added_domains, removed_domains = self.compute_domain_delta(existing_domains, sources)
         
-        # Update the tracker domains list
-        all_domains = sorted(list(existing_domains.union(self.new_domains)))
+        # Normalize: drop invalid entries, collapse covered subdomains and move
+        # URL fragments to their own list
+        whitelist = previous_rules.get("whitelist", {}).get("domains", [])
+        domains, patterns = self.normalize_entries((existing_domains - removed_domains) | added_domains,
+                                                   whitelist=whitelist)
+        all_domains = sorted(domains)
         rules["tracker_domains"] = all_domains
+        # Earlier patterns are classified again, so entries now rejected are dropped
+        url_patterns = patterns | self.normalize_entries(
+            self.url_patterns | set(previous_rules.get("tracker_url_patterns", [])), collapse=False)[1]
+        rules["tracker_url_patterns"] = sorted(url_patterns)
+        truly_new_domains = domains - existing_domains
+        
+        # Replace the URL filters of every source parsed in this run
+        tracker_filters = dict(previous_rules.get("tracker_filters", {}))
+        for name, filters in self.source_filters.items():
+            if filters:
+                tracker_filters[name] = filters
+            else:
+                tracker_filters.pop(name, None)
+        rules["tracker_filters"] = tracker_filters
+        self.removed_domains = existing_domains - domains
+        
+        # Owners come from Tracker Radar when it was parsed in this run; otherwise
+        # (304 or a failed download) the previous table is carried over. Either
+        # way only domains still listed keep an entry.
+        entities = self.tracker_entities
+        if entities is None:
+            entities = TrackerEntityIndex.decode(previous_rules.get("tracker_entities"))
+        rules["tracker_entities"] = TrackerEntityIndex.encode(
+            {domain: entity for domain, entity in entities.items() if domain in domains})
         
         # Update metadata
         rules["last_updated"] = datetime.now().isoformat()
         rules["version"] = "3.0"
         
         # Update auto_update section
-        if "auto_update" not in rules:
-            rules["auto_update"] = {}
+        rules["auto_update"] = dict(rules.get("auto_update", {}))
         rules["auto_update"]["last_update"] = datetime.now().isoformat()
+        rules["auto_update"]["sources"] = [dict(source) for source in
+                                           rules["auto_update"].get("sources") or DEFAULT_SOURCES]
+        for source in rules["auto_update"]["sources"]:
+            validators = self.source_validators.get(source.get("url"))
+            if validators:
+                source["etag"] = validators["etag"]
+                source["last_modified"] = validators["last_modified"]
         rules["auto_update"]["next_update"] = (datetime.now() + timedelta(hours=24)).isoformat()
         
         # Update statistics
         rules["statistics"] = self.calculate_statistics(rules)
         
-        # Save updated rules
-        with open(self.rules_file, 'w') as f:
-            json.dump(rules, f, indent=2, sort_keys=False)
+        if not self.validate_rules(rules):
+            print("⚠️ Rules file left unchanged")
+            return set(), False
+        
+        self.create_backup(previous_rules, rules)
+        self.publish_rules(rules)
+        self.save_source_snapshots()
             
         print(f"✅ Updated centralized rules file:")
         print(f"   📊 Total domains: {len(all_domains)}")
         print(f"   🆕 Newly added: {len(truly_new_domains)}")
+        print(f"   ➖ Removed: {len(self.removed_domains)} (invalid, covered by a parent or delisted)")
+        print(f"   🔗 URL fragment rules: {len(url_patterns)}")
+        print(f"   🧱 URL filters: {rules['statistics']['total_tracker_filters']}")
+        print(f"   🏢 Tracker owners: {rules['statistics']['total_tracker_entities']} "
+              f"({len(rules.get('tracker_entities', {}).get('domains', {}))} domains attributed)")
         print(f"   📋 Total PII patterns: {rules['statistics']['total_pii_patterns']}")
         print(f"   🔍 Total fingerprint APIs: {rules['statistics']['total_fingerprint_apis']}")
         print(f"   💾 Total storage methods: {rules['statistics']['total_storage_methods']}")
         
-        return truly_new_domains
+        return truly_new_domains, True
+    
+    def validate_rules(self, rules):
+        """Check that a rules dict has every required section"""
+        required_sections = [
+            "tracker_domains", "pii_patterns", "pii_regex_patterns",
+            "fingerprinting_apis", "storage_watch", "actions"
+        ]
+        
+        missing_sections = [section for section in required_sections if section not in rules]
+        if missing_sections:
+            print(f"⚠️ Warning: Missing sections: {missing_sections}")
+            return False
+        
+        print("✅ Rules validation passed")
+        return True
     
     def validate_rules_file(self):
-        """Validate the updated rules file"""
+        """Validate the rules file on disk"""
         try:
-            with open(self.rules_file, 'r') as f:
-                rules = json.load(f)
-            
-            required_sections = [
-                "tracker_domains", "pii_patterns", "pii_regex_patterns",
-                "fingerprinting_apis", "storage_watch", "actions"
-            ]
-            
-            missing_sections = [section for section in required_sections if section not in rules]
-            if missing_sections:
-                print(f"⚠️ Warning: Missing sections: {missing_sections}")
-                return False
-            
-            print("✅ Rules file validation passed")
-            return True
-            
+            return self.validate_rules(self.load_json(self.rules_file))
         except Exception as e:
             print(f"❌ Rules file validation failed: {e}")
             return False
     
+    def publish_rules(self, rules):
+        """Replace the rules file, building its artifact first.
+        
+        Proxy watchers reload when the JSON changes and only map the artifact,
+        so it must already match the new JSON when the rename makes it visible.
+        """
+        raw = json.dumps(rules, separators=(",", ":")).encode("utf-8")
+        self.build_rules_artifact(raw)
+        tmp_path = f"{self.rules_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.rules_file)
+    
+    def build_rules_artifact(self, raw=None):
+        """Write the precompiled rules artifact the proxy loads at startup (unless it is up to date).
+        
+        raw is the JSON about to replace the rules file; without it the file on disk is used.
+        """
+        try:
+            if raw is None and artifact_is_current(self.rules_file):
+                print("⏭️ Rules artifact up to date, not rebuilt")
+                return True
+            artifact_path = write_rules_artifact(self.rules_file, raw=raw)
+            print(f"⚡ Built precompiled rules artifact: {artifact_path}")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to build rules artifact: {e}")
+            return False
+    
+    def report_prefilter(self):
+        """Print the measured prefilter false-positive rate of the current artifact"""
+        try:
+            compiled = load_rules_artifact(self.rules_file)
+            if compiled is not None:
+                stats = prefilter_stats(compiled.tracker_domains)
+                print(f"   🔎 Domain prefilter: {stats['prefilter_bytes'] / 1024:.1f} KiB "
+                      f"({stats['bits_per_domain']:.1f} bits/domain), "
+                      f"{stats['false_positive_rate']:.2%} false positives on non-tracker hosts; "
+                      f"exact table {stats['table_bytes'] / 1024:.1f} KiB for {stats['domains']:,} domains")
+        except Exception as e:
+            print(f"⚠️ Could not measure the domain prefilter: {e}")
+    
     def run_update(self):
         """Run the complete update process"""
         print("🚀 Starting Privacy Guard centralized rules update...")
@@ -302,24 +734,29 @@ class EnhancedTrackerListUpdater:
         start_time = time.time()
         
         # Download from major sources
-        sources_success = []
-        if self.download_duckduckgo_trackers():
-            sources_success.append("DuckDuckGo")
-        if self.download_disconnect_trackers():
-            sources_success.append("Disconnect.me") 
-        if self.download_easyprivacy_list():
-            sources_success.append("EasyPrivacy")
+        sources = self.get_sources(self.load_existing_rules())
+        sources_success, sources_unchanged = self.download_sources(sources)
         
-        # Update rules file
-        new_domains = self.update_rules_file()
+        # Update rules file (nothing to merge when every source was unchanged)
+        if sources_success:
+            new_domains, validation_passed = self.update_rules_file(sources)
+        else:
+            print("📝 No source changed, rules file left as is")
+            new_domains = set()
+            validation_passed = self.validate_rules_file()
         
-        # Validate the updated file
-        validation_passed = self.validate_rules_file()
+        # Precompile the rules so the proxy starts without parsing the JSON
+        # (a rules file written above was already published with its artifact)
+        if validation_passed:
+            self.build_rules_artifact()
+            self.report_prefilter()
         
         elapsed = time.time() - start_time
         print("=" * 60)
         print(f"✅ Update completed in {elapsed:.1f} seconds")
         print(f"📡 Successful sources: {', '.join(sources_success)}")
+        if sources_unchanged:
+            print(f"⏭️ Unchanged sources: {', '.join(sources_unchanged)}")
         print(f"✅ Validation: {'Passed' if validation_passed else 'Failed'}")
         
         if new_domains:
@@ -328,9 +765,11 @@ class EnhancedTrackerListUpdater:
                 print(f"   • {domain}")
             if len(new_domains) > 10:
                 print(f"   ... and {len(new_domains) - 10} more")
+        if self.removed_domains:
+            print(f"\n➖ Removed {len(self.removed_domains)} entries (invalid, covered by a parent or delisted)")
         
         print(f"\n📋 Next steps:")
-        print(f"   1. Restart mitmproxy: mitmdump -s proxy.py -p 8080")
+        print(f"   1. A running proxy reloads the new rules automatically (no restart needed)")
         print(f"   2. Test with: curl http://localhost:8081/latest")
         print(f"   3. Visit tracking-heavy sites to test detection")
         